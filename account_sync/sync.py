@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# keep a local snapshot of the users, services and teams of an account up to date
+# the first run crawls everything. every later run reads the audit records since the previous sync with cursor
+# pagination and re-fetches only the users, services and teams that were created, changed or deleted
+# official api documentation for the audit records - https://developer.pagerduty.com/api-reference/reference/REST/openapiv3.json/paths/~1audit~1records/get
+# the audit records endpoint needs an account with the audit trail feature
+
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import requests
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common import jsoncodec
+from pd_common.autotune import AdaptiveConcurrency, iter_pages
+from pd_common.timestamps import parse_time
+
+base_url = 'https://api.pagerduty.com'
+
+# the audit records can only be read for a window of at most 31 days
+MAX_AUDIT_WINDOW = timedelta(days=31)
+
+# snapshot key (also the root_resource_types[] filter value) -> root resource type in the audit records and the
+# include[] used for the objects
+resource_types = {
+    'users': ('user_reference', 'contact_methods'),
+    'services': ('service_reference', 'integrations'),
+    'teams': ('team_reference', None)
+}
+
+def load_snapshot(file_name):
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, 'rb') as snapshot_fh:
+        return jsoncodec.loads(snapshot_fh.read())
+
+def save_snapshot(snapshot, file_name):
+    # write to a temporary file first, so an interrupted run never leaves a half written snapshot behind
+    with open(file_name + '.tmp', 'w') as snapshot_fh:
+        snapshot_fh.write(jsoncodec.dumps(snapshot))
+    os.replace(file_name + '.tmp', file_name)
+
+def full_sync(session, controller):
+    # remember when the crawl started, changes made during the crawl are picked up by the next incremental sync
+    snapshot = {'synced_until': datetime.now(timezone.utc).isoformat(), 'users': {}, 'services': {}, 'teams': {}}
+    for key, (_, include) in resource_types.items():
+        params = {'include[]': include} if include else {}
+        for page in iter_pages(session, f'{base_url}/{key}', params, controller):
+            for item in page[key]:
+                snapshot[key][item['id']] = item
+        print(f'{key}: {len(snapshot[key])}')
+    return snapshot
+
+def changed_resources(session, snapshot, until):
+    # walk the audit records from the stored cursor (or from the start of the window) and collect the changed ids.
+    # the cursor is saved after every page so that an interrupted sync carries on where it stopped
+    changed = {key: set() for key in resource_types}
+    type_to_key = {audit_type: key for key, (audit_type, _) in resource_types.items()}
+    params = {'since': snapshot['synced_until'], 'until': until, 'limit': 100, 'root_resource_types[]': list(resource_types)}
+    requests_made = 0
+
+    cursor = snapshot.get('audit_cursor')
+    while True:
+        response = session.get(f'{base_url}/audit/records', params=dict(params, cursor=cursor) if cursor else params)
+        response.raise_for_status()
+        requests_made += 1
+        page = jsoncodec.decode_response(response)
+
+        for record in page['records']:
+            root_resource = record['root_resource']
+            key = type_to_key.get(root_resource['type'])
+            if key:
+                changed[key].add(root_resource['id'])
+
+        cursor = page.get('next_cursor')
+        if not cursor:
+            break
+        snapshot['audit_cursor'] = cursor
+        snapshot.setdefault('pending_changes', {})
+        for key, ids in changed.items():
+            snapshot['pending_changes'][key] = sorted(set(snapshot['pending_changes'].get(key, [])) | ids)
+
+    # changes collected before an interruption
+    for key, ids in snapshot.get('pending_changes', {}).items():
+        changed[key].update(ids)
+    return changed, requests_made
+
+def refresh(session, key, object_id):
+    # one request per changed object. a 404 means the object was deleted
+    include = resource_types[key][1]
+    response = session.get(f'{base_url}/{key}/{object_id}', params={'include[]': include} if include else None)
+    if response.status_code == 404:
+        return key, object_id, None
+    response.raise_for_status()
+    return key, object_id, jsoncodec.decode_response(response)[key[:-1]]
+
+def audit_window_too_long(snapshot):
+    # an interrupted sync is resumed with its own until, otherwise the window ends now
+    until = parse_time(snapshot['audit_until']) if snapshot.get('audit_until') else datetime.now(timezone.utc)
+    return until - parse_time(snapshot['synced_until']) > MAX_AUDIT_WINDOW
+
+def incremental_sync(session, snapshot, workers):
+    # an interrupted sync resumes its cursor, which only makes sense for the same time window
+    until = snapshot.get('audit_until') or datetime.now(timezone.utc).isoformat()
+    snapshot['audit_until'] = until
+    changed, requests_made = changed_resources(session, snapshot, until)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(refresh, session, key, object_id) for key, ids in changed.items() for object_id in ids]
+        for future in futures:
+            key, object_id, item = future.result()
+            requests_made += 1
+            if item is None:
+                snapshot[key].pop(object_id, None)
+                print(f'deleted {key[:-1]} {object_id}')
+            else:
+                print(f"{'updated' if object_id in snapshot[key] else 'added'} {key[:-1]} {object_id}")
+                snapshot[key][object_id] = item
+
+    snapshot['synced_until'] = until
+    for key in ('audit_cursor', 'audit_until', 'pending_changes'):
+        snapshot.pop(key, None)
+    return requests_made
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incrementally sync a local snapshot of users, services and teams using the audit records.')
+    parser.add_argument('-k', '--api-key', required=True, help='REST API key from the account. Can be a read-only key.')
+    parser.add_argument('-s', '--snapshot', default='account_snapshot.json', help='snapshot file. default account_snapshot.json')
+    parser.add_argument('--full', action='store_true', help='ignore the snapshot and crawl everything again')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='objects re-fetched concurrently. default 8')
+    args = parser.parse_args()
+
+    with requests.Session() as session:
+        session.headers.update({'Accept': 'application/vnd.pagerduty+json;version=2', 'Authorization': 'Token token=' + args.api_key})
+
+        snapshot = None if args.full else load_snapshot(args.snapshot)
+        if snapshot is not None and audit_window_too_long(snapshot):
+            print(f"the snapshot was synced at {snapshot['synced_until']}, more than 31 days of audit records can not be read. running a full sync")
+            snapshot = None
+        if snapshot is None:
+            controller = AdaptiveConcurrency()
+            snapshot = full_sync(session, controller)
+            print(f'full sync done with {controller.pages} requests')
+        else:
+            try:
+                requests_made = incremental_sync(session, snapshot, args.workers)
+            finally:
+                # keeps the audit cursor of an interrupted run
+                save_snapshot(snapshot, args.snapshot)
+            print(f'incremental sync done with {requests_made} requests')
+
+    save_snapshot(snapshot, args.snapshot)
+    print('users: {}\nservices: {}\nteams: {}\nsnapshot saved in file - {}'.format(len(snapshot['users']), len(snapshot['services']), len(snapshot['teams']), args.snapshot))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# microbenchmarks for pd_common.jsoncodec
+# compares the old ways of decoding a page - json.loads(response.text) and response.json(), both of which turn the
+# body into a str first - with jsoncodec.loads on the raw bytes, and json.dumps with jsoncodec.dumps for the
+# per row encoding of get_incident_details.py.
+# by default the pages are synthetic incident (with first_trigger_log_entries included) and user (with
+# contact_methods included) pages of 100 objects. record real pages with e.g.
+#   curl -H 'Authorization: Token token=KEY' -H 'Accept: application/vnd.pagerduty+json;version=2' \
+#        'https://api.pagerduty.com/incidents?limit=100&include[]=first_trigger_log_entries' > incidents_page.json
+# and pass them with --incidents-page / --users-page
+#
+# usage: python benchmarks/bench_json.py [--incidents-page FILE] [--users-page FILE] [--number 200]
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common import jsoncodec
+from bench_record_memory import make_incident, reference
+
+def make_user(number):
+    user_id = f'PU{number:05d}'
+    contact_methods = [
+        {'id': f'PC{number:05d}{kind}', 'type': f'{kind}_contact_method', 'summary': kind, 'label': 'Work',
+         'address': f'user.{number}@example.com' if kind == 'email' else f'4155550{number % 1000:03d}',
+         'country_code': 1, 'send_short_email': False, 'self': f'https://api.pagerduty.com/users/{user_id}/contact_methods/PC{number:05d}{kind}',
+         'html_url': None}
+        for kind in ('email', 'phone', 'sms')
+    ]
+    return {
+        'name': f'User {number}', 'email': f'user.{number}@example.com', 'time_zone': 'Australia/Sydney', 'color': 'maroon',
+        'avatar_url': 'https://secure.gravatar.com/avatar/0d5b09d9e2316bac29239bf9490b746a.png?d=mm&r=PG', 'billed': True,
+        'role': 'limited_user', 'description': None, 'invitation_sent': True, 'job_title': 'engineer',
+        'teams': [reference('team', f'PT{number % 40:05d}', 'Team')], 'contact_methods': contact_methods,
+        'notification_rules': [reference('notification_rule', f'PN{number:05d}', '0 minutes: channel PC')],
+        'coordinated_incidents': [], 'id': user_id, 'type': 'user', 'summary': f'User {number}',
+        'self': f'https://api.pagerduty.com/users/{user_id}', 'html_url': f'https://acme.pagerduty.com/users/{user_id}'
+    }
+
+def make_incidents_page():
+    incidents = [make_incident(number) for number in range(100)]
+    for incident in incidents:
+        # include[]=first_trigger_log_entries expands the reference into the full log entry
+        incident['first_trigger_log_entry'] = dict(incident['first_trigger_log_entry'], type='trigger_log_entry', created_at=incident['created_at'],
+                                                   channel={'type': 'api', 'summary': incident['title'], 'details': {'host': 'web-001', 'cpu': 95, 'tags': ['prod', 'web']}},
+                                                   agent=incident['service'], service=incident['service'], incident=reference('incident', incident['id'], incident['summary']),
+                                                   contexts=[], event_details={'description': incident['title']})
+    return json.dumps({'incidents': incidents, 'limit': 100, 'offset': 0, 'total': None, 'more': True}).encode()
+
+def make_users_page():
+    return json.dumps({'users': [make_user(number) for number in range(100)], 'limit': 100, 'offset': 0, 'total': None, 'more': True}).encode()
+
+def run(label, statement, number):
+    seconds = min(timeit.repeat(statement, number=number, repeat=5)) / number
+    print(f'  {label:<40} {seconds * 1e6:10.1f} us')
+    return seconds
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the json decode/encode layer.')
+    parser.add_argument('--incidents-page', help='recorded /incidents page (raw response body)')
+    parser.add_argument('--users-page', help='recorded /users page (raw response body)')
+    parser.add_argument('--number', type=int, default=200, help='iterations per measurement. default 200')
+    args = parser.parse_args()
+
+    pages = {
+        'incidents page': open(args.incidents_page, 'rb').read() if args.incidents_page else make_incidents_page(),
+        'users page': open(args.users_page, 'rb').read() if args.users_page else make_users_page()
+    }
+
+    print(f'jsoncodec backend: {jsoncodec.backend}')
+    for name, body in pages.items():
+        print(f'{name} ({len(body) / 1024:.0f} KB)')
+        # response.text / response.json() decode the bytes to str before parsing
+        baseline = run('json.loads(body.decode())', lambda: json.loads(body.decode('utf-8')), args.number)
+        fast = run('jsoncodec.loads(body)', lambda: jsoncodec.loads(body), args.number)
+        print(f'  {"speedup":<40} {baseline / fast:10.1f}x')
+
+    log_entries = [incident['first_trigger_log_entry'] for incident in json.loads(pages['incidents page'])['incidents']]
+    print(f'encoding {len(log_entries)} log entries one by one (get_incident_details.py rows)')
+    baseline = run('json.dumps', lambda: [json.dumps(entry) for entry in log_entries], args.number)
+    fast = run('jsoncodec.dumps', lambda: [jsoncodec.dumps(entry) for entry in log_entries], args.number)
+    print(f'  {"speedup":<40} {baseline / fast:10.1f}x')
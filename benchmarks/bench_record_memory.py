@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# memory benchmark - raw incident dicts vs the compact records from pd_common.records
+# generates incidents shaped like the /incidents list response (nested service, escalation policy, assignments,
+# teams and first trigger log entry references) page by page and measures the memory kept by the list with tracemalloc.
+# the compact records are measured at the full count (1M by default). keeping 1M raw dicts needs several GB,
+# so the raw number is measured on --raw-sample incidents and scaled up linearly unless --raw-sample is set to the full count
+#
+# usage: python benchmarks/bench_record_memory.py [--count 1000000] [--raw-sample 20000]
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.records import project_incident
+
+def reference(kind, object_id, summary):
+    return {
+        'id': object_id,
+        'type': f'{kind}_reference',
+        'summary': summary,
+        'self': f'https://api.pagerduty.com/{kind}s/{object_id}',
+        'html_url': f'https://acme.pagerduty.com/{kind}s/{object_id}'
+    }
+
+def make_incident(number):
+    # a few hundred services and escalation policies shared by all the incidents, like in a real account
+    service_id, ep_id, user_id = f'PS{number % 300:05d}', f'PE{number % 120:05d}', f'PU{number % 800:05d}'
+    incident_id = f'Q{number:013d}'
+    created_at = f'2021-{number % 12 + 1:02d}-{number % 28 + 1:02d}T{number % 24:02d}:{number % 60:02d}:00Z'
+    return {
+        'incident_number': number,
+        'title': f'CPU utilisation above 90% on host web-{number % 500:03d}',
+        'description': f'CPU utilisation above 90% on host web-{number % 500:03d}',
+        'created_at': created_at,
+        'updated_at': created_at,
+        'status': ('triggered', 'acknowledged', 'resolved')[number % 3],
+        'incident_key': f'{number:032x}',
+        'service': reference('service', service_id, f'Service {service_id}'),
+        'assignments': [{'at': created_at, 'assignee': reference('user', user_id, f'User {user_id}')}],
+        'assigned_via': 'escalation_policy',
+        'last_status_change_at': created_at,
+        'resolved_at': None,
+        'first_trigger_log_entry': reference('log_entrie', f'R{number:025d}', 'Triggered through the API.'),
+        'alert_counts': {'all': 1, 'triggered': 1, 'resolved': 0},
+        'is_mergeable': True,
+        'escalation_policy': reference('escalation_policie', ep_id, f'Escalation policy {ep_id}'),
+        'teams': [reference('team', f'PT{number % 40:05d}', 'Team')],
+        'pending_actions': [],
+        'acknowledgements': [],
+        'basic_alert_grouping': None,
+        'alert_grouping': None,
+        'last_status_change_by': reference('service', service_id, f'Service {service_id}'),
+        'incidents_responders': [],
+        'responder_requests': [],
+        'subscriber_requests': [],
+        'urgency': 'high',
+        'id': incident_id,
+        'type': 'incident',
+        'summary': f'[#{number}] CPU utilisation above 90% on host web-{number % 500:03d}',
+        'self': f'https://api.pagerduty.com/incidents/{incident_id}',
+        'html_url': f'https://acme.pagerduty.com/incidents/{incident_id}'
+    }
+
+def measure(count, keep):
+    # build the list one page of 100 incidents at a time, the way the scripts receive them
+    tracemalloc.start()
+    started = time.perf_counter()
+    incidents_list = []
+    for page_start in range(0, count, 100):
+        page = [make_incident(number) for number in range(page_start, min(page_start + 100, count))]
+        incidents_list.extend(keep(incident) for incident in page)
+        del page
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del incidents_list
+    return current, peak, elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memory benchmark for the compact incident records.')
+    parser.add_argument('--count', type=int, default=1000000, help='number of incidents. default 1000000')
+    parser.add_argument('--raw-sample', type=int, default=20000, help='number of raw dicts actually measured. default 20000')
+    args = parser.parse_args()
+
+    raw_sample = min(args.raw_sample, args.count)
+    raw_current, raw_peak, raw_elapsed = measure(raw_sample, lambda incident: incident)
+    scale = args.count / raw_sample
+    compact_current, compact_peak, compact_elapsed = measure(args.count, project_incident)
+
+    mb = 1024 * 1024
+    print(f'incidents: {args.count}')
+    print(f'raw dicts:      {raw_current * scale / mb:10.1f} MB retained, {raw_current / raw_sample:7.0f} bytes/incident'
+          + (f' (measured on {raw_sample}, scaled x{scale:.0f})' if scale != 1 else ''))
+    print(f'compact records:{compact_current / mb:10.1f} MB retained, {compact_current / args.count:7.0f} bytes/incident, '
+          f'{compact_peak / mb:.1f} MB peak, built in {compact_elapsed:.1f}s')
+    print(f'reduction: {raw_current * scale / compact_current:.1f}x')
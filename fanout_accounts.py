@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# run one of the report scripts against many PagerDuty accounts in parallel
+# every account runs in its own process, in its own output directory, with its own rate budget, so the whole
+# fleet finishes in about the time of the slowest account instead of the sum of all of them
+#
+# accounts file format - one account per line, the name is optional and used for the output directory:
+#   account-name,API_KEY
+#   API_KEY
+# lines starting with # are skipped, and the names have to be unique
+#
+# the api key is handed to the script in the PD_API_KEY environment variable, never on its command line where
+# every other user of the machine could read it from the process list
+
+import argparse
+import csv
+import os
+from collections import Counter
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+repository_root = os.path.dirname(os.path.abspath(__file__))
+
+# script, the output files it writes and whether they start with a header row
+reports = {
+    'incidents': ('get_incidents_report/get_incidents_report.py', [('incidents_report.csv', True)]),
+    'users': ('get-users-list-from-account.py', [('user_list.csv', False)]),
+    'services': ('get-services-list-from-account/get-services-list-from-account.py', [('services_and_integratons_list.csv', False)])
+}
+
+def read_accounts(file_name):
+    accounts = []
+    with open(file_name) as accounts_fh:
+        for line in accounts_fh:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name, _, api_key = line.rpartition(',')
+            accounts.append((name.strip() or f'account_{len(accounts) + 1}', api_key.strip()))
+    return accounts
+
+def run_account(name, api_key, script, extra_args, output_dir, rate_budget):
+    account_dir = os.path.join(output_dir, name)
+    os.makedirs(account_dir, exist_ok=True)
+
+    # the scripts read the api key from the environment when --api-key is not given, and the budget is read by
+    # pd_common.autotune in the child process
+    env = dict(os.environ, PD_API_KEY=api_key)
+    if rate_budget:
+        env['PD_RATE_BUDGET'] = str(rate_budget)
+
+    started = time.monotonic()
+    with open(os.path.join(account_dir, 'run.log'), 'w') as log_fh:
+        completed = subprocess.run([sys.executable, os.path.join(repository_root, script)] + extra_args,
+                                   cwd=account_dir, env=env, stdout=log_fh, stderr=subprocess.STDOUT)
+    return name, completed.returncode, time.monotonic() - started
+
+def merge_outputs(accounts, output_files, output_dir):
+    # one file per report output, every row tagged with the account it came from
+    for file_name, has_header in output_files:
+        merged_file_name = os.path.join(output_dir, 'merged_' + file_name)
+        header_written = False
+        with open(merged_file_name, 'w') as merged_fh:
+            merged_csv = csv.writer(merged_fh)
+            for name, _ in accounts:
+                account_file_name = os.path.join(output_dir, name, file_name)
+                if not os.path.exists(account_file_name):
+                    continue
+                with open(account_file_name) as account_fh:
+                    rows = csv.reader(account_fh)
+                    if has_header:
+                        header = next(rows, None)
+                        if header and not header_written:
+                            merged_csv.writerow(['account'] + header)
+                            header_written = True
+                    for row in rows:
+                        merged_csv.writerow([name] + row)
+        print(f'Merged output saved in file - {merged_file_name}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a report against many PagerDuty accounts in parallel.',
+                                     epilog='Arguments after -- are passed on to the report script, e.g. -- --service-ids PXXXXX1')
+    parser.add_argument('-a', '--accounts', required=True, help='file with one "name,api key" line per account')
+    parser.add_argument('-r', '--report', choices=sorted(reports), help='report to run on every account')
+    parser.add_argument('--script', help='run any other script instead of a built-in report. it gets the api key in the PD_API_KEY environment variable')
+    parser.add_argument('--outputs', help='comma separated output files of --script to merge. files are assumed to have a header row')
+    parser.add_argument('-o', '--output-dir', default='fanout_output', help='one sub directory per account is created here. default fanout_output')
+    parser.add_argument('-p', '--processes', type=int, help='number of accounts processed at the same time. default all of them')
+    parser.add_argument('--rate-budget', type=float, help='max requests per minute for every account, e.g. 900. only with --report, the built-in reports apply it')
+    parser.add_argument('--merge', action='store_true', help='also write merged output files with an account column')
+    args, extra_args = parser.parse_known_args()
+
+    if bool(args.report) == bool(args.script):
+        parser.error('one of --report or --script is required')
+    # the budget is applied by pd_common.autotune, which an arbitrary script may not use
+    if args.script and args.rate_budget:
+        parser.error('--rate-budget can only be used with --report')
+    if extra_args and extra_args[0] == '--':
+        extra_args = extra_args[1:]
+
+    if args.report:
+        script, output_files = reports[args.report]
+    else:
+        script = os.path.abspath(args.script)
+        output_files = [(file_name.strip(), True) for file_name in (args.outputs or '').split(',') if file_name.strip()]
+
+    accounts = read_accounts(args.accounts)
+    if not accounts:
+        sys.exit('No accounts found in the accounts file.')
+    # every account writes to the directory named after it
+    duplicates = [name for name, count in Counter(name for name, _ in accounts).items() if count > 1]
+    if duplicates:
+        sys.exit(f'Account names must be unique, found more than once: {", ".join(duplicates)}')
+
+    started = time.monotonic()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.processes or len(accounts)) as pool:
+        futures = [pool.submit(run_account, name, api_key, script, extra_args, args.output_dir, args.rate_budget) for name, api_key in accounts]
+        for future in as_completed(futures):
+            name, returncode, elapsed = future.result()
+            status = 'SUCCESS' if returncode == 0 else f'FAILED (exit code {returncode})'
+            failed += returncode != 0
+            print(f'{name} - {status} in {elapsed:.1f}s - log saved in {os.path.join(args.output_dir, name, "run.log")}')
+
+    if args.merge:
+        merge_outputs(accounts, output_files, args.output_dir)
+
+    print(f'\nTotal accounts: {len(accounts)}\nFailed accounts: {failed}\nTotal time: {time.monotonic() - started:.1f}s')
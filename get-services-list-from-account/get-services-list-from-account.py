@@ -1,14 +1,23 @@
 #!/usr/bin/python3
-# fetch a list of all users on the account and save it to a csv file
+# fetch a list of all services and their integrations on the account and save it to a csv file
+# the pages are fetched in parallel through pd_common.autotune, which also applies the PD_RATE_BUDGET cap
 
 import requests
 import argparse
 import csv
+import os
+import sys
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.autotune import AdaptiveConcurrency, iter_pages
 
 parser = argparse.ArgumentParser(description='Get a list of all services and their integrations on a PagerDuty account.')
-parser.add_argument('-k', '--api-key', required=True, type=str, help='REST API key from the account owner.')
+parser.add_argument('-k', '--api-key', default=os.environ.get('PD_API_KEY'), type=str, help='REST API key from the account owner. Default the PD_API_KEY environment variable.')
 
 args = parser.parse_args()
+if not args.api_key:
+    parser.error('--api-key or the PD_API_KEY environment variable is required')
 
 url = 'https://api.pagerduty.com/services'
 header =    {
@@ -17,21 +26,16 @@ header =    {
                 'Authorization':'Token token=' + args.api_key
             }
 
-## added pagination support
-# switch to max result limit (as specified on PD documentation website)
-limit = 100
-offset = 0
+session = requests.Session()
+session.headers.update(header)
+controller = AdaptiveConcurrency()
 
 # open the csv file
 with open('services_and_integratons_list.csv','w') as output_file:
     csv_file = csv.writer(output_file)
 
-    while True:
-        params = {'include[]': 'integrations', 'limit': limit, 'offset': offset}
-
-        # Get the list of users from PD with their contact emails in JSON
-        services_list = requests.get(url, params=params, headers=header).json()
-
+    # Get the list of services from PD with their integrations, page by page
+    for services_list in iter_pages(session, url, {'include[]': 'integrations'}, controller):
         for service in services_list['services']:
             service_id = service['id']
             service_name = service['name']
@@ -46,8 +50,4 @@ with open('services_and_integratons_list.csv','w') as output_file:
                 # write data to the output csv file - to match existing sql query format
                 csv_file.writerow([service_name,integration_summary,integration_type])
 
-        # condition to break out of infinite while loop
-        if services_list['more'] == True:
-            offset += limit
-        else:
-            break
\ No newline at end of file
+print(controller.summary())
\ No newline at end of file
@@ -1,57 +1,150 @@
 #!/usr/bin/python3
 # fetch a list of all users on the account and save it to a csv file
+# one crawl can also write the contact methods, the team memberships and a JSONL or Parquet dump of the users -
+# every page is handed to all the selected outputs (sinks) as it arrives
 
 import requests
 import argparse
 import csv
+import os
+from pd_common import jsoncodec
+from pd_common.autotune import AdaptiveConcurrency, iter_pages
+
+user_columns = ['id','name','role','email','time_zone','description','job_title','teams']
+
+def parse_columns(value):
+    columns = [column.strip() for column in value.split(',') if column.strip()]
+    unknown = [column for column in columns if column not in user_columns]
+    if unknown or not columns:
+        raise argparse.ArgumentTypeError('unknown column(s) {}, choose from {}'.format(','.join(unknown), ','.join(user_columns)))
+    return columns
+
+def user_row(user, columns):
+    # teams are references, keep their names
+    return [';'.join(team['summary'] for team in user['teams']) if column == 'teams' else user.get(column) for column in columns]
+
+class UsersCsvSink:
+    file_name = 'user_list.csv'
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.output_file = open(self.file_name, 'w')
+        self.csv_file = csv.writer(self.output_file)
+
+    def write(self, users):
+        self.csv_file.writerows(user_row(user, self.columns) for user in users)
+
+    def close(self):
+        self.output_file.close()
+
+class ContactMethodsCsvSink(UsersCsvSink):
+    file_name = 'user_contact_methods.csv'
+
+    def __init__(self, columns):
+        super().__init__(columns)
+        self.csv_file.writerow(['user id', 'user email', 'contact method id', 'type', 'label', 'address'])
+
+    def write(self, users):
+        for user in users:
+            for contact_method in user['contact_methods']:
+                self.csv_file.writerow([user['id'], user['email'], contact_method['id'], contact_method['type'], contact_method.get('label'), contact_method.get('address')])
+
+class TeamsCsvSink(UsersCsvSink):
+    file_name = 'user_teams.csv'
+
+    def __init__(self, columns):
+        super().__init__(columns)
+        self.csv_file.writerow(['user id', 'user email', 'team id', 'team name'])
+
+    def write(self, users):
+        for user in users:
+            for team in user['teams']:
+                self.csv_file.writerow([user['id'], user['email'], team['id'], team['summary']])
+
+class JsonlSink(UsersCsvSink):
+    # the full user objects, contact methods included
+    file_name = 'users.jsonl'
+
+    def write(self, users):
+        self.output_file.writelines(jsoncodec.dumps(user) + '\n' for user in users)
+
+class ParquetSink:
+    # the selected columns, one row group per page. needs pyarrow
+    file_name = 'users.parquet'
+
+    def __init__(self, columns):
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        self.columns = columns
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(self.file_name, self.schema)
+
+    def write(self, users):
+        rows = [user_row(user, self.columns) for user in users]
+        self.writer.write_table(self.pyarrow.Table.from_pydict({column: [row[index] for row in rows] for index, column in enumerate(self.columns)}, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+sinks = {
+    'users': UsersCsvSink,
+    'contact_methods': ContactMethodsCsvSink,
+    'teams': TeamsCsvSink,
+    'jsonl': JsonlSink,
+    'parquet': ParquetSink
+}
 
 parser = argparse.ArgumentParser(description='Get a list of all users on a PagerDuty account.')
-parser.add_argument('-k', '--api-key', required=True, type=str, help='REST API key from the account owner.')
-# TODO: column support for csv files
-#parser.add_argument('-c', '--columns', type=str, choices=['id','name','role','email','time_zone','description','job_title','teams'], 
-#                       default=['id','name','email','role'], help='The columns for the report.')
+parser.add_argument('-k', '--api-key', default=os.environ.get('PD_API_KEY'), type=str, help='REST API key from the account owner. Default the PD_API_KEY environment variable.')
+parser.add_argument('-c', '--columns', type=parse_columns, default=['id','name','role','email'],
+                       help='Comma separated columns for user_list.csv and users.parquet, from {}. default id,name,role,email'.format(','.join(user_columns)))
+parser.add_argument('-o', '--outputs', type=lambda value: value.split(','), default=['users'],
+                       help='Comma separated outputs written in the same crawl: users (user_list.csv), contact_methods (user_contact_methods.csv), '
+                            'teams (user_teams.csv), jsonl (users.jsonl), parquet (users.parquet, needs pyarrow). default users')
+parser.add_argument('--concurrency', type=int, help='Pin the number of parallel page requests. Tuned automatically by default.')
+parser.add_argument('--max-concurrency', type=int, default=16, help='Upper bound for the automatically tuned number of parallel page requests.')
 
 args = parser.parse_args()
+if not args.api_key:
+    parser.error('--api-key or the PD_API_KEY environment variable is required')
+
+unknown_outputs = [output for output in args.outputs if output not in sinks]
+if unknown_outputs:
+    parser.error('unknown output(s) {}, choose from {}'.format(','.join(unknown_outputs), ','.join(sinks)))
 
 url = 'https://api.pagerduty.com/users'
 header =    {
                 'Accept':'application/vnd.pagerduty+json;version=2',
-                'Content-Type': 'application/json', 
+                'Content-Type': 'application/json',
                 'Authorization':'Token token=' + args.api_key
             }
 
 ## added pagination support
-# switch to max result limit (as specified on PD documentation website)
-limit = 100
-offset = 0
+# the pages are fetched in parallel and the number of requests in flight is tuned on the go
+controller = AdaptiveConcurrency(maximum=args.max_concurrency, pinned=args.concurrency)
+params = {'include[]': 'contact_methods'}
 
 # maintain a count
 total_users = 0
 
-# open the csv file
-with open('user_list.csv','w') as output_file:
-    csv_file = csv.writer(output_file)
+# open the output files
+open_sinks = [sinks[output](args.columns) for output in args.outputs]
 
-    while True:
-        params = {'include[]': 'contact_methods', 'limit': limit, 'offset': offset}
+try:
+    with requests.Session() as session:
+        session.headers.update(header)
 
         # Get the list of users from PD with their contact emails in JSON
-        users_list = requests.get(url, params=params, headers=header).json()
-
-        for user in users_list['users']:
-            total_users += 1
-            user_id = user['id']
-            user_name = user['name']
-            user_role = user['role']
-            user_email = user['email']
-
-            # write data to the output csv file
-            csv_file.writerow([user_id,user_name,user_role,user_email])
+        for users_list in iter_pages(session, url, params, controller):
+            total_users += len(users_list['users'])
 
-        # condition to break out of infinite while loop
-        if users_list['more'] == True:
-            offset+=limit
-        else:
-            break
+            # write data to every output file
+            for sink in open_sinks:
+                sink.write(users_list['users'])
+finally:
+    for sink in open_sinks:
+        sink.close()
 
-print('total users in the account: {}'.format(total_users))
+print(controller.summary())
+print('total users in the account: {}\nResults saved in file(s) - {}'.format(total_users, ', '.join(sink.file_name for sink in open_sinks)))
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # Script to fetch the first_trigger_log_entry values for all incidents in a service within a given time frame
 # works on one service only
+# with --enrich the alerts and notes of every incident are fetched as well and streamed to a JSONL file
 
 import argparse
 
@@ -10,6 +11,10 @@ parser.add_argument('--api-key', required=True, type=str, help='REST API key fro
 parser.add_argument('--service', required=True, type=str, help='Service ID from the account.')
 parser.add_argument('--since', required=True, type=str, help='Begin date to fetch the incidents.')
 parser.add_argument('--until', required=True, type=str, help='End date to fetch the incidents.')
+parser.add_argument('--concurrency', type=int, help='Pin the number of parallel page requests. Tuned automatically by default.')
+parser.add_argument('--max-concurrency', type=int, default=16, help='Upper bound for the automatically tuned number of parallel page requests.')
+parser.add_argument('--enrich', action='store_true', help='Also fetch the alerts and notes of every incident into incidents_details_from_SINCE_to_UNTIL.jsonl.')
+parser.add_argument('--enrich-workers', type=int, default=8, help='Incidents enriched at the same time with --enrich. default 8')
 
 args = parser.parse_args()
 
@@ -19,36 +24,53 @@ header =    {
                 'Authorization':'Token token=' + args.api_key
 }
 
-# pagination support - switch to max result limit (as specified on PD documentation website)
-limit = 100
-offset = 0
-
 # maintain a count of the incidents
 total_incidents = 0
 
 # get the lib's for the task
 import requests
 import csv
-import json
+import threading
+from pd_common import jsoncodec
+from pd_common.autotune import AdaptiveConcurrency, iter_pages
+from pd_common.enrichment import IncidentEnricher
 
 file_name = 'incidents_list_from_{}_to_{}.csv'.format(args.since,args.until)
+details_file_name = 'incidents_details_from_{}_to_{}.jsonl'.format(args.since,args.until)
+
+# pagination support - the pages are fetched in parallel and the number of requests in flight is tuned on the go
+controller = AdaptiveConcurrency(maximum=args.max_concurrency, pinned=args.concurrency)
+params = {
+    'include[]': 'first_trigger_log_entries',
+    'service_ids[]': args.service,
+    'since': args.since,
+    'until': args.until
+}
 
-with open(file_name,'w') as output_file:
+details_file = open(details_file_name, 'w') if args.enrich else None
+details_lock = threading.Lock()
+
+def write_details(incident, alerts, notes):
+    # called from the enrichment workers as soon as an incident is done
+    line = jsoncodec.dumps({
+        'incident_number': incident['incident_number'],
+        'id': incident['id'],
+        'title': incident['title'],
+        'alert_count': len(alerts),
+        'alerts': [{'id': alert['id'], 'status': alert['status'], 'created_at': alert['created_at'], 'body': alert.get('body')} for alert in alerts],
+        'notes': [{'created_at': note['created_at'], 'user': note['user']['summary'], 'content': note['content']} for note in notes]
+    })
+    with details_lock:
+        details_file.write(line + '\n')
+        details_file.flush()
+
+with open(file_name,'w') as output_file, requests.Session() as session:
     csv_file = csv.writer(output_file)
+    session.headers.update(header)
+    enricher = IncidentEnricher(session, controller, write_details, workers=args.enrich_workers) if args.enrich else None
 
     # Start looping through the incidents
-    while True:
-        params = {
-            'include[]': 'first_trigger_log_entries',
-            'service_ids[]': args.service, 
-            'since': args.since,
-            'until': args.until,
-            'limit': limit,
-            'offset': offset
-        }
-
-        # make the request
-        incidents_list = requests.get(url, params=params, headers=header).json()
+    for incidents_list in iter_pages(session, url, params, controller):
 
         # print(incidents_list)
 
@@ -62,16 +84,21 @@ with open(file_name,'w') as output_file:
             incident_id = incident['id']
             incident_title = incident['title']
             incident_created_at = incident['created_at']
-            incident_first_trigger_log_entry = json.dumps( incident['first_trigger_log_entry'] )
+            incident_first_trigger_log_entry = jsoncodec.dumps( incident['first_trigger_log_entry'] )
 
             # write the data to the csv file
             csv_file.writerow([incident_number,incident_id,incident_title,incident_created_at,incident_first_trigger_log_entry])
 
-        # condition to break out of infinite while loop
-        if incidents_list['more'] == True:
-            offset+=limit
-        else:
-            break
+            # queue the alerts and notes requests while the crawl goes on
+            if enricher:
+                enricher.submit(incident)
+
+    if enricher:
+        enricher.close()
+        details_file.close()
 
 # print some stats on the screen
-print('total incidents fetched: {}\nResults saved in file - {}'.format(total_incidents, file_name))
\ No newline at end of file
+print(controller.summary())
+print('total incidents fetched: {}\nResults saved in file - {}'.format(total_incidents, file_name))
+if enricher:
+    print('{}\nDetails saved in file - {}'.format(enricher.summary(), details_file_name))
@@ -4,71 +4,250 @@
 
 import argparse
 import requests
-import json
 import csv
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
 
-def get_incidents(session, service_ids=False):
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.autotune import AdaptiveConcurrency, get_page, iter_pages
+from pd_common import jsoncodec
+from pd_common.incident_store import IncidentStore, incident_record
+from pd_common.records import project_incident
+from pd_common.references import ReferenceResolver, enrich_names
+from pd_common.profiling import Profiler
+from pd_common.timestamps import parse_time
+
+def get_incidents(session, service_ids=False, controller=None):
     # handle pagination - incidents endpoint does not support cursor based pagination. using classic pagination
     # more details about pagination here - https://developer.pagerduty.com/docs/rest-api-v2/pagination
-    limit, offset, more, total = 100, 0, True, False
+    # the pages are fetched in parallel, the controller tunes how many requests are in flight
+    if controller is None:
+        controller = AdaptiveConcurrency()
 
     if service_ids:
         service_ids = service_ids.split(",")
 
     # define the parameters for the requests get call
-    querystring = {"service_ids[]": service_ids, "total": total, "limit": limit, "offset": offset, "time_zone": "UTC"}
+    querystring = {"service_ids[]": service_ids, "time_zone": "UTC"}
 
+    # every page is projected into compact records straight away, the raw api dicts are not kept around
     incidents_list = []
     try:
-        while more:
-            incidents_list_batch = json.loads(session.get('https://api.pagerduty.com/incidents', params=querystring).text)
-            incidents_list.extend(incidents_list_batch['incidents'])
-            offset += limit
-            more = incidents_list_batch['more']
+        for incidents_list_batch in iter_pages(session, 'https://api.pagerduty.com/incidents', querystring, controller):
+            incidents_list.extend(project_incident(incident) for incident in incidents_list_batch['incidents'])
 
+        print(controller.summary())
         return incidents_list
 
     except Exception as ex:
         print(f'An exception occured while connecting to the PagerDuty account. Exception details - {str(ex)}')
         return False
 
-def generate_csv_report(incidents_list):
+def get_open_incidents_from_store(store_file, service_ids=False):
+    # answer from the local webhook fed store instead of crawling the api
+    if service_ids:
+        service_ids = service_ids.split(",")
+
+    return [incident_record(row) for row in IncidentStore(store_file).open_incidents(service_ids)]
+
+def emit_incident_change(incident, previous_status, observed_at):
+    # one JSON line per new or changed incident, flushed straight away for the tools reading from stdout
+    change = {
+        'event': 'new' if previous_status is None else 'changed',
+        'observed_at': observed_at,
+        'id': incident['id'],
+        'incident_number': incident['incident_number'],
+        'status': incident['status'],
+        'previous_status': previous_status,
+        'title': incident['title'],
+        'urgency': incident.get('urgency'),
+        'service': incident['service']['summary'] if incident.get('service') else None,
+        'created_at': incident['created_at'],
+        'last_status_change_at': incident['last_status_change_at'],
+        'html_url': incident['html_url']
+    }
+    sys.stdout.write(jsoncodec.dumps(change) + '\n')
+    sys.stdout.flush()
+
+def poll_incidents(session, url, service_ids, index, since, full, controller, observed_at):
+    # one poll of --follow, returns the since of the next poll.
+    # the incidents created since the newest last status change seen so far are listed on every poll. the api
+    # filters on the creation time, so a status change of an older incident only shows up in the full list of the
+    # open incidents, which is fetched on the `full` polls
+    queries = [{"service_ids[]": service_ids, "since": since.isoformat(), "until": datetime.now(timezone.utc).isoformat(), "time_zone": "UTC"}]
+    if full:
+        queries.append({"service_ids[]": service_ids, "statuses[]": ["triggered", "acknowledged"], "date_range": "all", "time_zone": "UTC"})
+
+    seen = set()
+    next_since = since
+    for querystring in queries:
+        for incidents_list_batch in iter_pages(session, url, querystring, controller):
+            for incident in incidents_list_batch['incidents']:
+                if incident['id'] in seen:
+                    continue
+                seen.add(incident['id'])
+                next_since = max(next_since, parse_time(incident['last_status_change_at']))
+
+                state = (incident['status'], incident['last_status_change_at'])
+                previous = index.get(incident['id'])
+                if previous != state:
+                    emit_incident_change(incident, previous[0] if previous else None, observed_at)
+                index[incident['id']] = state
+
+    if not full:
+        return next_since
+
+    # incidents which were open and are now gone from both lists were resolved in the meantime
+    for incident_id, (status, _) in list(index.items()):
+        if incident_id in seen:
+            continue
+        if status != 'resolved':
+            try:
+                incident = get_page(session, f'{url}/{incident_id}', {}, controller)['incident']
+                if incident['status'] != status:
+                    emit_incident_change(incident, status, observed_at)
+            except requests.HTTPError as ex:
+                print(f'could not look up incident {incident_id} - {ex}', file=sys.stderr)
+        del index[incident_id]
+    return next_since
+
+def follow_incidents(session, service_ids=False, interval=5, window=3600, controller=None, resync=12):
+    # live tail - print only the incidents which are new or changed since the previous poll.
+    # the first poll looks `window` seconds back, every later one starts at the newest last status change seen so
+    # far, and every `resync` polls the open incidents are listed in full as well.
+    # the index holds incident id -> (status, last status change at) and only keeps open incidents and the ones
+    # seen since the previous full poll, so it stays small however long the script runs.
+    # a failed poll is logged on stderr and retried at the next interval
+    if controller is None:
+        controller = AdaptiveConcurrency()
+
+    if service_ids:
+        service_ids = service_ids.split(",")
+
+    url = 'https://api.pagerduty.com/incidents'
+    index = {}
+    since = datetime.now(timezone.utc) - timedelta(seconds=window)
+    polls = 0
+    while True:
+        poll_started = time.monotonic()
+        observed_at = datetime.now(timezone.utc).isoformat()
+        try:
+            since = poll_incidents(session, url, service_ids, index, since, polls % resync == 0, controller, observed_at)
+            polls += 1
+        except requests.RequestException as ex:
+            print(f'poll failed, retrying in {interval} seconds - {ex}', file=sys.stderr)
+
+        time.sleep(max(0, interval - (time.monotonic() - poll_started)))
+
+def link(reference):
+    return reference.html_url if reference else None
+
+def name(reference):
+    return reference.name if reference else None
+
+def generate_csv_report(incidents_list, with_names=False):
     # incidents reponse fields can be seen from the official documentation here - https://developer.pagerduty.com/api-reference/reference/REST/openapiv3.json/paths/~1incidents/get
     # displaying -> number, id, status, title, service link, ep link, created_at, last_status_change_by, 
+    # and with_names -> service name, ep name, last status change by name
 
     incidents_data = []
-    # fetch the data from the json and nicely place them in vars for readibility
+    # fetch the data from the records and nicely place them in vars for readibility
     for incident in incidents_list:
-        incident_number = incident['incident_number']
-        incident_id = incident['id']
-        incident_status = incident['status']
-        incident_title = incident['title']
-        service_link = incident['service']['html_url']
-        ep_link = incident['escalation_policy']['html_url']
-        incident_created_at = incident['created_at']
-        incident_last_status_change_by = incident['last_status_change_by']['html_url']
-        incident_last_status_change_at = incident['last_status_change_at']
+        incident_number = incident.incident_number
+        incident_id = incident.id
+        incident_status = incident.status
+        incident_title = incident.title
+        service_link = link(incident.service)
+        ep_link = link(incident.escalation_policy)
+        incident_created_at = incident.created_at
+        incident_last_status_change_by = link(incident.last_status_change_by)
+        incident_last_status_change_at = incident.last_status_change_at
         # keep appending the data to the list which will be written to the csv file in the next step
-        incidents_data.append([incident_number, incident_id, incident_status, incident_title, service_link, ep_link, incident_created_at, incident_last_status_change_by, incident_last_status_change_at])
+        row = [incident_number, incident_id, incident_status, incident_title, service_link, ep_link, incident_created_at, incident_last_status_change_by, incident_last_status_change_at]
+        if with_names:
+            row += [name(incident.service), name(incident.escalation_policy), name(incident.last_status_change_by)]
+        incidents_data.append(row)
 
     # write to csv file
     with open('incidents_report.csv','w') as csv_fh:
         csv_file = csv.writer(csv_fh)
         # write the headers
-        csv_file.writerow(['incident number', 'incident id', 'incident status', 'incident title', 'service', 'escalation policy', 'created at', 'last status change by', 'last status change at'])
+        headers = ['incident number', 'incident id', 'incident status', 'incident title', 'service', 'escalation policy', 'created at', 'last status change by', 'last status change at']
+        if with_names:
+            headers += ['service name', 'escalation policy name', 'last status change by name']
+        csv_file.writerow(headers)
         csv_file.writerows(incidents_data)
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Generate the incidents report.', epilog='Find more details in the accompanying README.md')
-    parser.add_argument('--api-key', '-k', type=str, required=True, help='Global API key of your PagerDuty account')
-    parser.add_argument('--service-ids', '-s', type=str, required=False, help='Optionally you may supply a Service ID to generate a report for the supplied Service ID. You may supply more than one Service ID associated with your account seperated by commas, example PXXXXX1,PXXXXX2')
-    args = parser.parse_args()
+def resolve_names(session, incidents_list, prefetch=False, controller=None):
+    # most names come for free with the reference summaries, only the references without one are looked up -
+    # once per distinct service, escalation policy or user
+    resolver = ReferenceResolver(session)
+    looked_up = enrich_names(incidents_list, resolver, prefetch=prefetch, controller=controller)
+    print(f'names looked up for {looked_up} references without a summary, {resolver.requests} requests')
+
+def main(args):
+    if args.from_store:
+        with profiler.phase('fetch'):
+            incidents_list = get_open_incidents_from_store(args.from_store, args.service_ids)
+        if incidents_list and args.with_names and args.api_key:
+            with requests.Session() as session, profiler.phase('transform'):
+                session.headers.update({"Accept": "application/vnd.pagerduty+json;version=2", "Authorization": "Token token={}".format(args.api_key)})
+                resolve_names(session, incidents_list, args.prefetch)
+        if incidents_list:
+            with profiler.phase('write'):
+                generate_csv_report(incidents_list, args.with_names)
+        else:
+            print('\nNo open incidents found in the incident store.')
+        return
 
     with requests.Session() as session:
         session.headers.update({"Accept": "application/vnd.pagerduty+json;version=2", "Content-Type": "application/json", "Authorization": "Token token={}".format(args.api_key)})
-        incidents_list = get_incidents(session, args.service_ids)
+        controller = AdaptiveConcurrency(maximum=args.max_concurrency, pinned=args.concurrency)
+
+        if args.follow:
+            try:
+                follow_incidents(session, args.service_ids, args.interval, args.window, controller, args.resync)
+            except KeyboardInterrupt:
+                sys.exit(0)
+
+        with profiler.phase('fetch'):
+            incidents_list = get_incidents(session, args.service_ids, controller)
+        if incidents_list and args.with_names:
+            with profiler.phase('transform'):
+                resolve_names(session, incidents_list, args.prefetch, controller)
 
     if incidents_list:
-        generate_csv_report(incidents_list)
+        with profiler.phase('write'):
+            generate_csv_report(incidents_list, args.with_names)
     else:
-        print('\nIncidents report could not be generated.')
\ No newline at end of file
+        print('\nIncidents report could not be generated.')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate the incidents report.', epilog='Find more details in the accompanying README.md')
+    parser.add_argument('--api-key', '-k', type=str, default=os.environ.get('PD_API_KEY'), help='Global API key of your PagerDuty account. Default the PD_API_KEY environment variable.')
+    parser.add_argument('--service-ids', '-s', type=str, required=False, help='Optionally you may supply a Service ID to generate a report for the supplied Service ID. You may supply more than one Service ID associated with your account seperated by commas, example PXXXXX1,PXXXXX2')
+    parser.add_argument('--concurrency', type=int, required=False, help='Pin the number of parallel page requests. By default it is tuned automatically and the settled value is printed at the end of the run.')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Upper bound for the automatically tuned number of parallel page requests. Default 16.')
+    parser.add_argument('--from-store', type=str, required=False, help='Report the open incidents from a local incident store kept by incident_webhook_store/receiver.py instead of crawling the account. --api-key is not used.')
+    parser.add_argument('--follow', '-f', action='store_true', help='Keep polling and print new or changed incidents as JSON lines on stdout instead of writing the report.')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between two polls in --follow mode. Default 5.')
+    parser.add_argument('--window', type=int, default=3600, help='Seconds the first poll looks back in --follow mode. Default 3600.')
+    parser.add_argument('--resync', type=int, default=12, help='List all the open incidents every this many polls in --follow mode, to catch the status changes of older incidents. Default 12.')
+    parser.add_argument('--with-names', action='store_true', help='Add the service, escalation policy and last status change by names to the report.')
+    parser.add_argument('--prefetch', action='store_true', help='With --with-names, fetch all the services, escalation policies and users up front instead of looking up the missing names one by one.')
+    parser.add_argument('--profile', nargs='?', const='profile', help='Profile the fetch, decode, transform and write phases of the run into this directory. Default profile.')
+    args = parser.parse_args()
+
+    if not args.from_store and not args.api_key:
+        parser.error('--api-key or the PD_API_KEY environment variable is required')
+
+    # decoding and the projection into records happen inside the fetch phase, the sampled stacks are split out
+    profiler = Profiler(args.profile, attribute={'jsoncodec.py': 'decode', 'records.py': 'transform'})
+    # the profile is written even when the run fails half way
+    try:
+        main(args)
+    finally:
+        profiler.close()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# find the noisiest services, escalation policies and the most repeated incident titles in an incident stream
+# reads incidents straight from the api (page by page) or from an incidents_report.csv written by get_incidents_report.py
+# and keeps a bounded space-saving summary per dimension, so memory does not grow with the number of incidents.
+# the counts are exact while a dimension has fewer distinct values than --capacity, otherwise every count is an
+# over-estimate by at most the printed error bound. the running top N is printed every --every incidents.
+# the api can only page through the first 10000 incidents of a query, so the period is crawled in time windows
+# and a window holding more incidents than that is split in two until every part fits
+
+import argparse
+import csv
+import heapq
+import os
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+import requests
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.autotune import MAX_OFFSET, AdaptiveConcurrency, iter_pages
+from pd_common.timestamps import parse_time
+
+# the incidents list accepts at most 6 months between since and until
+MAX_WINDOW = timedelta(days=180)
+
+class SpaceSaving:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.counters = {}
+        # min heap of (count, key) with stale entries skipped lazily
+        self.heap = []
+
+    def add(self, key):
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += 1
+            return
+
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [1, 0]
+            heapq.heappush(self.heap, (1, key))
+            return
+
+        # replace the smallest counter, the new key inherits its count as the error bound
+        while True:
+            count, smallest = heapq.heappop(self.heap)
+            current = self.counters.get(smallest)
+            if current is None:
+                continue
+            if current[0] != count:
+                heapq.heappush(self.heap, (current[0], smallest))
+                continue
+            break
+        del self.counters[smallest]
+        self.counters[key] = [count + 1, count]
+        heapq.heappush(self.heap, (count + 1, key))
+
+        # drop the stale entries once the heap grows well past the number of counters
+        if len(self.heap) > self.capacity * 4:
+            self.heap = [(counter[0], key) for key, counter in self.counters.items()]
+            heapq.heapify(self.heap)
+
+    def top(self, n):
+        return sorted(((key, count, error) for key, (count, error) in self.counters.items()), key=lambda item: -item[1])[:n]
+
+def normalize_title(title):
+    # group titles which only differ by ids, numbers, hosts numbering etc
+    title = title.lower()
+    title = re.sub(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', '<uuid>', title)
+    title = re.sub(r'\b[0-9a-f]{12,}\b', '<hex>', title)
+    title = re.sub(r'\d+', '#', title)
+    return re.sub(r'\s+', ' ', title).strip()
+
+def incidents_from_csv(file_name):
+    # the api crawl counts names, so the name columns of a --with-names report are used when it has them
+    with open(file_name) as csv_fh:
+        reader = csv.DictReader(csv_fh)
+        service_column = 'service name' if 'service name' in reader.fieldnames else 'service'
+        escalation_policy_column = 'escalation policy name' if 'escalation policy name' in reader.fieldnames else 'escalation policy'
+        for row in reader:
+            yield row[service_column], row[escalation_policy_column], row['incident title']
+
+def window_pages(session, querystring, since, until, controller):
+    # the pages of the incidents created in [since, until), split in halves while a window matches too many
+    pages = iter_pages(session, 'https://api.pagerduty.com/incidents', dict(querystring, since=since.isoformat(), until=until.isoformat()), controller)
+    first_page = next(pages)
+    if (first_page.get('total') or 0) > MAX_OFFSET and until - since > timedelta(seconds=1):
+        pages.close()
+        middle = since + (until - since) / 2
+        yield from window_pages(session, querystring, since, middle, controller)
+        yield from window_pages(session, querystring, middle, until, controller)
+        return
+    yield first_page
+    yield from pages
+
+def incidents_from_api(api_key, service_ids, since, until):
+    querystring = {"service_ids[]": service_ids.split(",") if service_ids else None, "time_zone": "UTC"}
+    controller = AdaptiveConcurrency()
+    with requests.Session() as session:
+        session.headers.update({"Accept": "application/vnd.pagerduty+json;version=2", "Authorization": "Token token={}".format(api_key)})
+        window_start = since
+        while window_start < until:
+            window_end = min(window_start + MAX_WINDOW, until)
+            for incidents_list_batch in window_pages(session, querystring, window_start, window_end, controller):
+                for incident in incidents_list_batch['incidents']:
+                    yield incident['service']['summary'], incident['escalation_policy']['summary'], incident['title']
+            window_start = window_end
+
+def print_heavy_hitters(summaries, total, top):
+    print(f'\n--- heavy hitters after {total} incidents ---')
+    for dimension, summary in summaries.items():
+        print(f'top {dimension}:')
+        for key, count, error in summary.top(top):
+            print(f'  {count:>9} {"(+/- " + str(error) + ")" if error else "":>14}  {key}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Streaming top N services, escalation policies and titles over incidents.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--csv', help='incidents_report.csv written by get_incidents_report.py')
+    source.add_argument('--api-key', '-k', help='crawl the incidents from the account with this api key instead')
+    parser.add_argument('--service-ids', '-s', help='only crawl these comma separated Service IDs')
+    parser.add_argument('--since', help='with --api-key, crawl the incidents created at or after this date, e.g. 2021-01-01. required with --api-key')
+    parser.add_argument('--until', help='with --api-key, crawl the incidents created before this date. default now')
+    parser.add_argument('--top', '-n', type=int, default=10, help='number of heavy hitters printed per dimension. default 10')
+    parser.add_argument('--capacity', type=int, default=1000, help='counters kept per dimension, bounds the memory. default 1000')
+    parser.add_argument('--every', type=int, default=10000, help='print the running heavy hitters every N incidents. default 10000')
+    args = parser.parse_args()
+    if args.api_key and not args.since:
+        parser.error('--since is required with --api-key')
+
+    summaries = {'services': SpaceSaving(args.capacity), 'escalation policies': SpaceSaving(args.capacity), 'titles': SpaceSaving(args.capacity)}
+    if args.csv:
+        incidents = incidents_from_csv(args.csv)
+    else:
+        until = parse_time(args.until) if args.until else datetime.now(timezone.utc)
+        incidents = incidents_from_api(args.api_key, args.service_ids, parse_time(args.since), until)
+
+    total = 0
+    for service, escalation_policy, title in incidents:
+        total += 1
+        summaries['services'].add(service)
+        summaries['escalation policies'].add(escalation_policy)
+        summaries['titles'].add(normalize_title(title))
+        if total % args.every == 0:
+            print_heavy_hitters(summaries, total, args.top)
+
+    print_heavy_hitters(summaries, total, args.top)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# local archive of incidents_report.csv files written by get_incidents_report.py
+# the rows are appended to blocks.dat in zlib compressed blocks of --block-size rows, the file is only ever appended to.
+# three sorted indexes - incident number, incident id and created_at - hold fixed width (key, block offset, row)
+# entries. lookups memory map the index and the block file and binary search the index, so finding one incident in
+# years of reports reads a few pages of the index and decompresses a single block.
+# an incident found in several archived reports is returned once per report, oldest report first.
+# one writer at a time - the indexes are rewritten to a temporary file and moved into place on every append
+
+import argparse
+import bisect
+import csv
+import mmap
+import os
+import struct
+import sys
+import zlib
+from functools import lru_cache
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common import jsoncodec
+from pd_common.timestamps import parse_time
+
+BLOCK_HEADER = struct.Struct('>II')  # compressed length, number of rows
+# index name -> entry layout (key, block offset, row in block) and the report column the key comes from
+INDEXES = {
+    'number': (struct.Struct('>QQI'), 'incident number'),
+    'id': (struct.Struct('>16sQI'), 'incident id'),
+    'created_at': (struct.Struct('>qQI'), 'created at')
+}
+
+def index_key(index, value):
+    if index == 'number':
+        return int(value)
+    if index == 'id':
+        return value.encode().ljust(16, b'\0')[:16]
+    return int(parse_time(value).timestamp())
+
+class IndexView:
+    # read-only sequence of the keys of a memory mapped index file, for bisect
+    def __init__(self, mapped, layout):
+        self.mapped = mapped
+        self.layout = layout
+
+    def __len__(self):
+        return len(self.mapped) // self.layout.size if self.mapped else 0
+
+    def __getitem__(self, position):
+        return self.entry(position)[0]
+
+    def entry(self, position):
+        return self.layout.unpack_from(self.mapped, position * self.layout.size)
+
+def map_file(path):
+    # an empty file can not be memory mapped
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, 'rb') as file_handle:
+        return mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+class IncidentsArchive:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.blocks_path = os.path.join(directory, 'blocks.dat')
+        # the blocks never change once written, so decompressed blocks stay valid across appends
+        self.read_block = lru_cache(maxsize=64)(self._read_block)
+        self.map_files()
+
+    def map_files(self):
+        self.blocks = map_file(self.blocks_path)
+        self.indexes = {index: IndexView(map_file(self.index_path(index)), layout) for index, (layout, _) in INDEXES.items()}
+
+    def index_path(self, index):
+        return os.path.join(self.directory, f'{index}.idx')
+
+    def _read_block(self, offset):
+        length, _ = BLOCK_HEADER.unpack_from(self.blocks, offset)
+        start = offset + BLOCK_HEADER.size
+        return zlib.decompress(self.blocks[start:start + length]).decode().split('\n')
+
+    def row(self, offset, position):
+        return jsoncodec.loads(self.read_block(offset)[position])
+
+    def append(self, report_file, block_size=1000):
+        # write the report rows as new blocks, then merge their index entries into the sorted indexes
+        new_entries = {index: [] for index in INDEXES}
+        appended = 0
+        with open(report_file, newline='') as csv_fh, open(self.blocks_path, 'ab') as blocks_file:
+            reader = csv.DictReader(csv_fh)
+            while True:
+                rows = [row for _, row in zip(range(block_size), reader)]
+                if not rows:
+                    break
+                offset = blocks_file.tell()
+                compressed = zlib.compress('\n'.join(jsoncodec.dumps(row) for row in rows).encode())
+                blocks_file.write(BLOCK_HEADER.pack(len(compressed), len(rows)))
+                blocks_file.write(compressed)
+                for position, row in enumerate(rows):
+                    for index, (_, column) in INDEXES.items():
+                        new_entries[index].append((index_key(index, row[column]), offset, position))
+                appended += len(rows)
+
+        for index, (layout, _) in INDEXES.items():
+            view = self.indexes[index]
+            existing = (view.entry(position) for position in range(len(view)))
+            # the existing entries are already sorted, merging the sorted new ones keeps the rewrite linear
+            added = sorted(new_entries[index])
+            temporary_path = self.index_path(index) + '.tmp'
+            with open(temporary_path, 'wb') as index_file:
+                index_file.writelines(layout.pack(*entry) for entry in merge_sorted(existing, added))
+            os.replace(temporary_path, self.index_path(index))
+
+        # map the grown files again
+        self.map_files()
+        return appended
+
+    def lookup(self, index, value):
+        view = self.indexes[index]
+        key = index_key(index, value)
+        position = bisect.bisect_left(view, key)
+        rows = []
+        while position < len(view):
+            entry_key, offset, row_position = view.entry(position)
+            if entry_key != key:
+                break
+            rows.append(self.row(offset, row_position))
+            position += 1
+        return rows
+
+    def time_range(self, since, until):
+        # rows created in [since, until), in created_at order
+        view = self.indexes['created_at']
+        position = bisect.bisect_left(view, index_key('created_at', since))
+        end = bisect.bisect_left(view, index_key('created_at', until))
+        while position < end:
+            _, offset, row_position = view.entry(position)
+            yield self.row(offset, row_position)
+            position += 1
+
+def merge_sorted(first, second):
+    # merge two sorted iterables of entries
+    second = iter(second)
+    pending = next(second, None)
+    for entry in first:
+        while pending is not None and pending < entry:
+            yield pending
+            pending = next(second, None)
+        yield entry
+    while pending is not None:
+        yield pending
+        pending = next(second, None)
+
+def write_rows(rows, output):
+    csv_file = None
+    count = 0
+    for row in rows:
+        if csv_file is None:
+            csv_file = csv.DictWriter(output, fieldnames=list(row), extrasaction='ignore')
+            csv_file.writeheader()
+        csv_file.writerow(row)
+        count += 1
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive incidents reports and look incidents up in them.', epilog='Find more details in the accompanying README.md')
+    parser.add_argument('--archive', default='incidents_archive', help='archive directory. default incidents_archive')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    append_command = commands.add_parser('append', help='add incidents_report.csv files to the archive')
+    append_command.add_argument('reports', nargs='+', help='incidents_report.csv files written by get_incidents_report.py')
+    append_command.add_argument('--block-size', type=int, default=1000, help='rows per compressed block. default 1000')
+
+    get_command = commands.add_parser('get', help='print the archived rows of one incident')
+    lookup = get_command.add_mutually_exclusive_group(required=True)
+    lookup.add_argument('-n', '--number', help='incident number')
+    lookup.add_argument('-i', '--id', help='incident id')
+
+    range_command = commands.add_parser('range', help='print the incidents created in a time range')
+    range_command.add_argument('--since', required=True, help='start of the range, e.g. 2021-01-01')
+    range_command.add_argument('--until', required=True, help='end of the range (excluded), e.g. 2021-02-01')
+    range_command.add_argument('-o', '--output', help='write the rows to this csv file instead of stdout')
+    args = parser.parse_args()
+
+    archive = IncidentsArchive(args.archive)
+
+    if args.command == 'append':
+        for report in args.reports:
+            print(f'{report}: {archive.append(report, args.block_size)} rows archived')
+
+    elif args.command == 'get':
+        rows = archive.lookup('number', args.number) if args.number else archive.lookup('id', args.id)
+        if not write_rows(rows, sys.stdout):
+            print('incident not found in the archive')
+
+    else:
+        if args.output:
+            with open(args.output, 'w', newline='') as output_file:
+                print(f'{write_rows(archive.time_range(args.since, args.until), output_file)} incidents saved in file - {args.output}')
+        else:
+            write_rows(archive.time_range(args.since, args.until), sys.stdout)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# small webhook receiver for PagerDuty v3 webhook subscriptions
+# every incident event is upserted into the local incident store, which get_incidents_report.py and
+# mass_resolve_incidents_10k can read with --from-store instead of crawling /incidents.
+# the raw events can also be recorded to a JSONL file, to be replayed later with replay.py
+# webhook v3 documentation - https://developer.pagerduty.com/docs/webhooks/v3-overview
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.incident_store import IncidentStore
+
+def valid_signature(secret, body, signature_header):
+    # the header can hold several signatures while a secret is being rotated - v1=abc,v1=def
+    expected = 'v1=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return any(hmac.compare_digest(expected, signature.strip()) for signature in (signature_header or '').split(','))
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.server.secret and not valid_signature(self.server.secret, body, self.headers.get('X-PagerDuty-Signature')):
+            self.send_response(401)
+            self.end_headers()
+            return
+
+        # a malformed event is answered with 400, so PagerDuty does not redeliver it forever
+        try:
+            payload = json.loads(body)
+            changed = self.server.store.apply_event(payload)
+        except ValueError as ex:
+            print(f'rejected a malformed event - {ex}')
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        if self.server.record_file:
+            with self.server.record_lock, open(self.server.record_file, 'a') as record_fh:
+                record_fh.write(json.dumps(payload) + '\n')
+
+        event = payload.get('event', payload)
+        print(f"{event.get('occurred_at')} {event.get('event_type')} {(event.get('data') or {}).get('id')} {'stored' if changed else 'ignored'}")
+
+        self.send_response(202)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # the request lines are replaced by the one line per event printed above
+        pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Receive PagerDuty v3 webhooks and keep a local incident state store.')
+    parser.add_argument('--store', default='incidents.db', help='SQLite file of the incident store. default incidents.db')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on. any other address than the loopback one requires --secret. default 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on. default 8080')
+    parser.add_argument('--secret', default=os.environ.get('PD_WEBHOOK_SECRET'), help='webhook subscription secret used to verify the signatures. defaults to $PD_WEBHOOK_SECRET')
+    parser.add_argument('--record', help='also append every received event to this JSONL file')
+    args = parser.parse_args()
+    # without a secret anybody who can reach the port could write to the store
+    if not args.secret and args.host not in ('127.0.0.1', 'localhost', '::1'):
+        parser.error(f'--secret (or $PD_WEBHOOK_SECRET) is required to listen on {args.host}')
+
+    server = ThreadingHTTPServer((args.host, args.port), WebhookHandler)
+    server.store = IncidentStore(args.store)
+    server.secret = args.secret
+    server.record_file = args.record
+    server.record_lock = threading.Lock()
+
+    if not args.secret:
+        print('WARNING: no --secret given, the webhook signatures are not verified. only local clients can reach the receiver')
+    print(f'listening on {args.host}:{args.port}, storing incidents in {args.store}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
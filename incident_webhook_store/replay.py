@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# replay recorded webhook events (one event payload per line, as written by receiver.py --record)
+# either straight into an incident store, to test offline, or as signed POST requests to a running receiver
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.incident_store import IncidentStore
+
+def read_events(file_name):
+    with open(file_name) as events_fh:
+        for line in events_fh:
+            if line.strip():
+                yield line.strip().encode()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay recorded PagerDuty v3 webhook events.')
+    parser.add_argument('file', help='JSONL file with one webhook payload per line')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--store', default='incidents.db', help='apply the events to this incident store. default incidents.db')
+    target.add_argument('--url', help='POST the events to a running receiver instead, e.g. http://localhost:8080/')
+    parser.add_argument('--secret', default=os.environ.get('PD_WEBHOOK_SECRET'), help='sign the POST requests with this secret. defaults to $PD_WEBHOOK_SECRET')
+    args = parser.parse_args()
+
+    # maintain a count
+    total_events, total_stored = 0, 0
+
+    if args.url:
+        import requests
+        with requests.Session() as session:
+            for body in read_events(args.file):
+                total_events += 1
+                headers = {'Content-Type': 'application/json'}
+                if args.secret:
+                    headers['X-PagerDuty-Signature'] = 'v1=' + hmac.new(args.secret.encode(), body, hashlib.sha256).hexdigest()
+                response = session.post(args.url, data=body, headers=headers)
+                total_stored += response.ok
+                if not response.ok:
+                    print(f'FAILED - event {total_events} - {response.status_code}')
+    else:
+        store = IncidentStore(args.store)
+        for body in read_events(args.file):
+            total_events += 1
+            try:
+                total_stored += store.apply_event(json.loads(body))
+            except ValueError as ex:
+                print(f'FAILED - event {total_events} - {ex}')
+
+    print('total events replayed: {}\ntotal events accepted: {}'.format(total_events, total_stored))
@@ -2,6 +2,14 @@
 # Use this script to mass update the incidents behavior in all services in a PagerDuty account
 # Two possible options are: Create alerts and incidents, Create incidents
 
+import argparse
+from pd_common import planner
+
+parser = argparse.ArgumentParser(description='Mass update the incident behavior of all services in a PagerDuty account.')
+parser.add_argument('--plan', action='store_true', help='only count the services to change and print the estimated requests and run time. nothing is changed')
+parser.add_argument('--rate-budget', type=float, default=planner.DEFAULT_RATE_BUDGET, help='requests per minute allowed for the api key, used by --plan. default {}'.format(planner.DEFAULT_RATE_BUDGET))
+args = parser.parse_args()
+
 # display the options to the user and get the api key
 api_key = input('Please enter the API key for the account: ')
 alert_creation = input('The following incident behavior options are available:\n\
@@ -16,11 +24,9 @@ elif int(alert_creation) == 2:
 else:
     exit('Exiting script: Not an expected Service Incident Behavior option selected!')
 
-print('\nThe script will now proceed with changing the services incident behavior to {}\n'.format(alert_creation))
-
 # import the requests lib, define the variables and request headers
 import requests
-import json
+from pd_common.jsoncodec import decode_response
 base_url = 'https://api.pagerduty.com'
 header =    {
                 'Accept':'application/vnd.pagerduty+json;version=2',
@@ -28,6 +34,18 @@ header =    {
                 'Authorization':'Token token=' + api_key
             }
 
+# count the services and estimate the share already set to the requested behavior from the first page
+if args.plan:
+    session = requests.Session()
+    session.headers.update(header)
+    first_page, latency = planner.probe(session, base_url + '/services', {})
+    total_services = first_page['total']
+    to_change = planner.extrapolate(sum(service['alert_creation'] != alert_creation for service in first_page['services']), len(first_page['services']), total_services)
+    planner.print_plan(total_services, to_change, planner.list_requests_for(total_services), to_change, 1, 1, latency, args.rate_budget)
+    exit()
+
+print('\nThe script will now proceed with changing the services incident behavior to {}\n'.format(alert_creation))
+
 # get a list of all the services in the account
 # update the service with the incident behavior specified
 try:
@@ -46,7 +64,7 @@ try:
         params = {'limit': limit, 'offset': offset}
 
         # Get the list of services from the PagerDuty account
-        services_list = json.loads(requests.get(services_url, params=params, headers=header).text)
+        services_list = decode_response(requests.get(services_url, params=params, headers=header))
 
         for service in services_list['services']:
             total_services += 1
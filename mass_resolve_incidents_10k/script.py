@@ -4,84 +4,166 @@
 
 import requests
 import argparse
-import json
+import os
+import sys
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common import planner
+from pd_common.autotune import MAX_OFFSET
+from pd_common.incident_store import OPEN_STATUSES, IncidentStore
+from pd_common.jsoncodec import decode_response
+from pd_common.retry import DeadLetterFile, RetryingSender, default_dead_letter_path
+from pd_common.workqueue import WorkQueue
+
+# classic pagination can not go past MAX_OFFSET. bigger sets are resolved in passes, the resolved incidents drop
+# out of the filters and the next pass starts at offset 0
+
+def split_values(values):
+    # the id options can be repeated and every value can hold several comma separated ids
+    return [item.strip() for value in values or [] for item in value.split(',') if item.strip()]
+
+def compile_incident_filters(options):
+    # turn the command line filters into /incidents query parameters, so that the api does the filtering and the
+    # crawl only downloads the incidents which are going to be resolved. the multi-valued filters are sent as lists,
+    # which requests expands into one key[]=value pair per value
+    filters = {
+        # resolved incidents can not be resolved again, without a status option both open statuses are asked for
+        'statuses[]': [status for status in (options.status_triggered, options.status_acknowledged) if status] or list(OPEN_STATUSES),
+        'time_zone': 'UTC'
+    }
+
+    for key, values in (('urgencies[]', options.urgency), ('service_ids[]', options.service_id),
+                        ('team_ids[]', options.team_id), ('user_ids[]', options.user_id)):
+        if split_values(values):
+            filters[key] = split_values(values)
+
+    # without since/until the api only looks at the last month
+    if options.since or options.until:
+        if options.since:
+            filters['since'] = options.since
+        if options.until:
+            filters['until'] = options.until
+    else:
+        filters['date_range'] = 'all'
 
-def get_incidents_list(pd_session, st, sa, sid, tid):
     if args.debug:
-        print(f"DEBUG: get_incidents_list: pd_session: {pd_session}, st: {st}, sa: {sa}, sid: {sid}, tid: {tid}")
+        print(f"DEBUG: compile_incident_filters: {filters}")
 
-    # maintain a count of all the incidents
-    total_incidents_count = 0
+    return filters
 
+def build_incidents_querystring(filters):
     # construct the basic query string using the max number of limits and offset values to get the max number of results in one request
-    querystring = {"limit":"100", "offset":"0", "more":"True", "total":"true", "time_zone":"UTC"}
+    querystring = dict(filters, limit=100, offset=0, total='false')
 
     if args.debug:
-        print(f"DEBUG: get_incidents_list: basic query string: {querystring}")
-
-    # modify the query string based on the args passed to the script
-    if st is not None:
-        querystring['statuses[]'] = 'triggered'
-
-    if sa is not None:
-        if st is None:
-            querystring['statuses[]'] = 'acknowledged'
-        else:
-            querystring['statuses[]'] = 'triggered,acknowledged'
+        print(f"DEBUG: build_incidents_querystring: final query string: {querystring}")
 
-    if sid is not None:
-        querystring['service_ids[]'] = sid
-
-    if tid is not None:
-        querystring['team_ids[]'] = tid
+    return querystring
 
+def get_incidents_list(pd_session, filters):
     if args.debug:
-        print(f"DEBUG: get_incidents_list: modified and final query string: {querystring}")
+        print(f"DEBUG: get_incidents_list: pd_session: {pd_session}, filters: {filters}")
+
+    querystring = build_incidents_querystring(filters)
 
     # time to fetch the incidents!
     incidents_list = []
 
-    while querystring['more'] == 'True':
+    more = True
+    while more and querystring['offset'] < MAX_OFFSET:
 
         if args.debug:
-            print("DEBUG: get_incidents_list: stepping in the while loop to fetch the incidents")
+            print(f"DEBUG: get_incidents_list: fetching the incidents from offset {querystring['offset']}")
 
-        response = pd_session.get('https://api.pagerduty.com/incidents', params=querystring).json()
-        
-        if args.debug:
-            # print(f"DEBUG: get_incidents_list: response content: {response}")
-            print(f"DEBUG: get_incidents_list response: total: {response['total']}")
+        response = pd_session.get('https://api.pagerduty.com/incidents', params=querystring)
+        if not response.ok:
+            print(f"could not fetch the incidents - {response.text}")
+            break
+        response = decode_response(response)
 
-        if response['total'] > 0:
-            # add the incident id's to the list
-            for incident in response['incidents']:
-                
-                if args.debug:
-                    print(f"DEBUG: get_incidents_list: while loop: incident details: {incident}")
+        # add the incident id's to the list
+        for incident in response['incidents']:
+
+            if args.debug:
+                print(f"DEBUG: get_incidents_list: while loop: incident details: {incident}")
 
-                incidents_list.append(incident['id'])
+            incidents_list.append(incident['id'])
 
-        querystring['more'] = response['more']
+        more = response['more']
+        querystring['offset'] += querystring['limit']
+
+    if more and querystring['offset'] >= MAX_OFFSET:
+        print(f"more than {MAX_OFFSET} incidents match the filters, the rest is fetched once these are resolved")
 
-    # test data. to be removed later
     return incidents_list
 
+def get_incidents_list_from_store(store_file, filters):
+    # open incidents from the local webhook fed store, with the same filters as the api query
+    if 'user_ids[]' in filters:
+        sys.exit("the incident store does not keep the assignments, --user-id can not be used with --from-store. quitting now.")
+
+    rows = IncidentStore(store_file).open_incidents(filters.get('service_ids[]'), filters['statuses[]'], filters.get('team_ids[]'),
+                                                    filters.get('urgencies[]'), filters.get('since'), filters.get('until'))
+
+    if args.debug:
+        print(f"DEBUG: get_incidents_list_from_store: {len(rows)} incidents found in {store_file}")
+
+    return [row['id'] for row in rows]
+
+def plan_resolution(pd_session, filters):
+    # count the matching incidents without fetching them. every incident costs one resolve request
+    first_page, latency = planner.probe(pd_session, 'https://api.pagerduty.com/incidents', filters)
+    total = first_page['total']
+
+    if args.debug:
+        print(f"DEBUG: plan_resolution: total incidents: {total}, probe latency: {latency}")
+
+    planner.print_plan(total, total, planner.list_requests_for(total), total, 1, 1, latency, args.rate_budget)
+
+def resolve_mutation(incident_id):
+    # the request resolving one incident, in the format shared by the retrying sender and the work queue
+    return {
+        'method': 'PUT',
+        'url': f'https://api.pagerduty.com/incidents/{incident_id}',
+        'json': {'incident': {'type': 'incident_reference', 'status': 'resolved'}},
+        'description': incident_id
+    }
+
 def resolve_incident(incident_id):
     if args.debug:
         print(f"DEBUG: resolve_incident: working on incident id: {incident_id}")
 
+    response = sender.send(resolve_mutation(incident_id))
+    if response is not None and response.ok:
+        print(f"{incident_id} - SUCCESS")
+        return True
+    else:
+        print(f"{incident_id} - FAILED - {response.text if response is not None else 'no response'}")
+        return False
+
 if __name__ == '__main__':
 
     # get the api key
     parser = argparse.ArgumentParser(description='Mass resolve incidents on PagerDuty account')
     parser.add_argument('-a', '--api-key', required=True, help='global api key from your PagerDuty account')
 
-    # get the optional filters - service_id, team_id, status, urgencies
+    # get the optional filters - service_id, team_id, user_id, status, urgencies, since/until
     parser.add_argument('-st', '--status-triggered', action='store_const', const='triggered', help='get incidents which have been triggered in your PagerDuty account.')
     parser.add_argument('-sa', '--status-acknowledged', action='store_const', const='acknowledged', help='get incidents which have been acknowledged in your PagerDuty account.')
     parser.add_argument('-sid', '--service-id', action='append', help='get incidents from a given service id from your PagerDuty account. multiple service id\'s can be given seperated by a comma(,)')
     parser.add_argument('-tid', '--team-id', action='append', help='get incidents from a team from your PagerDuty account. multiple team id\'s can be given seperated by a comma(,)')
-
+    parser.add_argument('-uid', '--user-id', action='append', help='get incidents assigned to a user from your PagerDuty account. multiple user id\'s can be given seperated by a comma(,)')
+    parser.add_argument('-u', '--urgency', action='append', help='get incidents with the given urgency, high or low. both can be given seperated by a comma(,)')
+    parser.add_argument('--since', help='get incidents created at or after this date, e.g. 2021-01-01. all dates are searched when neither --since nor --until is given')
+    parser.add_argument('--until', help='get incidents created before this date, e.g. 2021-02-01')
+
+    parser.add_argument('-f', '--from-email', help='email address of a valid user in your PagerDuty account, required to resolve the incidents')
+    parser.add_argument('--publish-to', metavar='QUEUE', help='publish the resolve requests to a shared work queue file instead of sending them. run workqueue_worker.py against the same file to process them')
+    parser.add_argument('--dead-letter-file', help='file the incidents which could not be resolved are saved to. default dead_letters_mass_resolve_incidents_10k_<utc timestamp>.jsonl, one file per run')
+    parser.add_argument('--from-store', metavar='STORE', help='take the open incidents from a local incident store kept by incident_webhook_store/receiver.py instead of crawling the account')
+    parser.add_argument('--plan', action='store_true', help='only count the matching incidents and print the estimated requests and run time. nothing is resolved')
+    parser.add_argument('--rate-budget', type=float, default=planner.DEFAULT_RATE_BUDGET, help=f'requests per minute allowed for the api key, used by --plan. default {planner.DEFAULT_RATE_BUDGET}')
     parser.add_argument('-d', '--debug', action='store_true',help='show detailed messages on stdout')
     args = parser.parse_args()
 
@@ -96,24 +178,60 @@ if __name__ == '__main__':
         'authorization':f'Token token={args.api_key}'
         }
     )
+    if args.from_email:
+        pd_session.headers['from'] = args.from_email
     
     if args.debug:
         print(f"DEBUG: main: pd_session object: {pd_session.headers}")
 
-    incidents_list = get_incidents_list(pd_session, args.status_triggered, args.status_acknowledged, args.service_id, args.team_id)
+    filters = compile_incident_filters(args)
+
+    if args.plan:
+        plan_resolution(pd_session, filters)
+        sys.exit()
+
+    if args.from_store:
+        incidents_list = get_incidents_list_from_store(args.from_store, filters)
+    else:
+        incidents_list = get_incidents_list(pd_session, filters)
     incidents_count = len(incidents_list)
 
     if args.debug:
         print(f"DEBUG: main: total incidents found: {incidents_count}")
 
+    # hand the incidents over to the workers of the shared queue
+    if args.publish_to and incidents_count > 0:
+        published = WorkQueue(args.publish_to).publish([resolve_mutation(incident_id) for incident_id in incidents_list])
+        print(f"published {published} resolve requests to {args.publish_to}. start workqueue_worker.py --queue {args.publish_to} to process them.")
+        if not args.from_store and incidents_count >= MAX_OFFSET:
+            print(f"only the first {MAX_OFFSET} incidents were published, run the script again once the workers are done to publish the rest.")
+
     # resolve the incidents
-    if incidents_count > 0:
-        for incident_id in incidents_list:
-            
-            if args.debug:
-                print(f"DEBUG: main: trying to resolve incident: {incident_id}")
+    elif incidents_count > 0:
+        if not args.from_email:
+            sys.exit("a --from-email address is required to resolve the incidents. quitting now.")
+
+        # transient errors are retried, the incidents which still fail are saved for redrive_dead_letters.py
+        dead_letters = DeadLetterFile(args.dead_letter_file or default_dead_letter_path('mass_resolve_incidents_10k'))
+        sender = RetryingSender(pd_session, dead_letters)
+
+        while incidents_list:
+            resolved_count = 0
+            for incident_id in incidents_list:
+
+                if args.debug:
+                    print(f"DEBUG: main: trying to resolve incident: {incident_id}")
+
+                resolved_count += resolve_incident(incident_id)
+
+            # a full window can mean more matching incidents past the offset limit. stop when nothing could be
+            # resolved, the next pass would only return the same incidents again
+            if args.from_store or len(incidents_list) < MAX_OFFSET or resolved_count == 0:
+                break
+            incidents_list = get_incidents_list(pd_session, filters)
 
-            resolve_incident(incident_id)
+        if dead_letters.count:
+            print(f"{dead_letters.count} incidents could not be resolved and were saved in {dead_letters.path}. replay them with redrive_dead_letters.py")
 
     else:
         print("no incidents resolved. quitting now.")
@@ -5,13 +5,25 @@
 #       minor tweaks :)
 # Date: 22 May 2019
 
+import argparse
 import requests
-import json
+import os
+import sys
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.jsoncodec import decode_response
+from pd_common.retry import DeadLetterFile, RetryingSender, default_dead_letter_path
 
 # account definitions
 api_token = ''
 service_id = ''
 from_email = ''
+
+parser = argparse.ArgumentParser(description='Resolve the triggered incidents of the service set in the script.')
+parser.add_argument('--dead-letter-file', help='file the failed resolves are saved to. default dead_letters_mass_resolve_incidents_by_service_id_<utc timestamp>.jsonl, one file per run')
+args = parser.parse_args()
+
 url = 'https://api.pagerduty.com/incidents'
 header =    {
                 'Accept':'application/vnd.pagerduty+json;version=2',
@@ -29,11 +41,17 @@ reset_offset = 0
 # maintain a count
 total_updates = 0
 
+# transient errors are retried, the updates which still fail are saved for redrive_dead_letters.py
+session = requests.Session()
+session.headers.update(header)
+dead_letters = DeadLetterFile(args.dead_letter_file or default_dead_letter_path('mass_resolve_incidents_by_service_id'))
+sender = RetryingSender(session, dead_letters)
+
 while True:
     params = {'service_ids[]': service_id, 'statuses[]': 'triggered', 'limit': limit, 'offset': offset}
 
     # Get the list of incidents from PD based on the supplied service ID and convert it to JSON
-    incidents_list = json.loads(requests.get(url, params=params, headers=header).text)
+    incidents_list = decode_response(requests.get(url, params=params, headers=header))
 
     
     for incident in incidents_list['incidents']:
@@ -52,13 +70,13 @@ while True:
         # form the new url for the api request
         update_url = url + '/{}'.format(incident_id)
 
-        # fire the request. for some reason had to convert payload to str
-        response = requests.put(update_url, headers=header, data=str(payload))
+        # fire the request
+        response = sender.send({'method': 'PUT', 'url': update_url, 'json': payload, 'description': incident_id})
 
-        if response.status_code == 200:
+        if response is not None and response.status_code == 200:
             print(incident_id + ' - SUCCESS')
         else:   
-            print(incident_id + ' - FAILED - ' + response.text)
+            print(incident_id + ' - FAILED - ' + (response.text if response is not None else 'no response'))
 
     # we need to monitor the offset variable to stop making it go out of bounds
     if reset_offset == 1: 
@@ -75,4 +93,6 @@ while True:
         break
 
 # print some fancy stats on the cli
-print('Total incidents resolved: {}\nTotal pages fetched: {}'.format(str(total_updates),str((offset//limit)+1)))    
\ No newline at end of file
+print('Total incidents resolved: {}\nTotal pages fetched: {}'.format(str(total_updates - dead_letters.count),str((offset//limit)+1)))
+if dead_letters.count:
+    print('Failed updates saved in file - {}. Replay them with redrive_dead_letters.py'.format(dead_letters.path))
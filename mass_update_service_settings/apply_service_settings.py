@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# apply per-service settings from a csv file to the services of a PagerDuty account
+# the first column (service) holds a service id or name, the other columns the settings to apply - an empty cell
+# leaves the setting alone. the csv is joined against one crawl of /services indexed by id and name, every change
+# for a service (from all of its rows) is merged into a single PUT, services which already have the settings are
+# skipped and the remaining updates are sent concurrently
+# official api documentation for Update a Service - https://developer.pagerduty.com/api-reference/reference/REST/openapiv3.json/paths/~1services~1%7Bid%7D/put
+
+import argparse
+import csv
+import os
+import sys
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.autotune import AdaptiveConcurrency, iter_pages
+from pd_common.retry import DeadLetterFile, RetryingSender, default_dead_letter_path, send_mutation
+from pd_common.workqueue import WorkQueue
+
+url = 'https://api.pagerduty.com/services'
+
+def parse_timeout(value):
+    # seconds, or none to switch the timeout off
+    return None if value.lower() in ('none', 'null', 'off') else int(value)
+
+def parse_urgency(value):
+    # only constant urgency rules, support hours rules have to be set up in the web app
+    if value not in ('high', 'low', 'severity_based'):
+        raise ValueError(f'expected high, low or severity_based, got "{value}"')
+    return {'type': 'constant', 'urgency': value}
+
+def parse_alert_creation(value):
+    if value not in ('create_incidents', 'create_alerts_and_incidents'):
+        raise ValueError(f'expected create_incidents or create_alerts_and_incidents, got "{value}"')
+    return value
+
+def parse_alert_grouping(value):
+    # time, intelligent, content_based, or none to switch the grouping off
+    if value.lower() in ('none', 'null', 'off'):
+        return None
+    if value not in ('time', 'intelligent', 'content_based'):
+        raise ValueError(f'expected time, intelligent, content_based or none, got "{value}"')
+    return value
+
+def parse_aggregate(value):
+    if value not in ('all', 'any'):
+        raise ValueError(f'expected all or any, got "{value}"')
+    return value
+
+def parse_fields(value):
+    # semicolon separated alert fields, e.g. summary;source
+    fields = sorted(field.strip() for field in value.split(';') if field.strip())
+    if not fields:
+        raise ValueError('expected one or more alert fields separated by ;')
+    return fields
+
+def current_urgency(service):
+    rule = service.get('incident_urgency_rule') or {}
+    return {'type': rule.get('type'), 'urgency': rule.get('urgency')}
+
+def current_grouping(service):
+    return (service.get('alert_grouping_parameters') or {}).get('type')
+
+def current_grouping_config(service, key):
+    value = ((service.get('alert_grouping_parameters') or {}).get('config') or {}).get(key)
+    return sorted(value) if key == 'fields' and value else value
+
+# csv column -> (how the cell is parsed, how the current value is read from the service).
+# the alert grouping columns are compared as one alert_grouping_parameters object, see grouping_parameters
+settings = {
+    'escalation_policy': (str, lambda service: service['escalation_policy']['id']),
+    'acknowledgement_timeout': (parse_timeout, lambda service: service.get('acknowledgement_timeout')),
+    'auto_resolve_timeout': (parse_timeout, lambda service: service.get('auto_resolve_timeout')),
+    'incident_urgency': (parse_urgency, current_urgency),
+    'alert_creation': (parse_alert_creation, lambda service: service.get('alert_creation')),
+    'alert_grouping': (parse_alert_grouping, current_grouping),
+    'alert_grouping_timeout': (int, lambda service: current_grouping_config(service, 'timeout')),
+    'alert_grouping_aggregate': (parse_aggregate, lambda service: current_grouping_config(service, 'aggregate')),
+    'alert_grouping_fields': (parse_fields, lambda service: current_grouping_config(service, 'fields'))
+}
+
+# grouping type -> the config columns it takes and the ones it requires
+grouping_config = {
+    'time': ({'alert_grouping_timeout': 'timeout'}, ()),
+    'content_based': ({'alert_grouping_aggregate': 'aggregate', 'alert_grouping_fields': 'fields'}, ('alert_grouping_aggregate', 'alert_grouping_fields')),
+    'intelligent': ({}, ()),
+    None: ({}, ())
+}
+grouping_columns = ['alert_grouping'] + [column for columns, _ in grouping_config.values() for column in columns]
+
+def read_settings(file_name):
+    # (service id or name, {column: parsed value}) for every row, in file order
+    wanted = []
+    with open(file_name, newline='') as csv_fh:
+        reader = csv.DictReader(csv_fh)
+        if not reader.fieldnames or reader.fieldnames[0] != 'service':
+            sys.exit('The first header in the csv file must be service. Exiting now.')
+        unknown = [column for column in reader.fieldnames[1:] if column not in settings]
+        if unknown:
+            sys.exit(f'Unknown column(s) {", ".join(unknown)}. Column headers should be one of these - {", ".join(settings)}')
+
+        for line_number, row in enumerate(reader, start=2):
+            service_settings = {}
+            wanted.append((row['service'].strip(), service_settings))
+            for column, value in row.items():
+                if column == 'service' or value is None or not value.strip():
+                    continue
+                try:
+                    service_settings[column] = settings[column][0](value.strip())
+                except ValueError as ex:
+                    sys.exit(f'line {line_number}, column {column}: {ex}')
+    return wanted
+
+def fetch_services(session, controller):
+    # one crawl of the services, indexed by id and by (case insensitive) name. names are not unique, so every
+    # name maps to the list of services carrying it
+    by_id, by_name = {}, {}
+    for services_list in iter_pages(session, url, {}, controller):
+        for service in services_list['services']:
+            by_id[service['id']] = service
+            by_name.setdefault(service['name'].lower(), []).append(service)
+    return by_id, by_name
+
+def grouping_parameters(service, service_settings):
+    # the alert_grouping_parameters the service should end up with, or None when no grouping column is set.
+    # the settings are combined with the current values, and a config column the effective grouping type does
+    # not take - or a missing required one - is an error
+    if not any(column in service_settings for column in grouping_columns):
+        return None
+
+    grouping = service_settings.get('alert_grouping', current_grouping(service))
+    if grouping not in grouping_config:
+        raise ValueError(f'unsupported current alert grouping "{grouping}", set alert_grouping as well')
+    columns, required = grouping_config[grouping]
+
+    misplaced = [column for column in grouping_columns[1:] if column in service_settings and column not in columns]
+    if misplaced:
+        raise ValueError(f"{', '.join(misplaced)} can not be used with alert grouping {grouping}")
+
+    config = {}
+    for column, key in columns.items():
+        # keep the current config only while the grouping type stays the same
+        value = service_settings.get(column, settings[column][1](service) if grouping == current_grouping(service) else None)
+        if value is None and column in required:
+            raise ValueError(f'alert grouping {grouping} needs {column}')
+        if value is not None:
+            config[key] = value
+    return {'type': grouping, 'config': config} if config else {'type': grouping}
+
+def plan_update(service, service_settings):
+    # the PUT bringing the service in line with its settings, or None when it already matches
+    # raises ValueError for alert grouping settings which do not fit together
+    changed = {column: value for column, value in service_settings.items()
+               if column not in grouping_columns and settings[column][1](service) != value}
+    grouping = grouping_parameters(service, service_settings)
+    current_config = {key: current_grouping_config(service, key) for key in ('timeout', 'aggregate', 'fields')}
+    if grouping is not None and (grouping['type'] != current_grouping(service)
+                                 or any(current_config[key] != value for key, value in grouping.get('config', {}).items())):
+        changed['alert_grouping_parameters'] = grouping
+    if not changed:
+        return None
+
+    payload = {'type': 'service'}
+    if 'escalation_policy' in changed:
+        payload['escalation_policy'] = {'id': changed['escalation_policy'], 'type': 'escalation_policy_reference'}
+    for column in ('acknowledgement_timeout', 'auto_resolve_timeout', 'alert_creation'):
+        if column in changed:
+            payload[column] = changed[column]
+    if 'incident_urgency' in changed:
+        payload['incident_urgency_rule'] = changed['incident_urgency']
+    if 'alert_grouping_parameters' in changed:
+        # the grouping type and its config live in one object, always sent whole
+        payload['alert_grouping_parameters'] = changed['alert_grouping_parameters']
+
+    return {'method': 'PUT', 'url': f"{url}/{service['id']}", 'json': {'service': payload},
+            'description': f"{service['name']} ({service['id']}) - " + ', '.join(f'{column}={value}' for column, value in changed.items())}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply per-service settings from a csv file to the services of a PagerDuty account.', epilog='Find more details in the accompanying readme.md')
+    parser.add_argument('-k', '--api-key', required=True, help='global api key with write access from the account')
+    parser.add_argument('-f', '--file-name', required=True, help='csv file with a service column and one column per setting')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='number of update requests sent concurrently. default 8')
+    parser.add_argument('--dry-run', action='store_true', help='only print the changes, do not send them')
+    parser.add_argument('--publish-to', metavar='QUEUE', help='publish the updates to a shared work queue file instead of sending them. run workqueue_worker.py against the same file to process them')
+    parser.add_argument('--dead-letter-file', help='file the failed updates are saved to. default dead_letters_apply_service_settings_<utc timestamp>.jsonl, one file per run')
+    args = parser.parse_args()
+
+    # the csv is checked before anything is fetched
+    wanted = read_settings(args.file_name)
+
+    with requests.Session() as session:
+        session.headers.update({
+            'Accept': 'application/vnd.pagerduty+json;version=2',
+            'Content-Type': 'application/json',
+            'Authorization': 'Token token=' + args.api_key
+        })
+
+        controller = AdaptiveConcurrency()
+        by_id, by_name = fetch_services(session, controller)
+
+        # join the csv against the services. all the rows of a service - by id or by name - are merged into one
+        # update, the later rows win
+        merged, not_found, errors = {}, [], []
+        for key, service_settings in wanted:
+            services = [by_id[key]] if key in by_id else by_name.get(key.lower(), [])
+            if len(services) > 1:
+                errors.append(f'service name "{key}" is used by {len(services)} services ({", ".join(service["id"] for service in services)}), use the service id instead')
+                continue
+            if not services:
+                if key not in not_found:
+                    not_found.append(key)
+                continue
+            merged.setdefault(services[0]['id'], (services[0], {}))[1].update(service_settings)
+
+        mutations = []
+        for service, service_settings in merged.values():
+            try:
+                mutation = plan_update(service, service_settings)
+            except ValueError as ex:
+                errors.append(f"{service['name']} ({service['id']}): {ex}")
+                continue
+            if mutation:
+                mutations.append(mutation)
+
+        # nothing is sent while any row is ambiguous or inconsistent
+        if errors:
+            sys.exit('\n'.join(['Exiting now, fix these rows first:'] + errors))
+
+        for key in not_found:
+            print(f'SKIPPING - service "{key}" not found in the account')
+
+        if args.dry_run:
+            for mutation in mutations:
+                print('DRY RUN - ' + mutation['description'])
+            total_changed = 0
+        elif args.publish_to:
+            # the workers of the shared queue send the updates
+            published = WorkQueue(args.publish_to).publish(mutations)
+            print('Published {} updates to {}. Start workqueue_worker.py --queue {} to process them.'.format(published, args.publish_to, args.publish_to))
+            total_changed = 0
+        else:
+            # transient errors are retried, the updates which still fail are saved for redrive_dead_letters.py
+            dead_letters = DeadLetterFile(args.dead_letter_file or default_dead_letter_path('apply_service_settings'))
+            sender = RetryingSender(session, dead_letters)
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                total_changed = sum(pool.map(lambda mutation: send_mutation(sender, mutation), mutations))
+
+    # print stats on cli
+    print('Total services in the account: {}\nRows in the csv file: {} ({} services not found)\nServices already matching: {}\nServices to change: {}\nServices changed: {}'.format(
+        len(by_id), len(wanted), len(not_found), len(merged) - len(mutations), len(mutations), total_changed))
+    if not (args.dry_run or args.publish_to) and dead_letters.count:
+        print('Failed updates saved in file - {}. Replay them with redrive_dead_letters.py'.format(dead_letters.path))
@@ -4,6 +4,7 @@
 #
 # the script searches the object with the user email address and proceeds to modify the attributes specified in the next column
 # the columns should have the headers to identify the column values
+# the csv file is streamed in chunks, so the updates start while the rest of a large file is still being read
 
 def fetch_all_users():
     users_list = list()
@@ -29,22 +30,16 @@ def fetch_all_users():
         }
 
         # fetch the initial batch of users
-        response = json.loads(requests.get('https://api.pagerduty.com/users', headers=header, params=querystring).text)
+        response = decode_response(requests.get('https://api.pagerduty.com/users', headers=header, params=querystring))
         more = response['more']
         offset += limit
 
-        users_list.extend(response['users'])
+        # only keep the fields needed for the updates
+        users_list.extend(project_user(user) for user in response['users'])
     
     return users_list
 
 def update_user_attribute(user_id, user_type, user_name, user_email, user_attribute_type, user_attribute_value):
-    # define the generic header to be used in all api requests
-    header = {
-            'accept': "application/vnd.pagerduty+json;version=2",
-            'content-type': "application/json",
-            'authorization': "Token token=" + args.api_key
-    }
-
     # check for job_title. value should be between 1..100
     if user_attribute_type == 'job_title' and user_attribute_value == '':
         user_attribute_value = ' '
@@ -60,46 +55,120 @@ def update_user_attribute(user_id, user_type, user_name, user_email, user_attrib
     }
 
     print(f"Updating {user_attribute_type} for {user_name} with the new value of {user_attribute_value}")
-    
-    requests.put("https://api.pagerduty.com/users/" + user_id, headers=header, json=payload)
 
-def run_custom_dataframe_checks(df):
+    # transient errors are retried by the sender, the updates which still fail end up in the dead letter file
+    response = sender.send({
+        'method': 'PUT',
+        'url': "https://api.pagerduty.com/users/" + user_id,
+        'json': payload,
+        'description': f"{user_attribute_type} for {user_email}"
+    })
+    if response is None or not response.ok:
+        print(f"FAILED - updating {user_attribute_type} for {user_name} - {response.text if response is not None else 'no response'}")
+
+def run_custom_header_checks(headers):
     # basic checks based on the number of columns in the csv file
-    if len(df.columns) > 1:
-        if not df.columns[0] == 'email':
+    if headers and len(headers) > 1:
+        if not headers[0] == 'email':
             print(f"The first header in the csv file must be email. Exiting now.")
             sys.exit()
         else:
             # list of editable user object attributes
             user_object_attributes = {'name', 'email', 'time_zone', 'role', 'description', 'job_title'}
-            for df_cols in df.columns:
-                if df_cols not in user_object_attributes:
-                    print(f"Column header \"{df_cols}\" not found in valid user object attributes. Column headers should be one of these - {user_object_attributes}")
+            for header in headers:
+                if header not in user_object_attributes:
+                    print(f"Column header \"{header}\" not found in valid user object attributes. Column headers should be one of these - {user_object_attributes}")
                     sys.exit()
     else:
         print(f"Number of columns is too less to run the script. Exiting now.")
         sys.exit()
 
-    return df
+    return headers
+
+def put_chunk(chunks, chunk, failed):
+    # put() blocks while the worker is behind. a failed worker never drains its queue again, so stop waiting then
+    while not failed.is_set():
+        try:
+            chunks.put(chunk, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+def read_chunks(reader, worker_queues, chunk_size, failed, errors):
+    # producer - read the csv rows and hand them to the update workers in fixed-size chunks through bounded queues,
+    # so only a few chunks of the file are held in memory at any time. the rows of one email always go to the same
+    # worker, which applies them in file order - the last row for an email wins, like in a sequential run
+    buffers = [[] for _ in worker_queues]
+    try:
+        for row in reader:
+            if failed.is_set():
+                return
+            index = zlib.crc32(row['email'].encode()) % len(worker_queues)
+            buffers[index].append(row)
+            if len(buffers[index]) == chunk_size:
+                put_chunk(worker_queues[index], buffers[index], failed)
+                buffers[index] = []
+        for chunks, buffer in zip(worker_queues, buffers):
+            if buffer:
+                put_chunk(chunks, buffer, failed)
+            # end marker
+            put_chunk(chunks, None, failed)
+    except Exception as ex:
+        errors.append(ex)
+        failed.set()
+
+def update_rows(chunks, headers, users_by_email, failed, errors):
+    # consumer - apply every row of a chunk, the columns of one row in order
+    try:
+        while not failed.is_set():
+            try:
+                chunk = chunks.get(timeout=1)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                return
+            for row in chunk:
+                user = users_by_email.get(row['email'])
+                if user is None:
+                    print(f"Skipping user with email address \"{row['email']}\" not found in the account")
+                    continue
+                for header in headers:
+                    update_user_attribute(user.id, user.type, user.name, user.email, header, row[header])
+    except Exception as ex:
+        # stops the producer and the other workers
+        errors.append(ex)
+        failed.set()
+
+def update_all_rows(reader, headers, users_by_email):
+    # one producer reading the chunks, one bounded queue per update worker
+    failed, errors = threading.Event(), []
+    worker_queues = [queue.Queue(maxsize=args.queue_chunks) for _ in range(args.workers)]
+    producer = threading.Thread(target=read_chunks, args=(reader, worker_queues, args.chunk_size, failed, errors), daemon=True)
+    producer.start()
+
+    workers = [threading.Thread(target=update_rows, args=(chunks, headers, users_by_email, failed, errors)) for chunks in worker_queues]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    producer.join()
+
+    if errors:
+        raise errors[0]
 
 def main():
-    import pandas as pd
-    df = run_custom_dataframe_checks(pd.read_csv(args.file_name))
+    # the file is read row by row, the headers are checked once before anything is fetched
+    with open(args.file_name, newline='') as csv_fh:
+        reader = csv.DictReader(csv_fh)
+        headers = run_custom_header_checks(reader.fieldnames)
 
-    # fetch a list of all users in the account 
-    users_list = fetch_all_users()
+        # fetch a list of all users in the account, indexed by email
+        with profiler.phase('fetch'):
+            users_by_email = {user.email: user for user in fetch_all_users()}
 
-    for df_row in df.itertuples():
-        user_found = False
-        for user in users_list:
-            # we have a match
-            if df_row.email == user['email']:
-                user_found = True
-                for df_col_title in df.columns:
-                    update_user_attribute(user['id'], user['type'], user['name'], user['email'], df_col_title, getattr(df_row, df_col_title) )
-
-        if not user_found:
-            print(f"Skipping user with email address \"{df_row.email}\" not found in the account")
+        # the csv is read while the updates are sent, the sampled stacks of the producer are counted as read
+        with profiler.phase('mutate'):
+            update_all_rows(reader, headers, users_by_email)
 
 if __name__ == "__main__":
     import argparse
@@ -108,10 +177,44 @@ if __name__ == "__main__":
         The script supports changing the name, email, time_zone, role, description, job_title.')
     parser.add_argument('-a', '--api-key', required=True, help='global api key from the account')
     parser.add_argument('-f', '--file-name', required=True, help='path of the csv file to be parsed')
+    parser.add_argument('--dead-letter-file', help='file the failed updates are saved to. default dead_letters_mass_update_titles_<utc timestamp>.jsonl, one file per run')
+    parser.add_argument('--chunk-size', type=int, default=500, help='csv rows read per chunk. default 500')
+    parser.add_argument('--queue-chunks', type=int, default=4, help='chunks read ahead of each update worker. default 4')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='update workers sending requests at the same time. default 4')
+    parser.add_argument('--profile', nargs='?', const='profile', help='profile the fetch, decode, read and mutate phases of the run into this directory. default profile')
     args = parser.parse_args()
 
+    import csv
+    import os
+    import queue
     import sys
-    import json
+    import threading
+    import zlib
     import requests
 
-    main()
\ No newline at end of file
+    # make the shared helpers in the repository root importable
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from pd_common.jsoncodec import decode_response
+    from pd_common.records import project_user
+    from pd_common.retry import DeadLetterFile, RetryingSender, default_dead_letter_path
+    from pd_common.profiling import Profiler
+
+    # one session and sender shared by all the update requests
+    session = requests.Session()
+    session.headers.update({
+            'accept': "application/vnd.pagerduty+json;version=2",
+            'content-type': "application/json",
+            'authorization': "Token token=" + args.api_key
+    })
+    dead_letters = DeadLetterFile(args.dead_letter_file or default_dead_letter_path('mass_update_titles'))
+    sender = RetryingSender(session, dead_letters)
+
+    profiler = Profiler(args.profile, attribute={'jsoncodec.py': 'decode', 'read_chunks': 'read'})
+    # the profile is written even when the run fails half way
+    try:
+        main()
+    finally:
+        profiler.close()
+
+    if dead_letters.count:
+        print(f"{dead_letters.count} updates failed and were saved in {dead_letters.path}. Replay them with redrive_dead_letters.py")
\ No newline at end of file
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# find on-call coverage gaps and overlaps for every escalation policy level in an account
+# the /oncalls entries for the period are crawled in parallel time windows - one concurrency controller bounds the
+# requests in flight across all of them - and grouped per escalation policy level
+# into sorted interval lists and swept once: a gap is a stretch of time with nobody on call for the level, an
+# overlap is a stretch with more than one on-call entry for it. the levels come from /escalation_policies, so a
+# level nobody is on call for during the whole period is reported as one gap covering the period
+# official api documentation for List On-Calls - https://developer.pagerduty.com/api-reference/reference/REST/openapiv3.json/paths/~1oncalls/get
+
+import argparse
+import csv
+import os
+import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import requests
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.autotune import AdaptiveConcurrency, iter_pages
+from pd_common.timestamps import parse_time
+
+def time_windows(since, until, window_days):
+    window_start = since
+    while window_start < until:
+        window_end = min(window_start + timedelta(days=window_days), until)
+        yield window_start, window_end
+        window_start = window_end
+
+def fetch_window(session, window_start, window_end, escalation_policy_ids, controller):
+    params = {'since': window_start.isoformat(), 'until': window_end.isoformat(), 'time_zone': 'UTC',
+              'escalation_policy_ids[]': escalation_policy_ids}
+    oncalls = []
+    for page in iter_pages(session, 'https://api.pagerduty.com/oncalls', params, controller):
+        oncalls.extend(page['oncalls'])
+    return oncalls
+
+def fetch_levels(session, escalation_policy_ids, controller):
+    # every (escalation policy id, level) of the account, or of the given escalation policies, and the policy names
+    levels, names = [], {}
+    for page in iter_pages(session, 'https://api.pagerduty.com/escalation_policies', {}, controller):
+        for escalation_policy in page['escalation_policies']:
+            if escalation_policy_ids and escalation_policy['id'] not in escalation_policy_ids:
+                continue
+            names[escalation_policy['id']] = escalation_policy['name']
+            levels.extend((escalation_policy['id'], level) for level in range(1, len(escalation_policy['escalation_rules']) + 1))
+    return levels, names
+
+def build_intervals(oncalls, since, until):
+    # (escalation policy id, level) -> sorted list of (start, end, user). entries spanning several windows are
+    # returned once per window, the set removes the copies. entries without start/end are permanent
+    unique = set()
+    names = {}
+    for oncall in oncalls:
+        escalation_policy = oncall['escalation_policy']
+        names[escalation_policy['id']] = escalation_policy['summary']
+        start = parse_time(oncall['start']) if oncall.get('start') else since
+        end = parse_time(oncall['end']) if oncall.get('end') else until
+        schedule_id = oncall['schedule']['id'] if oncall.get('schedule') else None
+        unique.add((escalation_policy['id'], oncall['escalation_level'], oncall['user']['summary'], schedule_id, max(start, since), min(end, until)))
+
+    intervals = defaultdict(list)
+    for escalation_policy_id, level, user, _, start, end in unique:
+        if start < end:
+            intervals[(escalation_policy_id, level)].append((start, end, user))
+    for level_intervals in intervals.values():
+        level_intervals.sort()
+    return intervals, names
+
+def sweep(level_intervals, since, until):
+    # one pass over the start/end events. ends sort before starts at the same instant, so back to back shifts
+    # are neither a gap nor an overlap
+    events = []
+    for start, end, user in level_intervals:
+        events.append((start, 1, user))
+        events.append((end, -1, user))
+    events.sort(key=lambda event: (event[0], event[1]))
+
+    gaps, overlaps = [], []
+    active = Counter()
+    cursor = since
+    for moment, delta, user in events:
+        if moment > cursor:
+            on_call = sum(active.values())
+            if on_call == 0:
+                gaps.append((cursor, moment, []))
+            elif on_call > 1:
+                overlaps.append((cursor, moment, sorted(active.elements())))
+            cursor = moment
+        active[user] += delta
+        if active[user] == 0:
+            del active[user]
+
+    if cursor < until:
+        gaps.append((cursor, until, []))
+    return gaps, overlaps
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find on-call coverage gaps and overlaps per escalation policy level.')
+    parser.add_argument('-k', '--api-key', required=True, help='REST API key from the account. Can be a read-only key.')
+    parser.add_argument('--since', required=True, help='start of the period, e.g. 2021-01-01')
+    parser.add_argument('--until', required=True, help='end of the period, e.g. 2022-01-01')
+    parser.add_argument('-e', '--escalation-policy-ids', help='only these comma separated escalation policy ids')
+    parser.add_argument('--window-days', type=int, default=30, help='length of the time windows crawled in parallel, at most 90. default 30')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='time windows crawled at the same time. default 8')
+    parser.add_argument('--no-overlaps', action='store_true', help='only report the gaps')
+    parser.add_argument('-o', '--output', default='oncall_coverage.csv', help='output csv file. default oncall_coverage.csv')
+    args = parser.parse_args()
+
+    since, until = parse_time(args.since), parse_time(args.until)
+    escalation_policy_ids = args.escalation_policy_ids.split(',') if args.escalation_policy_ids else None
+
+    with requests.Session() as session:
+        session.headers.update({'Accept': 'application/vnd.pagerduty+json;version=2', 'Authorization': 'Token token=' + args.api_key})
+        controller = AdaptiveConcurrency()
+        levels, policy_names = fetch_levels(session, escalation_policy_ids, controller)
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(fetch_window, session, window_start, window_end, escalation_policy_ids, controller)
+                       for window_start, window_end in time_windows(since, until, min(args.window_days, 90))]
+            oncalls = [oncall for future in futures for oncall in future.result()]
+
+    intervals, names = build_intervals(oncalls, since, until)
+    # the levels without any on-call entry sweep into one gap over the whole period
+    names.update(policy_names)
+    for level in levels:
+        intervals.setdefault(level, [])
+
+    # maintain a count
+    total_gaps, total_overlaps, total_gap_hours = 0, 0, 0.0
+
+    with open(args.output, 'w') as output_file:
+        csv_file = csv.writer(output_file)
+        csv_file.writerow(['escalation policy id', 'escalation policy', 'level', 'type', 'start', 'end', 'hours', 'on call'])
+        for (escalation_policy_id, level), level_intervals in sorted(intervals.items()):
+            gaps, overlaps = sweep(level_intervals, since, until)
+            total_gaps += len(gaps)
+            total_gap_hours += sum((end - start).total_seconds() for start, end, _ in gaps) / 3600
+            rows = [('gap', gap) for gap in gaps]
+            if not args.no_overlaps:
+                total_overlaps += len(overlaps)
+                rows += [('overlap', overlap) for overlap in overlaps]
+            for kind, (start, end, users) in sorted(rows, key=lambda row: row[1][0]):
+                csv_file.writerow([escalation_policy_id, names[escalation_policy_id], level, kind, start.isoformat(), end.isoformat(),
+                                   round((end - start).total_seconds() / 3600, 2), '; '.join(users)])
+
+    print(controller.summary())
+    print('on-call entries fetched: {}\nescalation policy levels: {}\ntotal gaps: {} ({:.1f} hours)\ntotal overlaps: {}\nResults saved in file - {}'.format(
+        len(oncalls), len(intervals), total_gaps, total_gap_hours, total_overlaps, args.output))
@@ -0,0 +1,2 @@
+# shared helpers for the scripts in this repository
+# scripts living in a sub directory add the repository root to sys.path before importing from here
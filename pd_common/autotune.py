@@ -0,0 +1,213 @@
+# adaptive concurrency for the classic (offset based) paginated list endpoints
+# pages are fetched in parallel and the number of requests in flight is tuned AIMD style -
+# raised by one per round trip while latency stays flat, cut down when latency climbs and halved on a 429.
+# the limit is global - every request made through get_page, from any iter_pages call or thread sharing the
+# controller, holds one of its slots while it is in flight, so a 429 slows all of them down
+# more details about pagination here - https://developer.pagerduty.com/docs/rest-api-v2/pagination
+# more details about rate limits here - https://developer.pagerduty.com/docs/rest-api-rate-limits
+
+# classic pagination can not go past an offset of 10000 - https://developer.pagerduty.com/docs/rest-api-v2/pagination
+MAX_OFFSET = 10000
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pd_common.jsoncodec import decode_response
+
+class RateBudget:
+    # token bucket holding at most one second worth of requests
+    def __init__(self, requests_per_minute):
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+# the PD_RATE_BUDGET bucket, shared by every controller of the process
+_process_budget = None
+_process_budget_lock = threading.Lock()
+
+def process_rate_budget():
+    global _process_budget
+    with _process_budget_lock:
+        if _process_budget is None and os.environ.get('PD_RATE_BUDGET'):
+            _process_budget = RateBudget(float(os.environ['PD_RATE_BUDGET']))
+        return _process_budget
+
+class AdaptiveConcurrency:
+    def __init__(self, initial=4, minimum=1, maximum=16, pinned=None, latency_tolerance=2.0, rate_budget=None):
+        # a pinned value switches the tuning off, use it with the value logged by a previous run
+        self.pinned = pinned
+        self.minimum = minimum
+        self.maximum = max(maximum, pinned or 0)
+        self.limit = float(pinned or initial)
+        self.latency_tolerance = latency_tolerance
+
+        # the lowest latency seen so far is used as the uncongested baseline. it is allowed to creep
+        # up slowly so that one lucky fast request does not keep the limit down for the whole run
+        self.baseline_latency = None
+
+        # optional cap on the requests per minute. fanout_accounts.py hands every account its own budget
+        # through the PD_RATE_BUDGET environment variable, which caps the whole process however many
+        # controllers it creates
+        self.rate_budget = RateBudget(rate_budget) if rate_budget else process_rate_budget()
+
+        # stats for the summary line
+        self.pages, self.throttled, self.peak, self.truncated = 0, 0, self.limit, 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+        # requests in flight, and the threads of the page pool shared by all the iter_pages calls
+        self.in_flight = 0
+        self.slot_freed = threading.Condition(self.lock)
+        self.executor = None
+
+    def concurrency(self):
+        return int(self.limit)
+
+    def acquire(self):
+        # block until the request fits under the current limit
+        with self.lock:
+            while self.in_flight >= max(1, int(self.limit)):
+                self.slot_freed.wait()
+            self.in_flight += 1
+        if self.rate_budget:
+            self.rate_budget.acquire()
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.slot_freed.notify_all()
+
+    def pool(self):
+        # the threads only wait for a slot, so one pool sized to the maximum serves every crawl
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.maximum)
+            return self.executor
+
+    def on_success(self, latency):
+        with self.lock:
+            self.pages += 1
+            if self.pinned:
+                return
+
+            if self.baseline_latency is None or latency < self.baseline_latency:
+                self.baseline_latency = latency
+            else:
+                self.baseline_latency *= 1.002
+
+            if latency <= self.baseline_latency * self.latency_tolerance:
+                # additive increase - roughly +1 for every window of successful requests
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                # the api is slowing down, back off gently before it starts throttling
+                self.limit = max(self.minimum, self.limit * 0.9)
+            self.peak = max(self.peak, self.limit)
+
+    def on_throttle(self):
+        with self.lock:
+            self.throttled += 1
+            if not self.pinned:
+                # multiplicative decrease
+                self.limit = max(self.minimum, self.limit / 2)
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        mode = 'pinned' if self.pinned else 'settled'
+        truncated = f', lists truncated at offset {MAX_OFFSET}: {self.truncated}' if self.truncated else ''
+        return (f'{mode} concurrency: {self.concurrency()} (peak {int(self.peak)}), pages fetched: {self.pages}, '
+                f'throttled responses: {self.throttled}{truncated}, pages/sec: {self.pages / elapsed:.2f}. '
+                f'Pass --concurrency {self.concurrency()} to pin this value for later runs.')
+
+def get_page(session, url, params, controller):
+    # keep retrying the same page while PagerDuty throttles us
+    while True:
+        controller.acquire()
+        try:
+            started = time.monotonic()
+            response = session.get(url, params=params)
+            latency = time.monotonic() - started
+        finally:
+            # the slot is not held while sleeping off a 429
+            controller.release()
+
+        if response.status_code == 429:
+            controller.on_throttle()
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+            continue
+
+        response.raise_for_status()
+        controller.on_success(latency)
+        return decode_response(response)
+
+def report_truncated(url, controller, total=None):
+    with controller.lock:
+        controller.truncated += 1
+    matching = f'{total} objects match' if total else 'more objects match'
+    print(f'WARNING: {matching} {url}, only the first {MAX_OFFSET} can be listed. narrow the filters to get the rest', file=sys.stderr)
+
+def iter_pages(session, url, params, controller, limit=100):
+    # the first page asks for the total so that the remaining offsets can be requested in parallel.
+    # pages at or past MAX_OFFSET are not requested, the api rejects them - the list is reported as truncated
+    params = dict(params, limit=limit, offset=0, total='true')
+    first_page = get_page(session, url, params, controller)
+    yield first_page
+
+    total = first_page.get('total')
+    if not first_page['more']:
+        return
+
+    # some endpoints do not return a total - walk them one page at a time
+    if total is None:
+        offset, more = 0, True
+        while more:
+            offset += limit
+            if offset >= MAX_OFFSET:
+                report_truncated(url, controller)
+                return
+            page = get_page(session, url, dict(params, offset=offset), controller)
+            more = page['more']
+            yield page
+        return
+
+    offsets = list(range(limit, min(total, MAX_OFFSET), limit))
+    offsets.reverse()
+    pending, ready = {}, {}
+    next_offset = limit
+
+    pool = controller.pool()
+    while offsets or pending:
+        # keep as many requests queued as the controller allows, the controller itself bounds the ones in flight
+        # across all the crawls. do not run too far ahead of the next page to be handed back, otherwise a slow
+        # page would pile up finished ones in memory
+        while offsets and len(pending) < controller.concurrency() and offsets[-1] < next_offset + limit * controller.maximum * 2:
+            offset = offsets.pop()
+            pending[pool.submit(get_page, session, url, dict(params, offset=offset), controller)] = offset
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            ready[pending.pop(future)] = future.result()
+
+        # hand the pages back in offset order so that the reports keep the api ordering
+        while next_offset in ready:
+            yield ready.pop(next_offset)
+            next_offset += limit
+
+    if total > MAX_OFFSET:
+        report_truncated(url, controller, total)
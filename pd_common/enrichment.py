@@ -0,0 +1,66 @@
+# per-incident enrichment - the alerts and notes of every incident, which the incidents list does not return inline
+# the incident ids are handed over while the list is still being crawled. a bounded pool fetches
+# /incidents/{id}/alerts (all pages) and /incidents/{id}/notes for each of them, an id already queued or in flight
+# is not fetched twice, and every finished incident is handed to the callback straight away.
+# the workers only decide which incident is fetched next - every alerts page and notes request goes through the
+# shared controller, so the requests in flight stay within its limit together with the crawl feeding the ids,
+# however many workers there are
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from pd_common.autotune import get_page, iter_pages
+
+class IncidentEnricher:
+    def __init__(self, session, controller, on_result, workers=8, backlog=64):
+        self.session = session
+        self.controller = controller
+        self.on_result = on_result
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # submit() blocks once this many incidents are waiting, so the crawl can not run away from the pool
+        self.slots = threading.BoundedSemaphore(workers + backlog)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.done = set()
+        self.enriched, self.failed, self.duplicates = 0, 0, 0
+
+    def submit(self, incident):
+        with self.lock:
+            if incident['id'] in self.in_flight or incident['id'] in self.done:
+                self.duplicates += 1
+                return self.in_flight.get(incident['id'])
+
+        self.slots.acquire()
+        with self.lock:
+            future = self.in_flight[incident['id']] = self.pool.submit(self.enrich, incident)
+        future.add_done_callback(lambda finished: self.finish(incident['id'], finished))
+        return future
+
+    def enrich(self, incident):
+        # the pages of a long alerts list are fetched in parallel, within the same global limit
+        url = f"https://api.pagerduty.com/incidents/{incident['id']}"
+        alerts = [alert for page in iter_pages(self.session, f'{url}/alerts', {}, self.controller) for alert in page['alerts']]
+        notes = get_page(self.session, f'{url}/notes', {}, self.controller)['notes']
+        return incident, alerts, notes
+
+    def finish(self, incident_id, future):
+        with self.lock:
+            del self.in_flight[incident_id]
+            self.done.add(incident_id)
+            if future.exception() is None:
+                self.enriched += 1
+            else:
+                self.failed += 1
+        self.slots.release()
+
+        if future.exception() is None:
+            self.on_result(*future.result())
+        else:
+            print(f'could not enrich incident {incident_id} - {future.exception()}')
+
+    def close(self):
+        # wait for everything still queued or in flight
+        self.pool.shutdown(wait=True)
+
+    def summary(self):
+        return f'incidents enriched: {self.enriched}, failed: {self.failed}, duplicate ids skipped: {self.duplicates}'
@@ -0,0 +1,122 @@
+# local incident state store fed by PagerDuty v3 webhooks (see incident_webhook_store/)
+# every incident event upserts the incident into an indexed SQLite table, so questions like "all open incidents
+# for these services" are answered locally instead of crawling /incidents.
+# events can arrive out of order - an event older than the one already stored for the incident is ignored.
+# the timestamps are stored as fixed width utc strings (see pd_common.timestamps), so sqlite compares them in time
+# order whatever precision and offset the events and the query options use
+# webhook v3 payload documentation - https://developer.pagerduty.com/docs/webhooks/v3-overview
+
+import json
+import sqlite3
+import threading
+
+from pd_common.records import IncidentRecord, reference
+from pd_common.timestamps import utc_string
+
+OPEN_STATUSES = ('triggered', 'acknowledged')
+
+def optional_utc_string(value):
+    return utc_string(value) if value else value
+
+class IncidentStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS incidents (
+                id TEXT PRIMARY KEY,
+                incident_number INTEGER,
+                title TEXT,
+                status TEXT,
+                urgency TEXT,
+                service_id TEXT,
+                service_html_url TEXT,
+                escalation_policy_id TEXT,
+                escalation_policy_html_url TEXT,
+                team_ids TEXT,
+                created_at TEXT,
+                last_status_change_by TEXT,
+                last_status_change_at TEXT,
+                html_url TEXT,
+                last_event_at TEXT,
+                data TEXT);
+            CREATE INDEX IF NOT EXISTS incidents_status_service ON incidents (status, service_id);
+            CREATE INDEX IF NOT EXISTS incidents_number ON incidents (incident_number);''')
+
+        # stores written before the timestamps were normalised keep the raw event strings
+        with self.connection:
+            rows = self.connection.execute('SELECT id, created_at, last_status_change_at, last_event_at FROM incidents WHERE length(last_event_at) != 27').fetchall()
+            self.connection.executemany('UPDATE incidents SET created_at = ?, last_status_change_at = ?, last_event_at = ? WHERE id = ?',
+                                        [(optional_utc_string(row['created_at']), optional_utc_string(row['last_status_change_at']),
+                                          utc_string(row['last_event_at']), row['id']) for row in rows])
+
+    def apply_event(self, payload):
+        # returns True when the event changed the store, raises ValueError for a malformed incident event
+        event = payload.get('event', payload) if isinstance(payload, dict) else None
+        if not isinstance(event, dict) or not isinstance(event.get('data') or {}, dict):
+            raise ValueError('the payload is not a webhook event')
+        data = event.get('data') or {}
+        if event.get('resource_type') != 'incident' or data.get('type') != 'incident':
+            return False
+
+        if not event.get('occurred_at') or not data.get('id'):
+            raise ValueError('incident event without occurred_at or data.id')
+        occurred_at = utc_string(event['occurred_at'])
+        service = data.get('service') or {}
+        escalation_policy = data.get('escalation_policy') or {}
+        agent = event.get('agent') or {}
+        row = (data['id'], data.get('number'), data.get('title'), data.get('status'), data.get('urgency'),
+               service.get('id'), service.get('html_url'), escalation_policy.get('id'), escalation_policy.get('html_url'),
+               ','.join(team['id'] for team in data.get('teams') or []), optional_utc_string(data.get('created_at')), agent.get('html_url'),
+               occurred_at, data.get('html_url'), occurred_at, json.dumps(data))
+
+        with self.lock, self.connection:
+            # the status change fields only move when the status really changed
+            cursor = self.connection.execute('''INSERT INTO incidents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    incident_number = excluded.incident_number, title = excluded.title, urgency = excluded.urgency,
+                    service_id = excluded.service_id, service_html_url = excluded.service_html_url,
+                    escalation_policy_id = excluded.escalation_policy_id, escalation_policy_html_url = excluded.escalation_policy_html_url,
+                    team_ids = excluded.team_ids, created_at = excluded.created_at, html_url = excluded.html_url,
+                    last_status_change_by = CASE WHEN status = excluded.status THEN last_status_change_by ELSE excluded.last_status_change_by END,
+                    last_status_change_at = CASE WHEN status = excluded.status THEN last_status_change_at ELSE excluded.last_status_change_at END,
+                    status = excluded.status, last_event_at = excluded.last_event_at, data = excluded.data
+                WHERE excluded.last_event_at >= incidents.last_event_at''', row)
+        return cursor.rowcount == 1
+
+    def open_incidents(self, service_ids=None, statuses=OPEN_STATUSES, team_ids=None, urgencies=None, since=None, until=None):
+        query = f'SELECT * FROM incidents WHERE status IN ({",".join("?" * len(statuses))})'
+        params = list(statuses)
+        if service_ids:
+            query += f' AND service_id IN ({",".join("?" * len(service_ids))})'
+            params += list(service_ids)
+        if urgencies:
+            query += f' AND urgency IN ({",".join("?" * len(urgencies))})'
+            params += list(urgencies)
+        if since:
+            query += ' AND created_at >= ?'
+            params.append(utc_string(since))
+        if until:
+            query += ' AND created_at < ?'
+            params.append(utc_string(until))
+        query += ' ORDER BY incident_number'
+
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        if team_ids:
+            rows = [row for row in rows if set(row['team_ids'].split(',')) & set(team_ids)]
+        return rows
+
+def incident_record(row):
+    # same shape as the records built from the /incidents list, so the report code can use either.
+    # the names come from the summaries in the stored event data
+    data = json.loads(row['data'])
+    service = reference('service', row['service_id'], row['service_html_url'], (data.get('service') or {}).get('summary'))
+    escalation_policy = reference('escalation_policy', row['escalation_policy_id'], row['escalation_policy_html_url'],
+                                  (data.get('escalation_policy') or {}).get('summary'))
+    # the agent of a webhook event is only known by its url
+    last_status_change_by = reference('agent', row['last_status_change_by'], row['last_status_change_by']) if row['last_status_change_by'] else None
+    return IncidentRecord(row['incident_number'], row['id'], row['status'], row['title'], service, escalation_policy,
+                          row['created_at'], last_status_change_by, row['last_status_change_at'])
@@ -0,0 +1,32 @@
+# one place for decoding the api responses and encoding json output
+# works on the raw response bytes, which skips building the intermediate str of response.text, and uses orjson
+# when it is installed, falling back to the standard library otherwise.
+# set PD_JSON_BACKEND=json to force the standard library, e.g. to compare with benchmarks/bench_json.py
+
+import json
+import os
+
+backend = 'json'
+if os.environ.get('PD_JSON_BACKEND', 'orjson') == 'orjson':
+    try:
+        import orjson
+        backend = 'orjson'
+    except ImportError:
+        pass
+
+if backend == 'orjson':
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        # the same compact, utf-8 output as orjson, so the files written do not depend on the backend
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+def decode_response(response):
+    return loads(response.content)
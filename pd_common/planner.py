@@ -0,0 +1,56 @@
+# pre-flight cost planner for the mass update scripts (--plan)
+# the matching objects are counted with total=true and the share of them that needs a change is estimated from
+# the first page, so a plan costs one or two GET requests and never sends a write.
+# the wall time estimate uses the latency measured on the probe requests, the configured concurrency and the
+# rate budget - PagerDuty allows 960 requests per minute per REST API key by default
+# more details about rate limits here - https://developer.pagerduty.com/docs/rest-api-rate-limits
+
+import math
+import time
+
+from pd_common.jsoncodec import decode_response
+
+DEFAULT_RATE_BUDGET = 960
+
+def probe(session, url, params, limit=100):
+    # first page of the list together with the total number of objects matching the filters
+    started = time.monotonic()
+    response = session.get(url, params=dict(params, limit=limit, offset=0, total='true'))
+    latency = time.monotonic() - started
+    response.raise_for_status()
+    return decode_response(response), latency
+
+def list_requests_for(total, limit=100):
+    return max(1, math.ceil(total / limit))
+
+def extrapolate(matching_on_first_page, first_page_size, total):
+    # share of the first page that needs a change, applied to the whole list
+    if not first_page_size:
+        return 0
+    return round(matching_on_first_page / first_page_size * total)
+
+def estimate_wall_time(request_count, concurrency, latency, rate_budget):
+    if not request_count:
+        return 0
+    per_second = concurrency / max(latency, 0.001)
+    if rate_budget:
+        per_second = min(per_second, rate_budget / 60)
+    return request_count / per_second
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(math.ceil(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h {minutes:02d}m {seconds:02d}s'
+
+def print_plan(objects, matching, list_requests, mutation_requests, list_concurrency, mutation_concurrency, latency, rate_budget=DEFAULT_RATE_BUDGET):
+    list_time = estimate_wall_time(list_requests, list_concurrency, latency, rate_budget)
+    mutation_time = estimate_wall_time(mutation_requests, mutation_concurrency, latency, rate_budget)
+    print('PLAN - no changes have been made to the account')
+    print(f'objects found: {objects}')
+    print(f'objects to change (estimated): {matching}')
+    print(f'list requests: {list_requests}')
+    print(f'mutation requests (estimated): {mutation_requests}')
+    print(f'measured latency: {latency * 1000:.0f} ms, rate budget: {rate_budget or "none"} requests/min')
+    print(f'estimated wall time: {format_duration(list_time + mutation_time)} '
+          f'(list {format_duration(list_time)} at concurrency {list_concurrency}, '
+          f'mutations {format_duration(mutation_time)} at concurrency {mutation_concurrency})')
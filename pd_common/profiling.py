@@ -0,0 +1,146 @@
+# built-in profiling for the --profile option of the scripts
+# a run is split into phases (fetch, transform, mutate, write ...) with `with profiler.phase('fetch'):`. for every
+# phase the wall time, a cProfile (<phase>.pstats) and the tracemalloc peak plus the top allocation sites are
+# recorded. the cProfile covers the calling thread and every thread started during the phase - the page pools and
+# the update workers - merged into one set of stats. threads started before the phase are only seen by the
+# sampler. phases are sequential - a phase opened inside another one only gets its wall time and memory figures,
+# cProfile can not nest.
+# a sampling thread takes the stacks of all the threads (the worker pools included) every few milliseconds and
+# writes them to stacks.collapsed, one "phase;frame;frame count" line per distinct stack - the format rendered by
+# flamegraph.pl, speedscope and friends. stacks passing through one of the `attribute` markers are counted under
+# that phase instead, e.g. {'jsoncodec.py': 'decode'} separates the decoding from the page fetching around it
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+class Profiler:
+    def __init__(self, directory=None, attribute=None, interval=0.005, top=10):
+        # without a directory every phase is a no-op, so the scripts can wrap their phases unconditionally
+        self.directory = directory
+        self.enabled = directory is not None
+        self.attribute = attribute or {'jsoncodec.py': 'decode'}
+        self.interval = interval
+        self.top = top
+        self.current = None
+        self.phases = []
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            tracemalloc.start()
+            self.stopped = threading.Event()
+            self.sampler = threading.Thread(target=self.sample, daemon=True)
+            self.sampler.start()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        outer, self.current = self.current, name
+        profile = cProfile.Profile() if outer is None else None
+        thread_profiles = []
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        if profile:
+            # the hook runs once in every new thread and hands the thread over to its own profile
+            threading.setprofile(lambda frame, event, arg: self.profile_thread(thread_profiles))
+            profile.enable()
+        stats = None
+        try:
+            yield
+        finally:
+            if profile:
+                threading.setprofile(None)
+                profile.disable()
+                stats = pstats.Stats(profile)
+                with self.lock:
+                    for thread_profile in thread_profiles:
+                        stats.add(thread_profile)
+                stats.dump_stats(os.path.join(self.directory, f'{name}.pstats'))
+            wall = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            ignore = [tracemalloc.Filter(False, module_file) for module_file in (tracemalloc.__file__, cProfile.__file__, __file__)]
+            sites = tracemalloc.take_snapshot().filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')[:self.top]
+            self.phases.append((name, wall, peak, sites, stats))
+            self.current = outer
+
+    def profile_thread(self, thread_profiles):
+        thread_profile = cProfile.Profile()
+        with self.lock:
+            thread_profiles.append(thread_profile)
+        thread_profile.enable()
+
+    def sample(self):
+        sampler_id = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            phase = self.current
+            if phase is None:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                stack.reverse()
+
+                # idle pool threads waiting for work are not part of any phase. a ThreadPoolExecutor worker blocks in
+                # the C level SimpleQueue.get, so its top python frame is _worker itself
+                if stack[-1].startswith('_worker (thread.py') or (
+                        stack[-1].startswith(('wait (threading.py', 'get (queue.py')) and any(entry.startswith('_worker (thread.py') for entry in stack)):
+                    continue
+
+                root = next((attributed for marker, attributed in self.attribute.items() if any(marker in entry for entry in stack)), phase)
+                self.stacks[';'.join([root] + stack)] += 1
+
+    def close(self):
+        # write stacks.collapsed and summary.txt, and print the summary
+        if not self.enabled:
+            return
+        self.stopped.set()
+        self.sampler.join()
+        tracemalloc.stop()
+
+        with open(os.path.join(self.directory, 'stacks.collapsed'), 'w') as collapsed_file:
+            collapsed_file.writelines(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+        samples = Counter()
+        for stack, count in self.stacks.items():
+            samples[stack.split(';', 1)[0]] += count
+        total_samples = sum(samples.values()) or 1
+
+        summary = io.StringIO()
+        summary.write(f"{'phase':<12}{'wall s':>10}{'peak MiB':>10}{'samples %':>11}\n")
+        for name, wall, peak, _, _ in self.phases:
+            summary.write(f'{name:<12}{wall:>10.2f}{peak / 2 ** 20:>10.1f}{100 * samples.pop(name, 0) / total_samples:>11.1f}\n')
+        # the attributed phases only exist in the samples
+        for name, count in samples.items():
+            summary.write(f"{name:<12}{'':>10}{'':>10}{100 * count / total_samples:>11.1f}\n")
+
+        for name, wall, peak, sites, stats in self.phases:
+            summary.write(f'\n== {name}: top allocation sites\n')
+            for site in sites:
+                summary.write(f'{site}\n')
+            if stats:
+                summary.write(f'\n== {name}: top functions by cumulative time, all threads ({name}.pstats)\n')
+                stats.stream = summary
+                stats.sort_stats('cumulative').print_stats(self.top)
+
+        with open(os.path.join(self.directory, 'summary.txt'), 'w') as summary_file:
+            summary_file.write(summary.getvalue())
+        print(summary.getvalue().split('\n==', 1)[0])
+        print(f'profile saved in {self.directory} - summary.txt, stacks.collapsed and one .pstats file per phase')
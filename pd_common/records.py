@@ -0,0 +1,78 @@
+# compact records for the large incident and user lists
+# the list endpoints return full objects with nested service, escalation policy, log entry and team references,
+# while the scripts only use a handful of fields. every page is projected into __slots__ records as soon as it
+# arrives, so the raw dicts can be freed straight away. values repeated across many records are shared - statuses
+# and user types are interned, and service, escalation policy and user references become shared Reference objects
+
+import sys
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Reference:
+    # one shared object per referenced service, escalation policy or user - all the records pointing at the same
+    # object hold the same Reference, so a name looked up once is seen by every one of them
+    __slots__ = ('kind', 'id', 'html_url', 'name')
+
+    def __init__(self, kind, id, html_url, name):
+        self.kind = kind
+        self.id = id
+        self.html_url = html_url
+        self.name = name
+
+_references = {}
+
+def reference(kind, object_id, html_url=None, name=None):
+    shared = _references.get((kind, object_id))
+    if shared is None:
+        shared = _references[(kind, object_id)] = Reference(_intern(kind), object_id, html_url, name)
+    elif name and not shared.name:
+        shared.name = name
+    return shared
+
+def _project_reference(api_reference):
+    # references can be missing or null, e.g. last_status_change_by on some incidents. their summary is the name
+    if not api_reference:
+        return None
+    return reference(api_reference['type'].replace('_reference', ''), api_reference['id'], api_reference.get('html_url'), api_reference.get('summary'))
+
+class IncidentRecord:
+    __slots__ = ('incident_number', 'id', 'status', 'title', 'service', 'escalation_policy', 'created_at',
+                 'last_status_change_by', 'last_status_change_at')
+
+    def __init__(self, incident_number, id, status, title, service, escalation_policy, created_at,
+                 last_status_change_by, last_status_change_at):
+        self.incident_number = incident_number
+        self.id = id
+        self.status = status
+        self.title = title
+        self.service = service
+        self.escalation_policy = escalation_policy
+        self.created_at = created_at
+        self.last_status_change_by = last_status_change_by
+        self.last_status_change_at = last_status_change_at
+
+def project_incident(incident):
+    return IncidentRecord(
+        incident['incident_number'],
+        incident['id'],
+        _intern(incident['status']),
+        incident['title'],
+        _project_reference(incident['service']),
+        _project_reference(incident['escalation_policy']),
+        incident['created_at'],
+        _project_reference(incident.get('last_status_change_by')),
+        incident['last_status_change_at']
+    )
+
+class UserRecord:
+    __slots__ = ('id', 'type', 'name', 'email')
+
+    def __init__(self, id, type, name, email):
+        self.id = id
+        self.type = type
+        self.name = name
+        self.email = email
+
+def project_user(user):
+    return UserRecord(user['id'], _intern(user['type']), user['name'], user['email'])
@@ -0,0 +1,79 @@
+# name lookups for the service, escalation policy and user references of the incident records
+# most references already carry the name in their summary, the resolver is only asked for the ones which do not.
+# every (kind, id) is fetched at most once while it stays in the bounded LRU cache. the cache can instead be
+# seeded up front with one crawl of the list endpoint of every kind that has references without a name - the cache
+# grows to hold everything prefetched, so a large account does not evict one kind while crawling the next
+
+from collections import OrderedDict
+import threading
+
+from pd_common.autotune import AdaptiveConcurrency, iter_pages
+from pd_common.jsoncodec import decode_response
+
+# reference kind -> list endpoint
+endpoints = {
+    'service': 'services',
+    'escalation_policy': 'escalation_policies',
+    'user': 'users'
+}
+
+class ReferenceResolver:
+    def __init__(self, session, maxsize=4096):
+        self.session = session
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits, self.requests = 0, 0
+
+    def remember(self, kind, object_id, name):
+        with self.lock:
+            self.cache[(kind, object_id)] = name
+            self.cache.move_to_end((kind, object_id))
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+
+    def prefetch(self, kinds=tuple(endpoints), controller=None):
+        controller = controller or AdaptiveConcurrency()
+        for kind in kinds:
+            names = {}
+            for page in iter_pages(self.session, f'https://api.pagerduty.com/{endpoints[kind]}', {}, controller):
+                self.requests += 1
+                names.update((item['id'], item['name']) for item in page[endpoints[kind]])
+            with self.lock:
+                self.maxsize = max(self.maxsize, len(self.cache) + len(names))
+            for object_id, name in names.items():
+                self.remember(kind, object_id, name)
+
+    def name(self, kind, object_id):
+        with self.lock:
+            if (kind, object_id) in self.cache:
+                self.hits += 1
+                self.cache.move_to_end((kind, object_id))
+                return self.cache[(kind, object_id)]
+
+        # unknown kinds (e.g. the agents of webhook events) can not be looked up
+        if kind not in endpoints:
+            return None
+
+        response = self.session.get(f'https://api.pagerduty.com/{endpoints[kind]}/{object_id}')
+        self.requests += 1
+        name = decode_response(response)[kind]['name'] if response.ok else None
+        self.remember(kind, object_id, name)
+        return name
+
+def enrich_names(records, resolver, fields=('service', 'escalation_policy', 'last_status_change_by'), prefetch=False, controller=None):
+    # the references are shared between the records, so every distinct one is looked at once. with prefetch, only
+    # the kinds which have a reference without a name are crawled
+    unique = {}
+    for record in records:
+        for field in fields:
+            shared = getattr(record, field)
+            if shared is not None and not shared.name:
+                unique[id(shared)] = shared
+
+    kinds = [kind for kind in endpoints if any(shared.kind == kind for shared in unique.values())]
+    if prefetch and kinds:
+        resolver.prefetch(kinds, controller)
+    for shared in unique.values():
+        shared.name = resolver.name(shared.kind, shared.id)
+    return len(unique)
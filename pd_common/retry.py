@@ -0,0 +1,130 @@
+# retries for the write (mutation) requests
+# a mutation is a plain dict - {'method': 'PUT', 'url': '...', 'json': {...}, 'description': '...'} - so that it
+# can be written as one line of a dead letter file and replayed later with redrive_dead_letters.py
+# transient errors (429, 5xx, connection errors) are retried with exponential backoff and full jitter.
+# a circuit breaker pauses all the senders when too many of the recent requests failed, and the mutations
+# which still fail after the last attempt are appended to the dead letter file. by default every script run gets
+# its own file, so a redrive never replays the failures of another script or of an older run
+
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import requests
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class CircuitBreaker:
+    def __init__(self, window=50, threshold=0.5, cooldown=30, min_requests=10):
+        # open the circuit when at least `threshold` of the last `window` requests failed
+        self.outcomes = deque(maxlen=window)
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.min_requests = min_requests
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        # block while the circuit is open
+        while True:
+            with self.lock:
+                remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record(self, success):
+        with self.lock:
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) >= self.min_requests and failures / len(self.outcomes) >= self.threshold:
+                print(f'Error rate spiked ({failures} of the last {len(self.outcomes)} requests failed). Pausing for {self.cooldown} seconds.')
+                self.open_until = time.monotonic() + self.cooldown
+                self.outcomes.clear()
+
+class DeadLetterFile:
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def write(self, mutation, status_code, error, attempts):
+        record = dict(mutation, status_code=status_code, error=error, attempts=attempts,
+                      failed_at=datetime.now(timezone.utc).isoformat())
+        with self.lock:
+            with open(self.path, 'a') as dead_letter_fh:
+                dead_letter_fh.write(json.dumps(record) + '\n')
+            self.count += 1
+
+def default_dead_letter_path(script):
+    return 'dead_letters_{}_{}.jsonl'.format(script, datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ'))
+
+def read_dead_letters(path):
+    # strip the failure details, only the mutation itself is replayed
+    with open(path) as dead_letter_fh:
+        for line in dead_letter_fh:
+            if line.strip():
+                record = json.loads(line)
+                yield {key: record[key] for key in ('method', 'url', 'json', 'description') if key in record}
+
+class RetryingSender:
+    def __init__(self, session, dead_letters=None, breaker=None, max_attempts=5, base_delay=1, max_delay=60, timeout=60):
+        self.session = session
+        self.timeout = timeout
+        self.dead_letters = dead_letters
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def worst_case_seconds(self):
+        # the longest one send() can take - every attempt timing out, the longest backoffs and the circuit breaker
+        # opening before every attempt. used to size the work queue leases
+        backoffs = sum(min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) for attempt in range(1, self.max_attempts))
+        return self.max_attempts * (self.timeout + self.breaker.cooldown) + backoffs
+
+    def backoff(self, attempt, response):
+        # honour the Retry-After header of a throttled request, otherwise exponential backoff with full jitter
+        if response is not None and response.status_code == 429 and 'Retry-After' in response.headers:
+            return float(response.headers['Retry-After'])
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def send(self, mutation):
+        # returns the last response, or None if the request never got one
+        response, error = None, None
+        for attempt in range(1, self.max_attempts + 1):
+            self.breaker.wait()
+            try:
+                response, error = self.session.request(mutation['method'], mutation['url'], json=mutation.get('json'), timeout=self.timeout), None
+            except requests.RequestException as ex:
+                response, error = None, str(ex)
+
+            if response is not None and response.ok:
+                self.breaker.record(True)
+                return response
+
+            # 4xx responses other than 429 are not going to get better by sending them again
+            if response is not None and response.status_code not in RETRYABLE_STATUS_CODES:
+                break
+
+            self.breaker.record(False)
+            if attempt < self.max_attempts:
+                time.sleep(self.backoff(attempt, response))
+
+        if self.dead_letters:
+            status_code = response.status_code if response is not None else None
+            self.dead_letters.write(mutation, status_code, error if response is None else response.text, attempt)
+        return response
+
+def send_mutation(sender, mutation):
+    # send one mutation and print its outcome, True when it went through
+    response = sender.send(mutation)
+    if response is not None and response.ok:
+        print('SUCCESS - ' + mutation.get('description', mutation['url']))
+        return True
+
+    print('FAILED - ' + mutation.get('description', mutation['url']) + ' - ' + (response.text if response is not None else 'no response'))
+    return False
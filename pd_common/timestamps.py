@@ -0,0 +1,14 @@
+# timestamps of the api responses, the webhook events and the command line options
+# the api writes them with or without fractional seconds and the options may carry any utc offset, so the strings
+# do not sort in time order - compare parsed values, or the fixed width utc strings of utc_string
+
+from datetime import datetime, timezone
+
+def parse_time(value):
+    # python < 3.11 does not understand the Z suffix. values without an offset are taken as utc
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def utc_string(value):
+    # e.g. 2021-01-01T00:00:00.000000Z - these compare as strings in time order
+    return parse_time(value).astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
@@ -0,0 +1,92 @@
+# shared work queue for the mass mutations, stored in a SQLite file
+# the mass update scripts publish their mutations (see pd_common.retry for the format) with --publish-to and any
+# number of workqueue_worker.py processes, each with its own api key if needed, pull them in leased batches.
+# a lease expires after lease_seconds, so the work of a crashed worker goes back to the queue, and only the
+# worker holding the lease can acknowledge a task. workers renew the lease of a task right before sending it.
+# a mutation is identified by a hash of its method, url and payload - publishing it again while it is still
+# pending or leased is a no-op, publishing it after it was done or failed queues it again
+# to share the queue between hosts put the file on a shared filesystem with working file locks
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+def dedupe_key(mutation):
+    identity = json.dumps([mutation['method'], mutation['url'], mutation.get('json')], sort_keys=True)
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+class WorkQueue:
+    def __init__(self, path, lease_seconds=300):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        # one connection per queue object, shared by the sender threads of a worker
+        self.lock = threading.Lock()
+        # autocommit mode, the transactions are opened explicitly below
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            dedupe_key TEXT UNIQUE,
+            mutation TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            lease_owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT)''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expires)')
+
+    def publish(self, mutations):
+        # returns the number of new (or queued again) tasks, mutations still waiting in the queue are skipped
+        rows = [(dedupe_key(mutation), json.dumps(mutation)) for mutation in mutations]
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            before = self.connection.total_changes
+            self.connection.executemany('''INSERT INTO tasks (dedupe_key, mutation) VALUES (?, ?)
+                ON CONFLICT (dedupe_key) DO UPDATE SET state = 'pending', mutation = excluded.mutation, lease_owner = NULL,
+                    lease_expires = NULL, attempts = 0, last_error = NULL
+                WHERE tasks.state IN ('done', 'failed')''', rows)
+            published = self.connection.total_changes - before
+            self.connection.execute('COMMIT')
+        return published
+
+    def lease(self, owner, count):
+        # BEGIN IMMEDIATE takes the write lock, so two workers can never lease the same task
+        now = time.time()
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self.connection.execute('''SELECT id, mutation FROM tasks
+                    WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                    ORDER BY id LIMIT ?''', (now, count)).fetchall()
+                self.connection.executemany('''UPDATE tasks SET state = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+                    WHERE id = ?''', [(owner, now + self.lease_seconds, task_id) for task_id, _ in rows])
+                self.connection.execute('COMMIT')
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+        return [(task_id, json.loads(mutation)) for task_id, mutation in rows]
+
+    def renew(self, task_id, owner):
+        # push the lease of one task out again, false when it is not held by this owner anymore
+        with self.lock:
+            cursor = self.connection.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                                             (time.time() + self.lease_seconds, task_id, owner))
+        return cursor.rowcount == 1
+
+    def ack(self, task_id, owner):
+        # false when the lease expired and the task was handed to another worker in the meantime
+        with self.lock:
+            cursor = self.connection.execute("UPDATE tasks SET state = 'done', lease_expires = NULL WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                                             (task_id, owner))
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, owner, error):
+        with self.lock:
+            cursor = self.connection.execute("UPDATE tasks SET state = 'failed', lease_expires = NULL, last_error = ? WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                                             (error, task_id, owner))
+        return cursor.rowcount == 1
+
+    def counts(self):
+        with self.lock:
+            return dict(self.connection.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
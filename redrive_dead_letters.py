@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# replay the mutations collected in a dead letter file by one of the mass update scripts
+# only the failed mutations are sent again. the ones failing again are written to a new dead letter file,
+# so the command can be repeated on its output until nothing is left
+
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from pd_common.retry import DeadLetterFile, RetryingSender, read_dead_letters, send_mutation
+
+parser = argparse.ArgumentParser(description='Replay the failed mutations from a dead letter file.')
+parser.add_argument('-k', '--api-key', required=True, type=str, help='REST API key with write access from the account.')
+parser.add_argument('-f', '--file', required=True, type=str, help='dead letter file (JSONL) written by one of the scripts.')
+parser.add_argument('--from-email', type=str, help='email of a valid user in the account. required when replaying incident updates.')
+parser.add_argument('-o', '--output', type=str, help='dead letter file for the mutations failing again. defaults to FILE.remaining.jsonl')
+parser.add_argument('-w', '--workers', type=int, default=4, help='number of mutations replayed concurrently. default 4')
+
+args = parser.parse_args()
+
+header =    {
+                'Accept':'application/vnd.pagerduty+json;version=2',
+                'Content-Type': 'application/json',
+                'Authorization':'Token token=' + args.api_key
+            }
+if args.from_email:
+    header['From'] = args.from_email
+
+mutations = list(read_dead_letters(args.file))
+dead_letters = DeadLetterFile(args.output or args.file + '.remaining.jsonl')
+
+with requests.Session() as session:
+    session.headers.update(header)
+    sender = RetryingSender(session, dead_letters)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        total_replayed = sum(pool.map(lambda mutation: send_mutation(sender, mutation), mutations))
+
+print('total mutations replayed: {}\ntotal mutations failed again: {}'.format(total_replayed, dead_letters.count))
+if dead_letters.count:
+    print('Failed mutations saved in file - {}'.format(dead_letters.path))
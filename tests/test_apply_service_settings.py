@@ -0,0 +1,62 @@
+import importlib.util
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mass_update_service_settings'))
+# the script imports requests at the top
+requests_installed = importlib.util.find_spec('requests') is not None
+if requests_installed:
+    import apply_service_settings
+    from apply_service_settings import plan_update
+
+def service(**fields):
+    current = {'id': 'S1', 'name': 'web', 'escalation_policy': {'id': 'E1'}, 'acknowledgement_timeout': 1800,
+               'auto_resolve_timeout': None, 'alert_creation': 'create_alerts_and_incidents',
+               'incident_urgency_rule': {'type': 'constant', 'urgency': 'high'},
+               'alert_grouping_parameters': {'type': 'time', 'config': {'timeout': 5}}}
+    current.update(fields)
+    return current
+
+@unittest.skipUnless(requests_installed, 'requests is not installed')
+class PlanUpdateTest(unittest.TestCase):
+    def test_matching_settings_need_no_update(self):
+        self.assertIsNone(plan_update(service(), {'escalation_policy': 'E1', 'acknowledgement_timeout': 1800, 'auto_resolve_timeout': None,
+                                                  'incident_urgency': {'type': 'constant', 'urgency': 'high'},
+                                                  'alert_grouping': 'time', 'alert_grouping_timeout': 5}))
+
+    def test_only_the_changed_settings_are_sent(self):
+        mutation = plan_update(service(), {'escalation_policy': 'E2', 'acknowledgement_timeout': 1800, 'auto_resolve_timeout': 14400})
+        self.assertEqual(mutation['method'], 'PUT')
+        self.assertEqual(mutation['url'], 'https://api.pagerduty.com/services/S1')
+        self.assertEqual(mutation['json'], {'service': {'type': 'service', 'auto_resolve_timeout': 14400,
+                                                        'escalation_policy': {'id': 'E2', 'type': 'escalation_policy_reference'}}})
+
+    def test_grouping_config_is_sent_whole(self):
+        mutation = plan_update(service(), {'alert_grouping_timeout': 10})
+        self.assertEqual(mutation['json']['service'], {'type': 'service', 'alert_grouping_parameters': {'type': 'time', 'config': {'timeout': 10}}})
+
+        # switching the type drops the config of the old one
+        mutation = plan_update(service(), {'alert_grouping': 'intelligent'})
+        self.assertEqual(mutation['json']['service']['alert_grouping_parameters'], {'type': 'intelligent'})
+
+    def test_content_based_fields_compare_in_any_order(self):
+        current = service(alert_grouping_parameters={'type': 'content_based', 'config': {'aggregate': 'all', 'fields': ['summary', 'source']}})
+        self.assertIsNone(plan_update(current, {'alert_grouping_fields': apply_service_settings.parse_fields('source;summary')}))
+
+    def test_grouping_settings_which_do_not_fit_together(self):
+        with self.assertRaisesRegex(ValueError, 'alert_grouping_timeout can not be used with alert grouping intelligent'):
+            plan_update(service(), {'alert_grouping': 'intelligent', 'alert_grouping_timeout': 5})
+        with self.assertRaisesRegex(ValueError, 'needs alert_grouping_fields'):
+            plan_update(service(), {'alert_grouping': 'content_based', 'alert_grouping_aggregate': 'any'})
+        with self.assertRaisesRegex(ValueError, 'unsupported current alert grouping'):
+            plan_update(service(alert_grouping_parameters={'type': 'rules'}), {'alert_grouping_timeout': 5})
+
+    def test_cell_parsers(self):
+        self.assertIsNone(apply_service_settings.parse_timeout('off'))
+        self.assertEqual(apply_service_settings.parse_fields(' summary ; source ;'), ['source', 'summary'])
+        with self.assertRaises(ValueError):
+            apply_service_settings.parse_urgency('urgent')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common import autotune
+from pd_common.autotune import MAX_OFFSET, AdaptiveConcurrency, get_page, iter_pages
+
+class FakeResponse:
+    def __init__(self, status_code, body, headers=None):
+        self.status_code = status_code
+        self.content = json.dumps(body).encode()
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f'status {self.status_code}')
+
+class FakeSession:
+    # a paginated list of `count` objects which records the peak number of requests in flight
+    def __init__(self, count):
+        self.count = count
+        self.lock = threading.Lock()
+        self.in_flight, self.peak = 0, 0
+        self.offsets = []
+
+    def get(self, url, params=None):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            self.offsets.append(params.get('offset', 0))
+        try:
+            time.sleep(0.002)
+            offset, limit = params.get('offset', 0), params.get('limit', 100)
+            if offset >= MAX_OFFSET:
+                return FakeResponse(400, {})
+            items = list(range(offset, min(offset + limit, self.count)))
+            return FakeResponse(200, {'items': items, 'more': offset + limit < self.count, 'total': self.count if params.get('total') == 'true' else None})
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+class GlobalLimitTest(unittest.TestCase):
+    def test_crawls_sharing_a_controller_share_its_limit(self):
+        session = FakeSession(3000)
+        controller = AdaptiveConcurrency(pinned=3)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            crawls = [pool.submit(lambda: [item for page in iter_pages(session, 'url', {}, controller) for item in page['items']]) for _ in range(4)]
+            results = [crawl.result() for crawl in crawls]
+
+        self.assertEqual(results, [list(range(3000))] * 4)
+        self.assertLessEqual(session.peak, 3)
+
+    def test_get_page_calls_are_bounded_too(self):
+        session = FakeSession(100)
+        controller = AdaptiveConcurrency(pinned=2)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: get_page(session, 'url', {}, controller), range(32)))
+        self.assertLessEqual(session.peak, 2)
+        self.assertEqual(controller.in_flight, 0)
+
+class OffsetCapTest(unittest.TestCase):
+    def test_pages_past_the_offset_cap_are_not_requested(self):
+        session = FakeSession(MAX_OFFSET + 2345)
+        controller = AdaptiveConcurrency()
+        items = [item for page in iter_pages(session, 'url', {}, controller) for item in page['items']]
+
+        self.assertEqual(items, list(range(MAX_OFFSET)))
+        self.assertLess(max(session.offsets), MAX_OFFSET)
+        self.assertEqual(controller.truncated, 1)
+
+class RateBudgetTest(unittest.TestCase):
+    def test_the_environment_budget_is_shared_by_every_controller(self):
+        with mock.patch.dict(os.environ, {'PD_RATE_BUDGET': '600'}), mock.patch.object(autotune, '_process_budget', None):
+            first, second = AdaptiveConcurrency(), AdaptiveConcurrency()
+            self.assertIsNotNone(first.rate_budget)
+            self.assertIs(first.rate_budget, second.rate_budget)
+            self.assertIsNot(AdaptiveConcurrency(rate_budget=60).rate_budget, first.rate_budget)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import importlib.util
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'oncall_coverage'))
+# the script imports requests at the top
+requests_installed = importlib.util.find_spec('requests') is not None
+if requests_installed:
+    import coverage_gaps
+
+def at(hour):
+    return datetime(2021, 3, 4, tzinfo=timezone.utc) + timedelta(hours=hour)
+
+def oncall(start, end, user, level=1):
+    return {'escalation_policy': {'id': 'E1', 'summary': 'ops'}, 'escalation_level': level, 'user': {'summary': user},
+            'schedule': {'id': 'S1'}, 'start': start, 'end': end}
+
+@unittest.skipUnless(requests_installed, 'requests is not installed')
+class SweepTest(unittest.TestCase):
+    def test_back_to_back_shifts_are_neither_gap_nor_overlap(self):
+        gaps, overlaps = coverage_gaps.sweep([(at(0), at(8), 'ann'), (at(8), at(16), 'bob'), (at(16), at(24), 'ann')], at(0), at(24))
+        self.assertEqual((gaps, overlaps), ([], []))
+
+    def test_gaps_and_overlaps(self):
+        intervals = [(at(2), at(8), 'ann'), (at(6), at(10), 'bob'), (at(12), at(20), 'ann')]
+        gaps, overlaps = coverage_gaps.sweep(intervals, at(0), at(24))
+        self.assertEqual(gaps, [(at(0), at(2), []), (at(10), at(12), []), (at(20), at(24), [])])
+        self.assertEqual(overlaps, [(at(6), at(8), ['ann', 'bob'])])
+
+    def test_a_level_without_shifts_is_one_full_gap(self):
+        self.assertEqual(coverage_gaps.sweep([], at(0), at(24)), ([(at(0), at(24), [])], []))
+
+    def test_intervals_repeated_across_windows_are_counted_once(self):
+        # the same shift returned by two time windows, and a permanent entry without start and end on level 2
+        oncalls = [oncall('2021-03-04T02:00:00Z', '2021-03-04T08:00:00Z', 'ann')] * 2
+        oncalls.append(oncall(None, None, 'bob', level=2))
+        intervals, names = coverage_gaps.build_intervals(oncalls, at(0), at(24))
+
+        self.assertEqual(names, {'E1': 'ops'})
+        self.assertEqual(intervals[('E1', 1)], [(at(2), at(8), 'ann')])
+        self.assertEqual(intervals[('E1', 2)], [(at(0), at(24), 'bob')])
+        self.assertEqual(coverage_gaps.sweep(intervals[('E1', 1)], at(0), at(24))[1], [])
+
+if __name__ == '__main__':
+    unittest.main()
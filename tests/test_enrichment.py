@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.autotune import AdaptiveConcurrency
+from pd_common.enrichment import IncidentEnricher
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.content = json.dumps(body).encode()
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+class FakeSession:
+    # every incident has 350 alerts and one note, the peak number of requests in flight is recorded
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight, self.peak = 0, 0
+
+    def get(self, url, params=None):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            time.sleep(0.002)
+            if url.endswith('/notes'):
+                return FakeResponse({'notes': [{'id': 'N1'}]})
+            offset, limit = params['offset'], params['limit']
+            alerts = [{'id': f'A{number}'} for number in range(offset, min(offset + limit, 350))]
+            return FakeResponse({'alerts': alerts, 'more': offset + limit < 350, 'total': 350})
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+class EnrichmentLimitTest(unittest.TestCase):
+    def test_alert_pages_and_notes_stay_within_the_controller_limit(self):
+        session = FakeSession()
+        controller = AdaptiveConcurrency(pinned=4)
+        results = {}
+        enricher = IncidentEnricher(session, controller, lambda incident, alerts, notes: results.update({incident['id']: (len(alerts), len(notes))}), workers=8)
+        for number in range(20):
+            enricher.submit({'id': f'P{number}'})
+        enricher.close()
+
+        self.assertEqual(results, {f'P{number}': (350, 1) for number in range(20)})
+        self.assertLessEqual(session.peak, 4)
+
+if __name__ == '__main__':
+    unittest.main()
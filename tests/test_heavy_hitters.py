@@ -0,0 +1,48 @@
+import importlib.util
+import os
+import random
+import sys
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_incidents_report'))
+# the script imports requests at the top
+requests_installed = importlib.util.find_spec('requests') is not None
+if requests_installed:
+    import heavy_hitters
+
+@unittest.skipUnless(requests_installed, 'requests is not installed')
+class SpaceSavingTest(unittest.TestCase):
+    def test_exact_counts_while_under_capacity(self):
+        summary = heavy_hitters.SpaceSaving(10)
+        for key in 'aaabbc':
+            summary.add(key)
+        self.assertEqual(summary.top(10), [('a', 3, 0), ('b', 2, 0), ('c', 1, 0)])
+        self.assertEqual(summary.top(1), [('a', 3, 0)])
+
+    def test_counts_over_capacity_stay_within_the_error_bound(self):
+        rng = random.Random(7)
+        # a few heavy keys in a long tail of rare ones
+        stream = [f'heavy-{rng.randrange(5)}' for _ in range(3000)] + [f'rare-{rng.randrange(2000)}' for _ in range(3000)]
+        rng.shuffle(stream)
+        summary = heavy_hitters.SpaceSaving(50)
+        for key in stream:
+            summary.add(key)
+
+        exact = Counter(stream)
+        self.assertEqual(len(summary.counters), 50)
+        self.assertEqual(sum(count for _, count, _ in summary.top(50)), len(stream))
+        for key, count, error in summary.top(50):
+            # the count never underestimates and overestimates by at most the recorded error
+            self.assertGreaterEqual(count, exact[key])
+            self.assertLessEqual(count - error, exact[key])
+        # every key above n / capacity is guaranteed to be kept
+        self.assertEqual({key for key, _, _ in summary.top(5)}, {f'heavy-{number}' for number in range(5)})
+
+    def test_normalize_title(self):
+        self.assertEqual(heavy_hitters.normalize_title('Disk  full on web-12 (ID 0a1b2c3d-0000-4000-8000-00000000abcd)'),
+                         'disk full on web-# (id <uuid>)')
+        self.assertEqual(heavy_hitters.normalize_title('job deadbeefcafe1234 failed'), 'job <hex> failed')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.incident_store import IncidentStore
+
+def incident_event(status, occurred_at, created_at='2021-03-04T10:00:00Z', incident_id='P1'):
+    return {'event': {'resource_type': 'incident', 'event_type': f'incident.{status}', 'occurred_at': occurred_at,
+                      'agent': {'html_url': 'https://example.pagerduty.com/users/U1'},
+                      'data': {'type': 'incident', 'id': incident_id, 'number': 1, 'title': 'disk full', 'status': status,
+                               'urgency': 'high', 'created_at': created_at, 'service': {'id': 'S1', 'html_url': 'u', 'summary': 'web'},
+                               'escalation_policy': {'id': 'E1', 'html_url': 'u', 'summary': 'ops'}, 'teams': [{'id': 'T1'}]}}}
+
+class IncidentStoreTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = IncidentStore(os.path.join(directory.name, 'incidents.db'))
+
+    def status(self):
+        return [row['status'] for row in self.store.open_incidents(statuses=('triggered', 'acknowledged', 'resolved'))]
+
+    def test_later_event_with_fractional_seconds_wins(self):
+        self.assertTrue(self.store.apply_event(incident_event('triggered', '2021-03-04T10:11:22Z')))
+        self.assertTrue(self.store.apply_event(incident_event('acknowledged', '2021-03-04T10:11:22.500Z')))
+        self.assertEqual(self.status(), ['acknowledged'])
+
+    def test_older_event_is_ignored(self):
+        self.store.apply_event(incident_event('resolved', '2021-03-04T10:15:00.250Z'))
+        self.assertFalse(self.store.apply_event(incident_event('acknowledged', '2021-03-04T10:15:00Z')))
+        self.assertEqual(self.status(), ['resolved'])
+
+    def test_status_change_fields_only_move_on_a_new_status(self):
+        self.store.apply_event(incident_event('acknowledged', '2021-03-04T10:11:22Z'))
+        self.assertTrue(self.store.apply_event(incident_event('acknowledged', '2021-03-04T10:20:00Z')))
+        [row] = self.store.open_incidents()
+        self.assertEqual((row['status'], row['last_status_change_at'], row['last_event_at']),
+                         ('acknowledged', '2021-03-04T10:11:22.000000Z', '2021-03-04T10:20:00.000000Z'))
+
+        # a resolved incident is kept but not open anymore
+        self.assertTrue(self.store.apply_event(incident_event('resolved', '2021-03-04T10:30:00Z')))
+        self.assertEqual(self.store.open_incidents(), [])
+        self.assertEqual(self.status(), ['resolved'])
+
+    def test_since_and_until_with_offsets(self):
+        self.store.apply_event(incident_event('triggered', '2021-03-04T10:11:22Z', created_at='2021-03-04T10:00:00Z'))
+        # 11:30+02:00 is 09:30 utc, before the incident was created
+        self.assertEqual(len(self.store.open_incidents(since='2021-03-04T11:30:00+02:00')), 1)
+        self.assertEqual(len(self.store.open_incidents(until='2021-03-04T11:30:00+02:00')), 0)
+        self.assertEqual(len(self.store.open_incidents(since='2021-03-04T10:00:00.000Z', until='2021-03-04T10:00:01Z')), 1)
+
+    def test_other_resources_are_ignored_and_malformed_events_rejected(self):
+        self.assertFalse(self.store.apply_event({'event': {'resource_type': 'service', 'data': {'type': 'service'}}}))
+        with self.assertRaises(ValueError):
+            self.store.apply_event({'event': {'resource_type': 'incident', 'data': {'type': 'incident', 'id': 'P1'}}})
+        with self.assertRaises(ValueError):
+            self.store.apply_event([1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import csv
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'get_incidents_report'))
+from incidents_archive import IncidentsArchive, merge_sorted
+
+def write_report(path, numbers, title='disk full'):
+    with open(path, 'w', newline='') as csv_fh:
+        writer = csv.DictWriter(csv_fh, fieldnames=['incident number', 'incident id', 'created at', 'title'])
+        writer.writeheader()
+        for number in numbers:
+            writer.writerow({'incident number': number, 'incident id': f'P{number:05d}',
+                             'created at': f'2021-03-04T{number // 60:02d}:{number % 60:02d}:00Z', 'title': title})
+
+class MergeSortedTest(unittest.TestCase):
+    def test_merge(self):
+        self.assertEqual(list(merge_sorted([1, 3, 5, 7], [2, 3, 8, 9])), [1, 2, 3, 3, 5, 7, 8, 9])
+        self.assertEqual(list(merge_sorted([], iter([(1, 0, 0)]))), [(1, 0, 0)])
+        self.assertEqual(list(merge_sorted([(1, 0, 0)], [])), [(1, 0, 0)])
+
+class IncidentsArchiveTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.archive = IncidentsArchive(os.path.join(self.directory, 'archive'))
+
+    def append(self, numbers, title='disk full'):
+        report = os.path.join(self.directory, 'incidents_report.csv')
+        write_report(report, numbers, title)
+        return self.archive.append(report, block_size=7)
+
+    def test_lookups_across_blocks_and_reports(self):
+        # reversed, so the index entries have to be sorted, and split over several blocks
+        self.assertEqual(self.append(range(50, 0, -1)), 50)
+        self.assertEqual(self.append([25, 60], title='disk still full'), 2)
+
+        self.assertEqual([row['title'] for row in self.archive.lookup('number', '25')], ['disk full', 'disk still full'])
+        self.assertEqual([row['incident number'] for row in self.archive.lookup('id', 'P00042')], ['42'])
+        self.assertEqual(self.archive.lookup('number', '61'), [])
+        self.assertEqual(self.archive.lookup('created_at', '2021-03-04T01:00:00Z')[0]['incident id'], 'P00060')
+
+    def test_time_range_is_in_created_at_order(self):
+        self.append([5, 1, 9, 3])
+        self.append([2])
+        rows = list(self.archive.time_range('2021-03-04T00:02:00Z', '2021-03-04T00:09:00Z'))
+        self.assertEqual([row['incident number'] for row in rows], ['2', '3', '5'])
+
+    def test_an_empty_archive(self):
+        self.assertEqual(self.archive.lookup('number', '1'), [])
+        self.assertEqual(list(self.archive.time_range('2021-01-01', '2022-01-01')), [])
+
+if __name__ == '__main__':
+    unittest.main()
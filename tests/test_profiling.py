@@ -0,0 +1,45 @@
+import os
+import pstats
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.profiling import Profiler
+
+class IdleWorkerSamplesTest(unittest.TestCase):
+    def test_idle_executor_workers_are_not_sampled(self):
+        with tempfile.TemporaryDirectory() as directory, ThreadPoolExecutor(max_workers=4) as pool:
+            # start the workers, then leave them idle for the whole phase
+            list(pool.map(abs, range(8)))
+            profiler = Profiler(directory, interval=0.002)
+            with profiler.phase('busy'):
+                deadline = time.monotonic() + 0.3
+                while time.monotonic() < deadline:
+                    sum(range(1000))
+            profiler.close()
+
+        self.assertTrue(profiler.stacks)
+        idle = [stack for stack in profiler.stacks if stack.rsplit(';', 1)[-1].startswith('_worker (thread.py')]
+        self.assertEqual(idle, [])
+
+def busy_worker_function():
+    return sum(number * number for number in range(200000))
+
+class WorkerThreadProfileTest(unittest.TestCase):
+    def test_threads_started_in_a_phase_are_in_its_pstats(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = Profiler(directory)
+            with profiler.phase('mutate'):
+                with ThreadPoolExecutor(max_workers=3) as pool:
+                    list(pool.map(lambda _: busy_worker_function(), range(6)))
+            profiler.close()
+            stats = pstats.Stats(os.path.join(directory, 'mutate.pstats'))
+
+        calls = [call_count for (_, _, function), (_, call_count, _, _, _) in stats.stats.items() if function == 'busy_worker_function']
+        self.assertEqual(calls, [6])
+
+if __name__ == '__main__':
+    unittest.main()
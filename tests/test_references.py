@@ -0,0 +1,61 @@
+import json
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.autotune import AdaptiveConcurrency
+from pd_common.records import Reference
+from pd_common.references import ReferenceResolver, enrich_names
+
+class FakeResponse:
+    status_code = 200
+    ok = True
+    headers = {}
+
+    def __init__(self, body):
+        self.content = json.dumps(body).encode()
+
+    def raise_for_status(self):
+        pass
+
+class FakeSession:
+    # /users lists 5000 users, /services two services
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, params=None):
+        self.urls.append(url)
+        kind = url.rsplit('/', 1)[-1]
+        count = 5000 if kind == 'users' else 2
+        offset, limit = params['offset'], params['limit']
+        items = [{'id': f'{kind}{number}', 'name': f'{kind} {number}'} for number in range(offset, min(offset + limit, count))]
+        return FakeResponse({kind: items, 'more': offset + limit < count, 'total': count})
+
+def record(service, user):
+    return SimpleNamespace(service=service, escalation_policy=None, last_status_change_by=user)
+
+class PrefetchTest(unittest.TestCase):
+    def test_nothing_is_prefetched_when_every_reference_has_a_name(self):
+        session = FakeSession()
+        records = [record(Reference('service', 'services1', None, 'web'), None)]
+        self.assertEqual(enrich_names(records, ReferenceResolver(session), prefetch=True, controller=AdaptiveConcurrency()), 0)
+        self.assertEqual(session.urls, [])
+
+    def test_only_the_missing_kinds_are_prefetched_and_kept(self):
+        session = FakeSession()
+        resolver = ReferenceResolver(session, maxsize=100)
+        service = Reference('service', 'services1', None, None)
+        records = [record(service, Reference('user', 'users4999', None, None)), record(Reference('service', 'services0', None, 'api'), None)]
+        enrich_names(records, resolver, prefetch=True, controller=AdaptiveConcurrency())
+
+        self.assertEqual(service.name, 'services 1')
+        self.assertEqual(records[0].last_status_change_by.name, 'users 4999')
+        self.assertFalse(any(url.endswith('/escalation_policies') for url in session.urls))
+        # the users crawl did not evict the services
+        self.assertIn(('service', 'services0'), resolver.cache)
+        self.assertEqual(len(resolver.cache), 5002)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.workqueue import WorkQueue, dedupe_key
+
+def mutation(user_id, email='new@example.com'):
+    return {'method': 'PUT', 'url': f'https://api.pagerduty.com/users/{user_id}', 'json': {'user': {'email': email}},
+            'description': f'{user_id} email={email}'}
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'queue.sqlite')
+        self.queue = WorkQueue(self.path)
+        self.addCleanup(self.queue.connection.close)
+
+    def test_publishing_a_waiting_mutation_again_is_a_no_op(self):
+        self.assertEqual(self.queue.publish([mutation('P1'), mutation('P2')]), 2)
+        self.assertEqual(self.queue.publish([mutation('P1'), mutation('P2', 'other@example.com')]), 1)
+        self.assertEqual(self.queue.counts(), {'pending': 3})
+
+        # still a no-op while the task is leased
+        self.queue.lease('worker-1', 10)
+        self.assertEqual(self.queue.publish([mutation('P1')]), 0)
+
+    def test_the_description_is_not_part_of_the_identity(self):
+        renamed = dict(mutation('P1'), description='another description')
+        self.assertEqual(dedupe_key(mutation('P1')), dedupe_key(renamed))
+        self.assertNotEqual(dedupe_key(mutation('P1')), dedupe_key(mutation('P1', 'other@example.com')))
+
+    def test_done_and_failed_mutations_are_queued_again(self):
+        self.queue.publish([mutation('P1'), mutation('P2')])
+        (first, _), (second, _) = self.queue.lease('worker-1', 10)
+        self.assertTrue(self.queue.ack(first, 'worker-1'))
+        self.assertTrue(self.queue.fail(second, 'worker-1', '400 Bad Request'))
+        self.assertEqual(self.queue.counts(), {'done': 1, 'failed': 1})
+
+        self.assertEqual(self.queue.publish([mutation('P1'), mutation('P2')]), 2)
+        self.assertEqual(self.queue.counts(), {'pending': 2})
+        attempts = self.queue.connection.execute('SELECT attempts, last_error FROM tasks ORDER BY id').fetchall()
+        self.assertEqual(attempts, [(0, None), (0, None)])
+
+    def test_a_task_is_leased_to_one_worker_at_a_time(self):
+        self.queue.publish([mutation(f'P{number}') for number in range(5)])
+        # a second queue object is a second worker process on the same file
+        other = WorkQueue(self.path)
+        self.addCleanup(other.connection.close)
+
+        first = self.queue.lease('worker-1', 3)
+        second = other.lease('worker-2', 3)
+        self.assertEqual([task['url'] for _, task in first], [mutation(f'P{number}')['url'] for number in range(3)])
+        self.assertEqual(len(second), 2)
+        self.assertFalse({task_id for task_id, _ in first} & {task_id for task_id, _ in second})
+        self.assertEqual(self.queue.lease('worker-3', 3), [])
+
+    def test_an_expired_lease_goes_to_the_next_worker(self):
+        queue = WorkQueue(self.path, lease_seconds=0.05)
+        self.addCleanup(queue.connection.close)
+        queue.publish([mutation('P1')])
+        [(task_id, _)] = queue.lease('worker-1', 1)
+        self.assertEqual(queue.lease('worker-2', 1), [])
+
+        time.sleep(0.1)
+        self.assertEqual([leased for leased, _ in queue.lease('worker-2', 1)], [task_id])
+        # the first worker lost the task and can neither renew nor acknowledge it
+        self.assertFalse(queue.renew(task_id, 'worker-1'))
+        self.assertFalse(queue.ack(task_id, 'worker-1'))
+        self.assertFalse(queue.fail(task_id, 'worker-1', 'timeout'))
+        self.assertTrue(queue.ack(task_id, 'worker-2'))
+        self.assertEqual(queue.counts(), {'done': 1})
+        self.assertEqual(queue.connection.execute('SELECT attempts FROM tasks').fetchone(), (2,))
+
+    def test_renewing_keeps_the_lease(self):
+        queue = WorkQueue(self.path, lease_seconds=0.2)
+        self.addCleanup(queue.connection.close)
+        queue.publish([mutation('P1')])
+        [(task_id, _)] = queue.lease('worker-1', 1)
+
+        time.sleep(0.15)
+        self.assertTrue(queue.renew(task_id, 'worker-1'))
+        time.sleep(0.1)
+        self.assertEqual(queue.lease('worker-2', 1), [])
+        self.assertTrue(queue.ack(task_id, 'worker-1'))
+        # a finished task can not be acknowledged or renewed a second time
+        self.assertFalse(queue.ack(task_id, 'worker-1'))
+        self.assertFalse(queue.renew(task_id, 'worker-1'))
+
+if __name__ == '__main__':
+    unittest.main()
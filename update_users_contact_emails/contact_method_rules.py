@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# REST API Guide: https://api-reference.pagerduty.com
+# apply several contact method transforms to all users of an account in a single crawl of /users
+# the transforms replace running the add/remove .invalid, update emails and remove phone/sms scripts one after another:
+#   --append-invalid            add a .invalid suffix to the email contact methods
+#   --strip-invalid             remove the .invalid suffix from the email contact methods
+#   --rewrite-domain OLD=NEW    move email contact methods from one domain to another (can be repeated)
+#   --delete-phone              delete the phone contact methods
+#   --delete-sms                delete the sms contact methods
+# the transforms are applied in the order they are given on the command line. all the changes for one contact
+# method are merged into a single request (one PUT or one DELETE) and the requests are sent concurrently.
+# like remove_users_phone_and_sms_numbers.py, the notification rules using a deleted contact method are deleted
+# first - all of them - before the contact methods they depend on
+
+import argparse
+import os
+import sys
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common import planner
+from pd_common.autotune import AdaptiveConcurrency, iter_pages
+from pd_common.retry import DeadLetterFile, RetryingSender, default_dead_letter_path, send_mutation
+from pd_common.workqueue import WorkQueue
+
+url = 'https://api.pagerduty.com/users'
+# the notification rules come as full objects, with the id of the contact method they notify
+include = ['contact_methods', 'notification_rules']
+
+class RuleAction(argparse.Action):
+    # keep every rule in one list so that the command line order is the order they get applied in
+    def __call__(self, parser, namespace, values, option_string=None):
+        rules = getattr(namespace, 'rules', None) or []
+        rules.append((self.const, values))
+        setattr(namespace, 'rules', rules)
+
+def append_invalid(contact_method, state, value):
+    if contact_method['type'] == 'email_contact_method' and not state['address'].endswith('.invalid'):
+        state['address'] += '.invalid'
+
+def strip_invalid(contact_method, state, value):
+    if contact_method['type'] == 'email_contact_method' and state['address'].endswith('.invalid'):
+        state['address'] = state['address'][:-8]
+
+def rewrite_domain(contact_method, state, value):
+    old_domain, new_domain = value
+    if contact_method['type'] == 'email_contact_method':
+        local_part, _, domain = state['address'].rpartition('@')
+        if domain.lower() == old_domain.lower():
+            state['address'] = local_part + '@' + new_domain
+
+def delete_phone(contact_method, state, value):
+    if contact_method['type'] == 'phone_contact_method':
+        state['delete'] = True
+
+def delete_sms(contact_method, state, value):
+    if contact_method['type'] == 'sms_contact_method':
+        state['delete'] = True
+
+transforms = {
+    'append_invalid': append_invalid,
+    'strip_invalid': strip_invalid,
+    'rewrite_domain': rewrite_domain,
+    'delete_phone': delete_phone,
+    'delete_sms': delete_sms
+}
+
+def parse_domain_rewrite(value):
+    old_domain, separator, new_domain = value.partition('=')
+    if not separator or not old_domain or not new_domain:
+        raise argparse.ArgumentTypeError(f'expected OLD=NEW, got "{value}"')
+    return old_domain, new_domain
+
+def plan_mutation(user_id, contact_method, rules):
+    # run every rule against the contact method and merge the outcome into one mutation, or None if nothing changes
+    state = {'address': contact_method.get('address', ''), 'delete': False}
+    for rule_name, value in rules:
+        transforms[rule_name](contact_method, state, value)
+        # nothing else matters once the contact method is going away
+        if state['delete']:
+            return {'method': 'DELETE', 'url': f"{url}/{user_id}/contact_methods/{contact_method['id']}",
+                    'description': f"[{user_id}] delete {contact_method['type']} {contact_method.get('address', '')}"}
+
+    if state['address'] == contact_method.get('address', ''):
+        return None
+
+    payload = {
+        'contact_method': {
+            'type': contact_method['type'],
+            'label': contact_method['label'],
+            'address': state['address']
+        }
+    }
+    return {'method': 'PUT', 'url': f"{url}/{user_id}/contact_methods/{contact_method['id']}", 'json': payload,
+            'description': f"[{user_id}] {contact_method['address']} -> {state['address']}"}
+
+def plan_user(user, rules):
+    # the notification rule deletes and the contact method mutations of one user
+    mutations = [mutation for mutation in (plan_mutation(user['id'], contact_method, rules) for contact_method in user['contact_methods']) if mutation]
+
+    # index the contact methods going away by id, one set lookup per notification rule
+    deleted_ids = {mutation['url'].rsplit('/', 1)[-1] for mutation in mutations if mutation['method'] == 'DELETE'}
+    rule_deletes = []
+    for notification_rule in user.get('notification_rules', []):
+        contact_method = notification_rule.get('contact_method') or {}
+        if contact_method.get('id') in deleted_ids:
+            rule_deletes.append({'method': 'DELETE', 'url': f"{url}/{user['id']}/notification_rules/{notification_rule['id']}",
+                                 'description': f"[{user['id']}] delete notification rule {notification_rule['id']} using {contact_method['id']}"})
+    return rule_deletes, mutations
+
+def collect_mutations(session, rules, controller):
+    # one crawl of the users, with their contact methods and notification rules included
+    rule_deletes, mutations, total_scanned = [], [], 0
+    for users_list in iter_pages(session, url, {'include[]': include}, controller):
+        for user in users_list['users']:
+            total_scanned += len(user['contact_methods'])
+            user_rule_deletes, user_mutations = plan_user(user, rules)
+            rule_deletes += user_rule_deletes
+            mutations += user_mutations
+
+    return rule_deletes, mutations, total_scanned
+
+def plan_mutations(session, rules, workers, list_concurrency, rate_budget):
+    # count the users and run the rules against the first page only, then scale the mutations up to all the users
+    first_page, latency = planner.probe(session, url, {'include[]': include})
+    total_users = first_page['total']
+    planned = [plan_user(user, rules) for user in first_page['users']]
+    to_change = planner.extrapolate(sum(len(mutations) for _, mutations in planned), len(first_page['users']), total_users)
+    requests_needed = planner.extrapolate(sum(len(rule_deletes) + len(mutations) for rule_deletes, mutations in planned), len(first_page['users']), total_users)
+    planner.print_plan(total_users, to_change, planner.list_requests_for(total_users), requests_needed, list_concurrency, workers, latency, rate_budget)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply contact method transforms to all the users of a PagerDuty account in a single pass.')
+    parser.add_argument('-k', '--api-key', required=True, help='global api key with write access from the account')
+    parser.add_argument('--append-invalid', dest='rules', action=RuleAction, nargs=0, const='append_invalid', help='add a .invalid suffix to email contact methods')
+    parser.add_argument('--strip-invalid', dest='rules', action=RuleAction, nargs=0, const='strip_invalid', help='remove the .invalid suffix from email contact methods')
+    parser.add_argument('--rewrite-domain', dest='rules', action=RuleAction, const='rewrite_domain', type=parse_domain_rewrite, metavar='OLD=NEW', help='move email contact methods from the OLD domain to the NEW domain. can be repeated')
+    parser.add_argument('--delete-phone', dest='rules', action=RuleAction, nargs=0, const='delete_phone', help='delete phone contact methods')
+    parser.add_argument('--delete-sms', dest='rules', action=RuleAction, nargs=0, const='delete_sms', help='delete sms contact methods')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='number of mutation requests sent concurrently. default 8')
+    parser.add_argument('--dry-run', action='store_true', help='only print the changes, do not send them')
+    parser.add_argument('--publish-to', metavar='QUEUE', help='publish the mutations to a shared work queue file instead of sending them. run workqueue_worker.py against the same file to process them')
+    parser.add_argument('--plan', action='store_true', help='estimate the requests and run time from the first page of users. nothing is changed')
+    parser.add_argument('--rate-budget', type=float, default=planner.DEFAULT_RATE_BUDGET, help=f'requests per minute allowed for the api key, used by --plan. default {planner.DEFAULT_RATE_BUDGET}')
+    parser.add_argument('--dead-letter-file', help='file the failed mutations are saved to. default dead_letters_contact_method_rules_<utc timestamp>.jsonl, one file per run')
+    args = parser.parse_args()
+
+    if not getattr(args, 'rules', None):
+        parser.error('at least one transform is required')
+
+    with requests.Session() as session:
+        session.headers.update({
+            'Accept': 'application/vnd.pagerduty+json;version=2',
+            'Content-Type': 'application/json',
+            'Authorization': 'Token token=' + args.api_key
+        })
+
+        controller = AdaptiveConcurrency()
+        if args.plan:
+            plan_mutations(session, args.rules, args.workers, controller.concurrency(), args.rate_budget)
+            sys.exit()
+
+        rule_deletes, mutations, total_scanned = collect_mutations(session, args.rules, controller)
+
+        if args.dry_run:
+            for mutation in rule_deletes + mutations:
+                print('DRY RUN - ' + mutation['method'] + ' ' + mutation['description'])
+            total_changed, total_rules_deleted = 0, 0
+        elif args.publish_to:
+            # the queue workers do not keep any order, so the contact method deletes wait for the next run while
+            # notification rules still use them. the updates do not depend on anything and go out straight away
+            held_back = [mutation for mutation in mutations if rule_deletes and mutation['method'] == 'DELETE']
+            published = WorkQueue(args.publish_to).publish(rule_deletes + [mutation for mutation in mutations if not (rule_deletes and mutation['method'] == 'DELETE')])
+            print('Published {} mutations to {}. Start workqueue_worker.py --queue {} to process them.'.format(published, args.publish_to, args.publish_to))
+            if held_back:
+                print('{} contact method deletes were held back until their notification rules are gone. Run the script again with --publish-to once the workers are done.'.format(len(held_back)))
+            total_changed, total_rules_deleted = 0, 0
+        else:
+            # transient errors are retried, the mutations which still fail are saved for redrive_dead_letters.py
+            dead_letters = DeadLetterFile(args.dead_letter_file or default_dead_letter_path('contact_method_rules'))
+            sender = RetryingSender(session, dead_letters)
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                # every notification rule delete has finished before the contact methods go
+                total_rules_deleted = sum(pool.map(lambda mutation: send_mutation(sender, mutation), rule_deletes))
+                total_changed = sum(pool.map(lambda mutation: send_mutation(sender, mutation), mutations))
+
+    # print stats on cli
+    print('Total contact methods scanned: {}\nTotal notification rules to delete: {}\nTotal notification rules deleted: {}\nTotal contact methods to change: {}\nTotal contact methods changed: {}'.format(
+        total_scanned, len(rule_deletes), total_rules_deleted, len(mutations), total_changed))
+    if not (args.dry_run or args.publish_to) and dead_letters.count:
+        print('Failed mutations saved in file - {}. Replay them with redrive_dead_letters.py'.format(dead_letters.path))
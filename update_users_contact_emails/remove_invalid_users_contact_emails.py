@@ -5,7 +5,12 @@
 #       minor tweaks :)
 
 import requests
-import json
+import os
+import sys
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common.jsoncodec import decode_response
 
 # account definitions
 api_token = 'xxx'
@@ -28,7 +33,7 @@ while True:
     params = {'include[]': 'contact_methods', 'limit': limit, 'offset': offset}
 
     # Get the list of users from PD with their contact emails and convert it to JSON
-    users_list = json.loads(requests.get(url, params=params, headers=header).text)
+    users_list = decode_response(requests.get(url, params=params, headers=header))
 
     for user in users_list['users']:
         # working example: print(users_list['users'][0]['contact_methods'][0]['address'])
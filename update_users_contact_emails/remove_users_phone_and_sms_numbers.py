@@ -4,11 +4,31 @@
 # TODO: exception handling when no/invalid api_token is passed
 #       minor tweaks :)
 
+import argparse
 import requests
-import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common import planner
+from pd_common.jsoncodec import decode_response
+from pd_common.retry import DeadLetterFile, RetryingSender, default_dead_letter_path
+from pd_common.workqueue import WorkQueue
 
 # account definitions
 api_token = 'api_token'
+
+parser = argparse.ArgumentParser(description='Delete the phone and sms contact methods, and the notification rules using them, of all users.')
+parser.add_argument('-k', '--api-key', default=api_token, help='api key with write access from the account owner. default the api_token set in the script')
+parser.add_argument('--plan', action='store_true', help='only estimate the requests and run time from the first page of users. nothing is deleted')
+parser.add_argument('--rate-budget', type=float, default=planner.DEFAULT_RATE_BUDGET, help='requests per minute allowed for the api key, used by --plan. default {}'.format(planner.DEFAULT_RATE_BUDGET))
+parser.add_argument('--dead-letter-file', help='file the failed deletes are saved to. default dead_letters_remove_users_phone_and_sms_numbers_<utc timestamp>.jsonl, one file per run')
+parser.add_argument('--publish-to', metavar='QUEUE', help='publish the deletes to a shared work queue file instead of sending them. run workqueue_worker.py against the same file to process them')
+args = parser.parse_args()
+api_token = args.api_key
+
 url = 'https://api.pagerduty.com/users'
 header =    {
                 'Accept':'application/vnd.pagerduty+json;version=2',
@@ -21,66 +41,65 @@ header =    {
 limit = 100
 offset = 0
 
+# number of delete requests sent concurrently
+workers = 8
+
 # maintain a count
 total_scanned, total_phone_updates, total_sms_updates, total_notification_updates = 0, 0, 0, 0
 
 # define global lists to store the self urls for contact methods defined in user data
 phone_url_list, sms_url_list, notification_url_list = [], [], []
 
+def user_deletes(user):
+    # phone and sms contact methods of the user, and the notification rules using them
+    phone_and_sms_ids = {contact_method['id'] for contact_method in user['contact_methods'] if contact_method['type'] in ('phone_contact_method', 'sms_contact_method')}
+    rules = [notification_rule for notification_rule in user.get('notification_rules', []) if (notification_rule.get('contact_method') or {}).get('id') in phone_and_sms_ids]
+    return len(phone_and_sms_ids) + len(rules)
+
+# one probe request - the deletes for the users on the first page are extrapolated to all the users
+if args.plan:
+    session = requests.Session()
+    session.headers.update(header)
+    first_page, latency = planner.probe(session, url, {'include[]': ['contact_methods', 'notification_rules']})
+    total_users = first_page.get('total') or len(first_page['users'])
+    users_to_change = planner.extrapolate(sum(user_deletes(user) > 0 for user in first_page['users']), len(first_page['users']), total_users)
+    deletes = planner.extrapolate(sum(user_deletes(user) for user in first_page['users']), len(first_page['users']), total_users)
+    planner.print_plan(total_users, users_to_change, planner.list_requests_for(total_users, limit), deletes, 1, workers, latency, args.rate_budget)
+    sys.exit()
+
 while True:
-    params = {'include[]': 'contact_methods', 'limit': limit, 'offset': offset}
+    # the notification rules are included as full objects, with the id of the contact method they notify
+    params = {'include[]': ['contact_methods', 'notification_rules'], 'limit': limit, 'offset': offset}
 
     # Get the list of users from PD with their contact methods and convert it to JSON
-    users_list = json.loads(requests.get(url, params=params, headers=header).text)
+    users_list = decode_response(requests.get(url, params=params, headers=header))
 
     # contact methods
     for user in users_list['users']:
         # update the total count
         total_scanned+=1
-        
-        # working example: print(users_list['users'][0]['contact_methods'][0]['address'])
-        uid = user['id']
 
-        # reset the arrays for the current user
-        current_phone_url_list, current_sms_url_list = [], []
-        
+        # index the phone and sms contact methods of the user by id
+        phone_and_sms_ids = set()
+
         # this loop handles multiple contact methods, if any, for one user
-        # we have to get the phone and sms self url's, 
-        # save them to a local list then append this list to the global list to be deleted later
         for contact_method in user['contact_methods']: 
             # handle the phone contacts here
             if contact_method['type'] == 'phone_contact_method':
                 total_phone_updates+=1
-
-                # fetch the required url
-                phone_url = contact_method['self']
-                current_phone_url_list.append(phone_url)
+                phone_url_list.append(contact_method['self'])
+                phone_and_sms_ids.add(contact_method['id'])
             elif contact_method['type'] == 'sms_contact_method':
                 total_sms_updates+=1
+                sms_url_list.append(contact_method['self'])
+                phone_and_sms_ids.add(contact_method['id'])
 
-                # fetch the required url
-                sms_url = contact_method['self']
-                current_sms_url_list.append(sms_url)
-        
-        # for notification_rule in user['notification_rules']:
-        #     # we will have to go through all the notification rules to verify their use
-        #     # the phone number is in their summary field, extract the text from there
-        #     # iterate the phone numbers first
-        #     contact_method_id = notification_rule['summary'][-7:]
-        #     for phone_list_element in current_phone_url_list:
-        #         if phone_list_element[-7:] == contact_method_id:
-        #             total_notification_updates+=1
-        #             notification_url_list.append(notification_rule['self'])
-            
-        #     # iterate the sms numbers second
-        #     for sms_list_element in current_sms_url_list:
-        #         if sms_list_element[-7:] == contact_method_id:
-        #             total_notification_updates+=1
-        #             notification_url_list.append(notification_rule['self'])
-
-        # join the local url lists to global url lists
-        phone_url_list += current_phone_url_list
-        sms_url_list += current_sms_url_list
+        # the notification rules using one of those contact methods have to go first, one set lookup per rule
+        for notification_rule in user.get('notification_rules', []):
+            contact_method = notification_rule.get('contact_method') or {}
+            if contact_method.get('id') in phone_and_sms_ids:
+                total_notification_updates+=1
+                notification_url_list.append(notification_rule['self'])
 
     # condition to break out of infinite while loop
     if users_list['more'] == True:
@@ -88,32 +107,45 @@ while True:
     else:
         break
 
-# run the delete requests for the URLs collected above
-if phone_url_list:
-    for phone_url in phone_url_list:
-        print('deleting phone URL: {}'.format(phone_url))
-        phone_url_delete_response = requests.delete(phone_url, headers=header)
-        print(str(phone_url_delete_response.status_code) + ' - ' + phone_url_delete_response.text)
-else:
-    print('No Phone numbers found on account on any user')
-
-if sms_url_list:
-    for sms_url in sms_url_list:
-        print('deleting SMS URL: {}'.format(sms_url))
-        sms_url_delete_response = requests.delete(sms_url, headers=header)
-        print(str(sms_url_delete_response.status_code) + ' - ' + sms_url_delete_response.text)
-else:
-    print('No SMS numbers found on account on any account')
-
-# if notification_url_list:
-#     for notification_rule in notification_url_list:
-#         print('deleting notification rule: {}'.format(notification_rule))
-#         notification_url_delete_response = requests.delete(notification_rule, headers=header)
-#         print(str(notification_url_delete_response.status_code) + ' - ' +  notification_url_delete_response.text)
-# else:
-#     print('No Notification URLs found on account')
+def delete(delete_url):
+    response = sender.send({'method': 'DELETE', 'url': delete_url, 'description': delete_url})
+    if response is not None and response.ok:
+        print('deleted: {}'.format(delete_url))
+    else:
+        print('FAILED - {} - {}'.format(delete_url, response.text if response is not None else 'no response'))
+
+# the queue workers do not keep any order, so the notification rules are published on their own first. the contact
+# methods are published by the next run, once no notification rule uses them anymore
+if args.publish_to:
+    publish_urls = notification_url_list or phone_url_list + sms_url_list
+    published = WorkQueue(args.publish_to).publish([{'method': 'DELETE', 'url': delete_url, 'description': delete_url} for delete_url in publish_urls])
+    print('Published {} deletes to {}. Start workqueue_worker.py --queue {} to process them.'.format(published, args.publish_to, args.publish_to))
+    if notification_url_list and (phone_url_list or sms_url_list):
+        print('Only the notification rule deletes were published. Run the script again with --publish-to once the workers are done to publish the phone and sms deletes.')
+    sys.exit()
+
+# transient errors are retried, the deletes which still fail are saved for redrive_dead_letters.py
+session = requests.Session()
+session.headers.update(header)
+dead_letters = DeadLetterFile(args.dead_letter_file or default_dead_letter_path('remove_users_phone_and_sms_numbers'))
+sender = RetryingSender(session, dead_letters)
+
+# run the delete requests for the URLs collected above. the notification rules are deleted (all of them)
+# before the contact methods they depend on
+with ThreadPoolExecutor(max_workers=workers) as pool:
+    if notification_url_list:
+        list(pool.map(delete, notification_url_list))
+    else:
+        print('No Notification rules using phone or SMS numbers found on account')
+
+    if phone_url_list or sms_url_list:
+        list(pool.map(delete, phone_url_list + sms_url_list))
+    else:
+        print('No Phone or SMS numbers found on account on any user')
 
 # print come fancy stats on terminal
-print('total users scanned: {}\ntotal phone notifications deleted: {}\ntotal sms notifications deleted: {} \
-    \n'.format(total_scanned,total_phone_updates,total_sms_updates))
-print('script run completed')
\ No newline at end of file
+print('total users scanned: {}\ntotal notification rules deleted: {}\ntotal phone notifications deleted: {}\ntotal sms notifications deleted: {} \
+    \n'.format(total_scanned,total_notification_updates,total_phone_updates,total_sms_updates))
+if dead_letters.count:
+    print('{} deletes failed and were saved in {}. Replay them with redrive_dead_letters.py'.format(dead_letters.count, dead_letters.path))
+print('script run completed')
@@ -4,11 +4,30 @@
 # TODO: exception handling when no/invalid api_token is passed
 #       minor tweaks :)
 
+import argparse
 import requests
-import json
+import os
+import sys
+
+# make the shared helpers in the repository root importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from pd_common import planner
+from pd_common.jsoncodec import decode_response
+from pd_common.retry import DeadLetterFile, RetryingSender, default_dead_letter_path
+from pd_common.workqueue import WorkQueue
 
 # account definitions
 api_token = 'xxx'
+
+parser = argparse.ArgumentParser(description='Add a .invalid suffix to the email contact methods of all users.')
+parser.add_argument('-k', '--api-key', default=api_token, help='api key with write access from the account owner. default the api_token set in the script')
+parser.add_argument('--plan', action='store_true', help='only estimate the requests and run time from the first page of users. nothing is changed')
+parser.add_argument('--rate-budget', type=float, default=planner.DEFAULT_RATE_BUDGET, help='requests per minute allowed for the api key, used by --plan. default {}'.format(planner.DEFAULT_RATE_BUDGET))
+parser.add_argument('--dead-letter-file', help='file the failed updates are saved to. default dead_letters_update_users_contact_emails_<utc timestamp>.jsonl, one file per run')
+parser.add_argument('--publish-to', metavar='QUEUE', help='publish the updates to a shared work queue file instead of sending them. run workqueue_worker.py against the same file to process them')
+args = parser.parse_args()
+api_token = args.api_key
+
 url = 'https://api.pagerduty.com/users'
 header =    {
                 'Accept':'application/vnd.pagerduty+json;version=2',
@@ -24,11 +43,31 @@ offset = 0
 # maintain a count
 total_scanned,total_updates = 0, 0
 
+# the updates collected for --publish-to
+mutations = []
+
+# transient errors are retried, the updates which still fail are saved for redrive_dead_letters.py
+session = requests.Session()
+session.headers.update(header)
+dead_letters = DeadLetterFile(args.dead_letter_file or default_dead_letter_path('update_users_contact_emails'))
+sender = RetryingSender(session, dead_letters)
+
+# one probe request - the email contact methods without the .invalid suffix on the first page are extrapolated
+# to all the users
+if args.plan:
+    first_page, latency = planner.probe(session, url, {'include[]': 'contact_methods'})
+    total_users = first_page.get('total') or len(first_page['users'])
+    first_page_updates = sum(contact_method['type'] == 'email_contact_method' and contact_method['address'][-8:] != '.invalid'
+                             for user in first_page['users'] for contact_method in user['contact_methods'])
+    to_change = planner.extrapolate(first_page_updates, len(first_page['users']), total_users)
+    planner.print_plan(total_users, to_change, planner.list_requests_for(total_users, limit), to_change, 1, 1, latency, args.rate_budget)
+    sys.exit()
+
 while True:
     params = {'include[]': 'contact_methods', 'limit': limit, 'offset': offset}
 
     # Get the list of users from PD with their contact emails and convert it to JSON
-    users_list = json.loads(requests.get(url, params=params, headers=header).text)
+    users_list = decode_response(requests.get(url, params=params, headers=header))
 
     for user in users_list['users']:
         # working example: print(users_list['users'][0]['contact_methods'][0]['address'])
@@ -66,13 +105,18 @@ while True:
                 # form the new url for the api request
                 update_url = url + '/{}/contact_methods/{}'.format(uid,current_contact_method_id)
 
-                # fire the request. for some reason had to convert payload to str
-                response = requests.put(update_url, headers=header, data=str(payload))
+                mutation = {'method': 'PUT', 'url': update_url, 'json': payload, 'description': current_contact_method_email}
+                if args.publish_to:
+                    mutations.append(mutation)
+                    continue
+
+                # fire the request
+                response = sender.send(mutation)
 
-                if response.status_code == 200:
+                if response is not None and response.status_code == 200:
                     print('SUCCESS - ' + current_contact_method_email + '.invalid')
                 else:   
-                    print('FAILED - ' + current_contact_method_email + ' - ' + response.text)
+                    print('FAILED - ' + current_contact_method_email + ' - ' + (response.text if response is not None else 'no response'))
                 print('\n')
     
     # condition to break out of infinite while loop
@@ -81,5 +125,12 @@ while True:
     else:
         break
 
+# hand the updates over to the workers of the shared queue
+if args.publish_to:
+    published = WorkQueue(args.publish_to).publish(mutations)
+    print('Published {} updates to {}. Start workqueue_worker.py --queue {} to process them.'.format(published, args.publish_to, args.publish_to))
+
 # print stats on cli
-print('Total contact methods scanned: {}\nTotal contact methods changed: {}\nTotal pages fetched: {}'.format(str(total_scanned),str(total_updates),str((offset//limit)+1)))
\ No newline at end of file
+print('Total contact methods scanned: {}\nTotal contact methods changed: {}\nTotal pages fetched: {}'.format(str(total_scanned),str(total_updates),str((offset//limit)+1)))
+if dead_letters.count:
+    print('Failed updates saved in file - {}. Replay them with redrive_dead_letters.py'.format(dead_letters.path))
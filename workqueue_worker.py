@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# worker for the shared mutation queue filled by the mass update scripts with --publish-to
+# start as many of these as needed, on one or more hosts and with different api keys - every worker leases its
+# own batch of mutations, sends them concurrently through the retrying sender and acknowledges them one by one.
+# the worker exits once the queue has no pending or leased work left
+
+import argparse
+import os
+import socket
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from pd_common.retry import DeadLetterFile, RetryingSender
+from pd_common.workqueue import WorkQueue
+
+parser = argparse.ArgumentParser(description='Pull mutations from a shared work queue and send them to PagerDuty.')
+parser.add_argument('-q', '--queue', required=True, type=str, help='queue file written by --publish-to.')
+parser.add_argument('-k', '--api-key', required=True, type=str, help='REST API key with write access from the account.')
+parser.add_argument('--from-email', type=str, help='email of a valid user in the account. required for incident updates.')
+parser.add_argument('-w', '--workers', type=int, default=4, help='mutations sent concurrently by this worker. default 4')
+parser.add_argument('-b', '--batch-size', type=int, default=50, help='mutations leased at once. default 50')
+parser.add_argument('--lease-seconds', type=int, help='seconds before a mutation of a stuck worker goes back to the queue. default the longest time one mutation can take with all its retries')
+parser.add_argument('--worker-id', type=str, default=f'{socket.gethostname()}-{os.getpid()}', help='name of this worker in the queue. default host-pid')
+
+args = parser.parse_args()
+
+header =    {
+                'Accept':'application/vnd.pagerduty+json;version=2',
+                'Content-Type': 'application/json',
+                'Authorization':'Token token=' + args.api_key
+            }
+if args.from_email:
+    header['From'] = args.from_email
+
+def process(task):
+    task_id, mutation = task
+    # the lease was taken for the whole batch, renew it for this task so that a slow batch does not hand it out again
+    if not queue.renew(task_id, args.worker_id):
+        print('SKIPPED - lease lost, another worker has it - ' + mutation.get('description', mutation['url']))
+        return None
+
+    response = sender.send(mutation)
+    if response is not None and response.ok:
+        if not queue.ack(task_id, args.worker_id):
+            print('WARNING - lease expired while sending, another worker may send it again - ' + mutation.get('description', mutation['url']))
+        print('SUCCESS - ' + mutation.get('description', mutation['url']))
+        return True
+
+    queue.fail(task_id, args.worker_id, response.text if response is not None else 'no response')
+    print('FAILED - ' + mutation.get('description', mutation['url']))
+    return False
+
+# maintain a count
+total_sent, total_failed, total_skipped = 0, 0, 0
+
+with requests.Session() as session, ThreadPoolExecutor(max_workers=args.workers) as pool:
+    session.headers.update(header)
+    sender = RetryingSender(session, DeadLetterFile(f'dead_letters_{args.worker_id}.jsonl'))
+    # a lease has to outlive the slowest possible send of its task
+    queue = WorkQueue(args.queue, args.lease_seconds or sender.worst_case_seconds())
+
+    while True:
+        tasks = queue.lease(args.worker_id, args.batch_size)
+        if not tasks:
+            # other workers still hold leases - wait around in case one of them dies and its work comes back
+            if queue.counts().get('leased'):
+                time.sleep(5)
+                continue
+            break
+
+        for succeeded in pool.map(process, tasks):
+            if succeeded is None:
+                total_skipped += 1
+            elif succeeded:
+                total_sent += 1
+            else:
+                total_failed += 1
+
+print('worker {} done\ntotal mutations sent: {}\ntotal mutations failed: {}\ntotal mutations skipped (lease lost): {}\nqueue state: {}'.format(
+    args.worker_id, total_sent, total_failed, total_skipped, queue.counts()))